@@ -0,0 +1,58 @@
+"""conversations
+
+Revision ID: 2f8d61c0a9e5
+Revises: 7c3e9a1d2b40
+Create Date: 2026-10-18 11:02:17.284113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f8d61c0a9e5'
+down_revision: Union[str, Sequence[str], None] = '7c3e9a1d2b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'conversations',
+        sa.Column('user_low_id', sa.Integer(), nullable=False),
+        sa.Column('user_high_id', sa.Integer(), nullable=False),
+        sa.Column('last_message_id', sa.Integer(), nullable=True),
+        sa.Column('last_activity', sa.DateTime(), nullable=False),
+        sa.Column('unread_low', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('unread_high', sa.Integer(), nullable=False, server_default='0'),
+        sa.CheckConstraint('user_low_id <= user_high_id', name='ck_conversations_ordered_pair'),
+        sa.ForeignKeyConstraint(['user_low_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_high_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('user_low_id', 'user_high_id')
+    )
+    op.create_index('ix_conversations_low_activity', 'conversations', ['user_low_id', 'last_activity'], unique=False)
+    op.create_index('ix_conversations_high_activity', 'conversations', ['user_high_id', 'last_activity'], unique=False)
+
+    # Backfill one row per pair from the newest message in either direction
+    op.execute("""
+        INSERT INTO conversations (user_low_id, user_high_id, last_message_id, last_activity)
+        SELECT DISTINCT ON (LEAST(sender_id, recipient_id), GREATEST(sender_id, recipient_id))
+            LEAST(sender_id, recipient_id),
+            GREATEST(sender_id, recipient_id),
+            id,
+            COALESCE(timestamp, now())
+        FROM messages
+        ORDER BY LEAST(sender_id, recipient_id), GREATEST(sender_id, recipient_id),
+                 timestamp DESC NULLS LAST, id DESC
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversations_high_activity', table_name='conversations')
+    op.drop_index('ix_conversations_low_activity', table_name='conversations')
+    op.drop_table('conversations')
@@ -0,0 +1,68 @@
+"""groups
+
+Revision ID: 6d2b8e4f1a93
+Revises: f1c6a9d3e852
+Create Date: 2026-10-18 23:12:48.530917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d2b8e4f1a93'
+down_revision: Union[str, Sequence[str], None] = 'f1c6a9d3e852'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'groups',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('created_by', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.Column('last_message_id', sa.Integer(), nullable=True),
+        sa.Column('last_activity', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.ForeignKeyConstraint(['created_by'], ['users.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'group_members',
+        sa.Column('group_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('joined_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.ForeignKeyConstraint(['group_id'], ['groups.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('group_id', 'user_id')
+    )
+    op.create_index('ix_group_members_user', 'group_members', ['user_id', 'group_id'], unique=False)
+
+    # On the partitioned table each of these reaches every partition
+    op.add_column('messages', sa.Column('group_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'messages_group_id_fkey', 'messages', 'groups', ['group_id'], ['id'], ondelete='CASCADE'
+    )
+    op.alter_column('messages', 'recipient_id', existing_type=sa.Integer(), nullable=True)
+    op.create_check_constraint(
+        'ck_messages_recipient_or_group', 'messages', '(recipient_id IS NULL) <> (group_id IS NULL)'
+    )
+    op.create_index('ix_messages_group', 'messages', ['group_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DELETE FROM attachments WHERE message_id IN (SELECT id FROM messages WHERE group_id IS NOT NULL)')
+    op.execute('DELETE FROM messages WHERE group_id IS NOT NULL')
+    op.drop_index('ix_messages_group', table_name='messages')
+    op.drop_constraint('ck_messages_recipient_or_group', 'messages', type_='check')
+    op.alter_column('messages', 'recipient_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_constraint('messages_group_id_fkey', 'messages', type_='foreignkey')
+    op.drop_column('messages', 'group_id')
+    op.drop_index('ix_group_members_user', table_name='group_members')
+    op.drop_table('group_members')
+    op.drop_table('groups')
@@ -0,0 +1,33 @@
+"""messages conversation index
+
+Revision ID: 7c3e9a1d2b40
+Revises: abf6e1484d4f
+Create Date: 2026-10-18 10:12:41.503917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3e9a1d2b40'
+down_revision: Union[str, Sequence[str], None] = 'abf6e1484d4f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_messages_conversation',
+        'messages',
+        ['sender_id', 'recipient_id', 'timestamp', 'id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation', table_name='messages')
@@ -0,0 +1,43 @@
+"""user search indexes
+
+Revision ID: 9b1f4e7a3c52
+Revises: 2f8d61c0a9e5
+Create Date: 2026-10-18 13:41:05.917346
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b1f4e7a3c52'
+down_revision: Union[str, Sequence[str], None] = '2f8d61c0a9e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        'ix_users_username_trgm',
+        'users',
+        ['username'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'username': 'gin_trgm_ops'}
+    )
+    op.create_index(
+        'ix_users_username_lower_prefix',
+        'users',
+        [sa.text('lower(username) text_pattern_ops')],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_username_lower_prefix', table_name='users')
+    op.drop_index('ix_users_username_trgm', table_name='users')
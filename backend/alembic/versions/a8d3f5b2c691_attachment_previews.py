@@ -0,0 +1,30 @@
+"""attachment previews
+
+Revision ID: a8d3f5b2c691
+Revises: e5b7c3a90d14
+Create Date: 2026-10-18 16:02:17.208344
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3f5b2c691'
+down_revision: Union[str, Sequence[str], None] = 'e5b7c3a90d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('attachments', sa.Column('thumbnail_url', sa.String(length=1024), nullable=True))
+    op.add_column('attachments', sa.Column('placeholder', sa.String(length=128), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('attachments', 'placeholder')
+    op.drop_column('attachments', 'thumbnail_url')
@@ -0,0 +1,39 @@
+"""message changes
+
+Revision ID: b3c9f1e06a74
+Revises: d7e2a4c81b36
+Create Date: 2026-10-18 18:05:12.843261
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3c9f1e06a74'
+down_revision: Union[str, Sequence[str], None] = 'd7e2a4c81b36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'message_changes',
+        sa.Column('seq', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('op', sa.String(length=6), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False, server_default=sa.text('now()')),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('seq')
+    )
+    op.create_index('ix_message_changes_user_seq', 'message_changes', ['user_id', 'seq'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_changes_user_seq', table_name='message_changes')
+    op.drop_table('message_changes')
@@ -0,0 +1,39 @@
+"""message search vector
+
+Revision ID: c4a2d8e61f07
+Revises: 9b1f4e7a3c52
+Create Date: 2026-10-18 14:26:53.402771
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a2d8e61f07'
+down_revision: Union[str, Sequence[str], None] = '9b1f4e7a3c52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        'messages',
+        sa.Column(
+            'search_vector',
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('simple', text)", persisted=True),
+            nullable=True
+        )
+    )
+    op.create_index('ix_messages_search_vector', 'messages', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_search_vector', table_name='messages')
+    op.drop_column('messages', 'search_vector')
@@ -0,0 +1,43 @@
+"""read receipts
+
+Revision ID: d7e2a4c81b36
+Revises: a8d3f5b2c691
+Create Date: 2026-10-18 17:21:40.517093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e2a4c81b36'
+down_revision: Union[str, Sequence[str], None] = 'a8d3f5b2c691'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for column in ('last_read_low', 'last_read_high', 'last_delivered_low', 'last_delivered_high'):
+        op.add_column('conversations', sa.Column(column, sa.Integer(), nullable=False, server_default='0'))
+    op.create_index('ix_messages_unread', 'messages', ['recipient_id', 'sender_id', 'id'], unique=False)
+
+    # Counters were never reset before receipts existed: history up to now counts as read
+    op.execute("""
+        UPDATE conversations
+        SET last_read_low = COALESCE(last_message_id, 0),
+            last_read_high = COALESCE(last_message_id, 0),
+            last_delivered_low = COALESCE(last_message_id, 0),
+            last_delivered_high = COALESCE(last_message_id, 0),
+            unread_low = 0,
+            unread_high = 0
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_unread', table_name='messages')
+    for column in ('last_delivered_high', 'last_delivered_low', 'last_read_high', 'last_read_low'):
+        op.drop_column('conversations', column)
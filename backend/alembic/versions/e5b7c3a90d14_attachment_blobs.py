@@ -0,0 +1,50 @@
+"""attachment blobs
+
+Revision ID: e5b7c3a90d14
+Revises: c4a2d8e61f07
+Create Date: 2026-10-18 15:08:44.631920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b7c3a90d14'
+down_revision: Union[str, Sequence[str], None] = 'c4a2d8e61f07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('attachments', sa.Column('sha256', sa.String(length=64), nullable=False, server_default=''))
+    op.alter_column('attachments', 'sha256', server_default=None)
+    op.add_column('attachments', sa.Column('uploader_id', sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        'attachments_uploader_id_fkey', 'attachments', 'users', ['uploader_id'], ['id'], ondelete='CASCADE'
+    )
+    op.alter_column('attachments', 'message_id', existing_type=sa.Integer(), nullable=True)
+    op.alter_column(
+        'attachments', 'content_type', existing_type=sa.String(length=50), type_=sa.String(length=255)
+    )
+    op.create_index('ix_attachments_sha256', 'attachments', ['sha256'], unique=False)
+    op.create_index('ix_attachments_uploader_id', 'attachments', ['uploader_id'], unique=False)
+    op.create_index('ix_attachments_message_id', 'attachments', ['message_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_attachments_message_id', table_name='attachments')
+    op.drop_index('ix_attachments_uploader_id', table_name='attachments')
+    op.drop_index('ix_attachments_sha256', table_name='attachments')
+    op.execute("DELETE FROM attachments WHERE message_id IS NULL")
+    op.alter_column(
+        'attachments', 'content_type', existing_type=sa.String(length=255), type_=sa.String(length=50)
+    )
+    op.alter_column('attachments', 'message_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_constraint('attachments_uploader_id_fkey', 'attachments', type_='foreignkey')
+    op.drop_column('attachments', 'uploader_id')
+    op.drop_column('attachments', 'sha256')
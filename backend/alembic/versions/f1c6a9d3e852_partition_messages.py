@@ -0,0 +1,118 @@
+"""partition messages
+
+Revision ID: f1c6a9d3e852
+Revises: b3c9f1e06a74
+Create Date: 2026-10-18 21:40:37.215904
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c6a9d3e852'
+down_revision: Union[str, Sequence[str], None] = 'b3c9f1e06a74'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Months created past the current one, like MESSAGE_PARTITION_MONTHS_AHEAD
+MONTHS_AHEAD = 3
+
+MESSAGE_INDEXES = (
+    ('ix_messages_conversation', ['sender_id', 'recipient_id', 'timestamp', 'id'], {}),
+    ('ix_messages_unread', ['recipient_id', 'sender_id', 'id'], {}),
+    ('ix_messages_search_vector', ['search_vector'], {'postgresql_using': 'gin'}),
+)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_messages_table(name: str, partitioned: bool) -> None:
+    op.execute(f"""
+        CREATE TABLE {name} (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+            text text NOT NULL,
+            timestamp timestamp without time zone NOT NULL DEFAULT now(),
+            search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED,
+            sender_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            recipient_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            CONSTRAINT {name}_pkey PRIMARY KEY ({'id, timestamp' if partitioned else 'id'})
+        ){' PARTITION BY RANGE (timestamp)' if partitioned else ''}
+    """)
+
+
+def replace_messages_table(partitioned: bool) -> None:
+    """
+    Copies messages into a new table, partitioned or not, and swaps it in.
+    The id sequence is handed over to the new table.
+    """
+    for name, _, _ in MESSAGE_INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
+    op.execute('DROP INDEX IF EXISTS ix_messages_id')
+    op.execute('ALTER SEQUENCE messages_id_seq OWNED BY NONE')
+    create_messages_table('messages_new', partitioned)
+
+    if partitioned:
+        # One partition per month from the oldest message to a few months from now
+        bind = op.get_bind()
+        oldest, newest = bind.execute(sa.text(
+            "SELECT min(timestamp)::date, max(timestamp)::date FROM messages"
+        )).one()
+        today = date.today()
+        oldest = oldest or today
+        newest = max(newest or today, today)
+        month = date(oldest.year, oldest.month, 1)
+        last = add_months(date(newest.year, newest.month, 1), MONTHS_AHEAD)
+        while month <= last:
+            op.execute(
+                f"CREATE TABLE messages_{month:%Y_%m} PARTITION OF messages_new "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            )
+            month = add_months(month, 1)
+
+    op.execute("""
+        INSERT INTO messages_new (id, text, timestamp, sender_id, recipient_id)
+        SELECT id, text, COALESCE(timestamp, now()), sender_id, recipient_id FROM messages
+    """)
+    op.execute('DROP TABLE messages')
+    op.execute('ALTER TABLE messages_new RENAME TO messages')
+    for constraint in ('pkey', 'sender_id_fkey', 'recipient_id_fkey'):
+        op.execute(f'ALTER TABLE messages RENAME CONSTRAINT messages_new_{constraint} TO messages_{constraint}')
+    op.execute('ALTER SEQUENCE messages_id_seq OWNED BY messages.id')
+
+    # Built once the rows are in; on the partitioned table each partition gets its own
+    for name, columns, kwargs in MESSAGE_INDEXES:
+        op.create_index(name, 'messages', columns, unique=False, **kwargs)
+    if not partitioned:
+        op.create_index('ix_messages_id', 'messages', ['id'], unique=False)
+    op.execute('ANALYZE messages')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # A partitioned table's primary key has to include the partition key,
+    # so nothing can reference messages.id alone any more
+    op.drop_constraint('conversations_last_message_id_fkey', 'conversations', type_='foreignkey')
+    op.drop_constraint('attachments_message_id_fkey', 'attachments', type_='foreignkey')
+    replace_messages_table(partitioned=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    replace_messages_table(partitioned=False)
+    # Rows whose message was archived would break the foreign keys
+    op.execute('UPDATE conversations SET last_message_id = NULL WHERE last_message_id NOT IN (SELECT id FROM messages)')
+    op.execute('UPDATE attachments SET message_id = NULL WHERE message_id NOT IN (SELECT id FROM messages)')
+    op.create_foreign_key(
+        'attachments_message_id_fkey', 'attachments', 'messages', ['message_id'], ['id'], ondelete='CASCADE'
+    )
+    op.create_foreign_key(
+        'conversations_last_message_id_fkey', 'conversations', 'messages', ['last_message_id'], ['id'],
+        ondelete='SET NULL'
+    )
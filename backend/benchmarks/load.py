@@ -0,0 +1,527 @@
+"""
+Load test of the app in main.py over real HTTP and WebSocket connections.
+
+    python -m benchmarks.load [--users 1000] [--contacts 10] [--messages-per-chat 100]
+        [--scenarios login,history,contacts,chat,idle] [--requests 2000] [--concurrency 50]
+        [--sockets 1000] [--chat-messages 10] [--idle-seconds 10] [--url http://host:port]
+        [--output result.json]
+
+Needs the database from core/config.py with the migrations applied: the compose
+"db" service, or any local PostgreSQL reached through the POSTGRES_* variables.
+Use a scratch database, the synthetic users and messages are written to the real
+tables. Seeding is skipped when the data for the requested scale already exists.
+
+By default the app runs in-process under uvicorn, sharing the event loop with the
+clients. Pass --url to drive a server started separately instead (e.g. with several
+workers); it must use the same SECRET_KEY and database, and have the MESSAGE_RATE_*
+limits raised or set to 0. Thousands of sockets need a matching `ulimit -n`.
+
+Scenarios:
+    login     POST /users/login with the seeded password (bcrypt bound)
+    history   GET /messages/{user}/{peer}, scrolling back up to --pages pages
+    contacts  GET /messages/contacts
+    chat      --sockets sessions on /ws/session each sending --chat-messages
+              messages to a peer: latency until the ack and until the peer has it
+    idle      --sockets sessions on /ws/session kept open and silent for --idle-seconds,
+              sampling the pool's checked out connections (from /metrics) and the
+              busy backends in pg_stat_activity: both should stay at their baseline,
+              an idle socket holds no DB connection
+
+Prints one JSON document, written to --output too, with per scenario throughput,
+latency percentiles in milliseconds and DB statements per operation, taken from
+the db_query_duration_seconds counts on /metrics.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+# The clients send as fast as they can: no message rate limits in-process unless asked for
+os.environ.setdefault("MESSAGE_RATE_PER_USER", "0")
+os.environ.setdefault("MESSAGE_RATE_PER_CONNECTION", "0")
+
+import httpx
+import uvicorn
+import websockets
+from sqlalchemy import text
+
+from core import create_access_token, engine
+from core.security import hash_password
+from services.partitions import ensure_partitions
+
+BENCH_USER_PREFIX = "bench_load_"
+BENCH_PASSWORD = "benchmark-password"
+SCENARIOS = ("login", "history", "contacts", "chat", "idle")
+# How often the idle scenario samples DB connection usage, in seconds
+IDLE_SAMPLE_INTERVAL = 0.5
+
+
+async def seed(users: int, contacts: int, per_chat: int) -> List[int]:
+    """
+    Creates `users` users, each chatting with the next `contacts` users (wrapping around),
+    with `per_chat` messages per chat, one minute apart, and the matching conversations.
+    Returns the user ids.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            INSERT INTO users (username, email, password_hash, created_at)
+            SELECT :prefix || g, :prefix || g || '@bench.local', :password_hash, now()
+            FROM generate_series(1, :users) AS g
+            ON CONFLICT DO NOTHING
+        """), {"prefix": BENCH_USER_PREFIX, "users": users, "password_hash": hash_password(BENCH_PASSWORD)})
+        user_ids = (await conn.execute(text("""
+            SELECT id FROM users
+            WHERE starts_with(username, :prefix) AND substr(username, length(:prefix) + 1)::int <= :users
+            ORDER BY substr(username, length(:prefix) + 1)::int
+        """), {"prefix": BENCH_USER_PREFIX, "users": users})).scalars().all()
+        existing = (await conn.execute(text(
+            "SELECT count(*) FROM messages WHERE sender_id = ANY(CAST(:ids AS integer[]))"
+        ), {"ids": user_ids})).scalar()
+
+    if existing >= users * contacts * per_chat:
+        return user_ids
+
+    await ensure_partitions(since=date.today() - timedelta(days=per_chat // 1440 + 1))
+
+    # One transaction per slice of users, their chats with the following users
+    for start in range(0, users, 100):
+        async with engine.begin() as conn:
+            await conn.execute(text("""
+                INSERT INTO messages (text, timestamp, sender_id, recipient_id)
+                SELECT
+                    'bench message ' || m,
+                    now() - (:per_chat - m) * interval '1 minute',
+                    CASE WHEN m % 2 = 0 THEN ids[1 + i] ELSE ids[1 + (i + k) % :users] END,
+                    CASE WHEN m % 2 = 0 THEN ids[1 + (i + k) % :users] ELSE ids[1 + i] END
+                FROM (SELECT CAST(:ids AS integer[]) AS ids) AS bench,
+                     generate_series(:start, least(:start + 99, :users - 1)) AS i,
+                     generate_series(1, :contacts) AS k,
+                     generate_series(1, :per_chat) AS m
+            """), {"ids": user_ids, "users": users, "contacts": contacts, "per_chat": per_chat, "start": start})
+
+    async with engine.begin() as conn:
+        # Everything seeded counts as read and delivered
+        await conn.execute(text("""
+            INSERT INTO conversations (
+                user_low_id, user_high_id, last_message_id, last_activity, unread_low, unread_high,
+                last_read_low, last_read_high, last_delivered_low, last_delivered_high
+            )
+            SELECT least(sender_id, recipient_id), greatest(sender_id, recipient_id), max(id), max(timestamp), 0, 0,
+                   max(id), max(id), max(id), max(id)
+            FROM messages
+            WHERE sender_id = ANY(CAST(:ids AS integer[]))
+            GROUP BY 1, 2
+            ON CONFLICT (user_low_id, user_high_id) DO NOTHING
+        """), {"ids": user_ids})
+        await conn.execute(text("ANALYZE users"))
+        await conn.execute(text("ANALYZE messages"))
+        await conn.execute(text("ANALYZE conversations"))
+    return user_ids
+
+
+def summarize(timings: List[float], errors: int, elapsed: float, queries: Optional[float]) -> dict:
+    timings = sorted(timings)
+    operations = len(timings)
+    return {
+        "operations": operations,
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "throughput_per_s": round(operations / elapsed, 1) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(statistics.median(timings), 2),
+            "p99": round(timings[max(0, int(len(timings) * 0.99) - 1)], 2),
+            "max": round(timings[-1], 2),
+        } if timings else None,
+        "db_queries_per_op": round(queries / operations, 2) if queries is not None and operations else None,
+    }
+
+
+async def metric_value(client: httpx.AsyncClient, sample: str) -> Optional[float]:
+    """
+    The value of one sample on /metrics, e.g. 'db_pool_connections{state="checked_out"}'.
+    """
+    try:
+        response = await client.get("/metrics")
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    for line in response.text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+async def busy_backends() -> int:
+    """
+    Connections to the app's database running a statement or inside a transaction,
+    other than the one asking. Idle pooled connections are not counted.
+    """
+    async with engine.connect() as conn:
+        return (await conn.execute(text("""
+            SELECT count(*) FROM pg_stat_activity
+            WHERE datname = current_database() AND pid <> pg_backend_pid()
+              AND backend_type = 'client backend' AND state <> 'idle'
+        """))).scalar()
+
+
+async def query_count(client: httpx.AsyncClient) -> Optional[float]:
+    """
+    Statements run so far, summed over the db_query_duration_seconds histogram.
+    With several workers behind --url this is the count of whichever worker answered.
+    """
+    try:
+        response = await client.get("/metrics")
+        response.raise_for_status()
+    except httpx.HTTPError:
+        return None
+    return sum(
+        float(line.rsplit(" ", 1)[1])
+        for line in response.text.splitlines()
+        if line.startswith("db_query_duration_seconds_count")
+    )
+
+
+async def measure(
+    client: httpx.AsyncClient,
+    operation: Callable[[int], Awaitable[None]],
+    requests: int,
+    concurrency: int
+) -> dict:
+    """
+    Runs `operation(worker)` `requests` times over `concurrency` workers.
+    """
+    timings: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker(index: int):
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await operation(index)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            timings.append((time.perf_counter() - start) * 1000)
+
+    queries_before = await query_count(client)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    queries_after = await query_count(client)
+    queries = queries_after - queries_before if queries_before is not None and queries_after is not None else None
+    return summarize(timings, errors, elapsed, queries)
+
+
+def auth(user_id: int) -> Dict[str, str]:
+    return {"Authorization": "Bearer " + create_access_token({"sub": f"bench-{user_id}", "uid": user_id})}
+
+
+async def login_scenario(client: httpx.AsyncClient, user_ids: List[int], args) -> dict:
+    rng = random.Random(1)
+
+    async def login(worker: int):
+        number = rng.randint(1, len(user_ids))
+        response = await client.post("/users/login", data={
+            "username": f"{BENCH_USER_PREFIX}{number}", "password": BENCH_PASSWORD
+        })
+        response.raise_for_status()
+
+    return await measure(client, login, args.requests, args.concurrency)
+
+
+async def history_scenario(client: httpx.AsyncClient, user_ids: List[int], args) -> dict:
+    """
+    Every worker opens a random chat at its newest page and scrolls back through it,
+    one operation per page, until it has read --pages pages or reached the start.
+    """
+    rng = random.Random(2)
+    scrolls: Dict[int, dict] = {}
+    headers = {user_id: auth(user_id) for user_id in user_ids}
+
+    async def next_page(worker: int):
+        scroll = scrolls.get(worker)
+        if scroll is None or scroll["pages"] >= args.pages or not scroll["cursor"]:
+            index = rng.randrange(len(user_ids))
+            peer = user_ids[(index + rng.randint(1, args.contacts)) % len(user_ids)]
+            scroll = scrolls[worker] = {"user": user_ids[index], "peer": peer, "cursor": None, "pages": 0}
+        params = {"limit": args.page_size}
+        if scroll["cursor"]:
+            params["before"] = scroll["cursor"]
+        response = await client.get(
+            f"/messages/{scroll['user']}/{scroll['peer']}", params=params, headers=headers[scroll["user"]]
+        )
+        response.raise_for_status()
+        scroll["cursor"] = response.json()["next_cursor"]
+        scroll["pages"] += 1
+
+    return await measure(client, next_page, args.requests, args.concurrency)
+
+
+async def contacts_scenario(client: httpx.AsyncClient, user_ids: List[int], args) -> dict:
+    rng = random.Random(3)
+    headers = {user_id: auth(user_id) for user_id in user_ids}
+
+    async def contacts(worker: int):
+        user_id = rng.choice(user_ids)
+        response = await client.get(
+            "/messages/contacts", params={"limit": args.page_size}, headers=headers[user_id]
+        )
+        response.raise_for_status()
+
+    return await measure(client, contacts, args.requests, args.concurrency)
+
+
+async def chat_scenario(client: httpx.AsyncClient, user_ids: List[int], args) -> dict:
+    """
+    Opens one session per user for the first --sockets users. Each sends --chat-messages
+    messages to the next user, carrying the send time in the text, and listens until it
+    has its acks and the messages of the previous user.
+    """
+    sockets = min(args.sockets, len(user_ids))
+    ws_url = args.url.replace("http", "ws", 1) + "/ws/session"
+    expected = args.chat_messages
+    connect_timings: List[float] = []
+    ack_timings: List[float] = []
+    delivery_timings: List[float] = []
+    errors = 0
+    ready = asyncio.Event()
+    connected = 0
+
+    async def session(index: int):
+        nonlocal connected, errors
+        user_id = user_ids[index]
+        peer_id = user_ids[(index + 1) % sockets]
+        token = create_access_token({"sub": f"bench-{user_id}", "uid": user_id})
+        start = time.perf_counter()
+        async with websockets.connect(f"{ws_url}?token={token}", max_size=None, open_timeout=60) as ws:
+            connect_timings.append((time.perf_counter() - start) * 1000)
+            connected += 1
+            if connected == sockets:
+                ready.set()
+            # Nobody sends before every socket is up, or early messages would miss their peer
+            await ready.wait()
+
+            sent: Dict[str, float] = {}
+            for number in range(expected):
+                client_id = f"{user_id}:{number}"
+                sent[client_id] = time.perf_counter()
+                await ws.send(json.dumps({
+                    "action": "add",
+                    "client_id": client_id,
+                    "message": {"recipient_id": peer_id, "text": f"bench {sent[client_id]:.6f}"},
+                }))
+
+            acks = received = 0
+            while acks < expected or received < expected:
+                event = json.loads(await asyncio.wait_for(ws.recv(), args.timeout))
+                action = event.get("action")
+                if action == "ack":
+                    ack_timings.append((time.perf_counter() - sent[event["client_id"]]) * 1000)
+                    acks += 1
+                elif action == "add" and event["message"]["recipient_id"] == user_id:
+                    sent_at = float(event["message"]["text"].split()[1])
+                    delivery_timings.append((time.perf_counter() - sent_at) * 1000)
+                    received += 1
+                elif action == "error":
+                    errors += 1
+                    acks += 1
+
+    async def guarded(index: int):
+        nonlocal connected, errors
+        try:
+            await session(index)
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+            errors += 1
+            # A socket that never came up must not hold the others back
+            connected += 1
+            if connected >= sockets:
+                ready.set()
+
+    queries_before = await query_count(client)
+    start = time.perf_counter()
+    await asyncio.gather(*(guarded(i) for i in range(sockets)))
+    elapsed = time.perf_counter() - start
+    queries_after = await query_count(client)
+    queries = queries_after - queries_before if queries_before is not None and queries_after is not None else None
+
+    result = summarize(ack_timings, errors, elapsed, queries)
+    result["sockets"] = sockets
+    result["connect_ms"] = summarize(connect_timings, 0, elapsed, None)["latency_ms"]
+    result["delivery_ms"] = summarize(delivery_timings, 0, elapsed, None)["latency_ms"]
+    result["delivered"] = len(delivery_timings)
+    return result
+
+
+async def idle_scenario(client: httpx.AsyncClient, user_ids: List[int], args) -> dict:
+    """
+    Opens one session per user for the first --sockets users and keeps them all open
+    without sending anything for --idle-seconds, while sampling DB connection usage.
+    `held_connections` is how far the samples went above the baseline taken before
+    the first socket was opened: 0 means the sockets hold no DB connection. A presence
+    beacon published through the postgres broker borrows one for a single statement,
+    so a sample may occasionally catch one.
+    """
+    sockets = min(args.sockets, len(user_ids))
+    ws_url = args.url.replace("http", "ws", 1) + "/ws/session"
+    checked_out = 'db_pool_connections{state="checked_out"}'
+    connect_timings: List[float] = []
+    errors = 0
+    opened = asyncio.Event()
+    release = asyncio.Event()
+    settled = 0
+
+    async def session(index: int):
+        nonlocal settled, errors
+        user_id = user_ids[index]
+        token = create_access_token({"sub": f"bench-{user_id}", "uid": user_id})
+        start = time.perf_counter()
+        try:
+            async with websockets.connect(f"{ws_url}?token={token}", max_size=None, open_timeout=60) as ws:
+                connect_timings.append((time.perf_counter() - start) * 1000)
+                settled += 1
+                if settled == sockets:
+                    opened.set()
+                await release.wait()
+                # Open and closed cleanly: nothing went wrong while it sat idle
+                await ws.close()
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+            errors += 1
+            settled += 1
+            if settled >= sockets:
+                opened.set()
+
+    baseline_pool = await metric_value(client, checked_out)
+    baseline_backends = await busy_backends()
+    tasks = [asyncio.create_task(session(i)) for i in range(sockets)]
+    await opened.wait()
+
+    queries_before = await query_count(client)
+    pool_samples: List[float] = []
+    backend_samples: List[int] = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.idle_seconds:
+        sample = await metric_value(client, checked_out)
+        if sample is not None:
+            pool_samples.append(sample)
+        backend_samples.append(await busy_backends())
+        await asyncio.sleep(IDLE_SAMPLE_INTERVAL)
+    elapsed = time.perf_counter() - start
+    queries_after = await query_count(client)
+
+    release.set()
+    await asyncio.gather(*tasks)
+
+    return {
+        "sockets": sockets,
+        "open": len(connect_timings),
+        "errors": errors,
+        "seconds": round(elapsed, 2),
+        "connect_ms": summarize(connect_timings, 0, elapsed, None)["latency_ms"],
+        "pool_checked_out": {
+            "baseline": baseline_pool,
+            "max": max(pool_samples) if pool_samples else None,
+        },
+        "busy_backends": {
+            "baseline": baseline_backends,
+            "max": max(backend_samples) if backend_samples else None,
+        },
+        "held_connections": max(
+            max(pool_samples, default=0) - (baseline_pool or 0),
+            max(backend_samples, default=0) - baseline_backends,
+            0
+        ),
+        "db_queries_while_idle": (
+            queries_after - queries_before if queries_before is not None and queries_after is not None else None
+        ),
+    }
+
+
+SCENARIO_RUNNERS = {
+    "login": login_scenario,
+    "history": history_scenario,
+    "contacts": contacts_scenario,
+    "chat": chat_scenario,
+    "idle": idle_scenario,
+}
+
+
+async def run(args) -> dict:
+    user_ids = await seed(args.users, args.contacts, args.messages_per_chat)
+
+    server = None
+    server_task = None
+    if not args.url:
+        from main import app
+
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            if server_task.done():
+                server_task.result()
+            await asyncio.sleep(0.05)
+        args.url = f"http://127.0.0.1:{args.port}"
+
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+            for name in args.scenarios:
+                results[name] = await SCENARIO_RUNNERS[name](client, user_ids, args)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            await server_task
+        await engine.dispose()
+
+    return {
+        "users": args.users,
+        "contacts": args.contacts,
+        "messages_per_chat": args.messages_per_chat,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "in_process": server is not None,
+        "scenarios": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--contacts", type=int, default=10)
+    parser.add_argument("--messages-per-chat", type=int, default=100)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--chat-messages", type=int, default=10)
+    parser.add_argument("--idle-seconds", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--url", help="Server to drive instead of running the app in-process")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    if not 0 < args.contacts < args.users / 2:
+        # Otherwise a pair would be seeded twice, once from each side
+        parser.error("--contacts must be positive and below half of --users")
+
+    result = json.dumps(asyncio.run(run(args)), indent=2)
+    print(result)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(result + "\n")
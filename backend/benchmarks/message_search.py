@@ -0,0 +1,119 @@
+"""
+Benchmark of GET /messages/search on a synthetic corpus.
+
+    python -m benchmarks.message_search [--messages 10000000] [--users 10000] [--queries 200]
+
+Needs the database from core/config.py with the migrations applied; use a
+scratch database, the corpus is written to the real tables. Seeding is skipped
+when enough synthetic messages already exist. Prints one JSON document with
+latency percentiles in milliseconds and the plan of one sample query.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+from sqlalchemy import text
+
+from core import AsyncSessionLocal, engine
+from routers.messages import search_messages
+from services.partitions import ensure_partitions
+
+BENCH_USER_PREFIX = "bench_search_"
+VOCABULARY = [
+    "meeting", "deploy", "lunch", "invoice", "release", "weekend", "coffee", "review", "deadline",
+    "birthday", "ticket", "backup", "holiday", "budget", "roadmap", "standup", "incident", "photo",
+    "concert", "migration", "postgres", "football", "contract", "airport", "dinner", "password",
+]
+
+
+async def seed(messages: int, users: int, batch: int = 500_000):
+    # The corpus spreads over the past year, every month of it needs its partition
+    await ensure_partitions(since=date.today() - timedelta(days=366))
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            INSERT INTO users (username, email, password_hash, created_at)
+            SELECT :prefix || g, :prefix || g || '@bench.local', 'x', now()
+            FROM generate_series(1, :users) AS g
+            ON CONFLICT DO NOTHING
+        """), {"prefix": BENCH_USER_PREFIX, "users": users})
+        bounds = (await conn.execute(text(
+            "SELECT min(id), max(id) FROM users WHERE username LIKE :prefix || '%'"
+        ), {"prefix": BENCH_USER_PREFIX})).one()
+        existing = (await conn.execute(text(
+            "SELECT count(*) FROM messages WHERE sender_id BETWEEN :low AND :high"
+        ), {"low": bounds[0], "high": bounds[1]})).scalar()
+
+    low, high = bounds
+    remaining = messages - existing
+    while remaining > 0:
+        size = min(batch, remaining)
+        # Each message is 6 to 14 random words, ids are spread over the synthetic users
+        async with engine.begin() as conn:
+            await conn.execute(text("""
+                INSERT INTO messages (text, timestamp, sender_id, recipient_id)
+                SELECT
+                    (SELECT string_agg(w[1 + floor(random() * array_length(w, 1))::int], ' ')
+                     FROM generate_series(1, 6 + (g % 9))),
+                    now() - (random() * interval '365 days'),
+                    :low + floor(random() * (:high - :low + 1))::int,
+                    :low + floor(random() * (:high - :low + 1))::int
+                FROM generate_series(1, :size) AS g, (SELECT CAST(:words AS text[]) AS w) AS vocabulary
+            """), {"low": low, "high": high, "size": size, "words": VOCABULARY})
+        remaining -= size
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE messages"))
+    return low, high
+
+
+async def run(messages: int, users: int, queries: int) -> dict:
+    low, high = await seed(messages, users)
+    rng = random.Random(42)
+    timings = []
+    async with AsyncSessionLocal() as db:
+        for _ in range(queries):
+            terms = " ".join(rng.sample(VOCABULARY, rng.randint(1, 2)))
+            user_id = rng.randint(low, high)
+            start = time.perf_counter()
+            page = await search_messages(q=terms, cursor=None, limit=20, user_id=user_id, db=db)
+            if page["next_cursor"]:
+                await search_messages(q=terms, cursor=page["next_cursor"], limit=20, user_id=user_id, db=db)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        plan = await db.execute(text("""
+            EXPLAIN (ANALYZE, BUFFERS, FORMAT TEXT)
+            SELECT id FROM messages
+            WHERE search_vector @@ websearch_to_tsquery('simple', 'deploy incident')
+              AND (sender_id = :user_id OR recipient_id = :user_id)
+            ORDER BY ts_rank_cd(search_vector, websearch_to_tsquery('simple', 'deploy incident')) DESC, id DESC
+            LIMIT 21
+        """), {"user_id": low})
+        sample_plan = [row[0] for row in plan]
+
+    timings.sort()
+    return {
+        "messages": messages,
+        "users": users,
+        "queries": queries,
+        "two_pages_ms": {
+            "p50": round(statistics.median(timings), 2),
+            "p99": round(timings[int(len(timings) * 0.99) - 1], 2),
+            "max": round(timings[-1], 2),
+        },
+        "sample_plan": sample_plan,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.messages, args.users, args.queries)), indent=2))
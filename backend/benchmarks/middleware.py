@@ -0,0 +1,96 @@
+"""
+Requests per second through the pure ASGI JWTMiddleware against the previous
+BaseHTTPMiddleware implementation, on an app with a single authenticated route.
+
+    python -m benchmarks.middleware [--requests 5000] [--concurrency 50]
+
+Prints one JSON document with requests per second for each implementation.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from core.auth import create_access_token, verify_token
+from core.middleware import JWTMiddleware
+
+LEGACY_OPEN_ROUTES = ["/users/login", "/users/register", "/docs", "/openapi.json", "/users", "/ws"]
+
+
+class LegacyJWTMiddleware(BaseHTTPMiddleware):
+    """
+    The middleware as it was before the rewrite, kept here as the baseline.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        if any(request.url.path.startswith(route) for route in LEGACY_OPEN_ROUTES):
+            return await call_next(request)
+
+        auth_header = request.headers.get("Authorization")
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return JSONResponse({"detail": "Not authenticated"}, status_code=401)
+
+        token = auth_header.split(" ")[1]
+        payload = verify_token(token)
+        if not payload:
+            return JSONResponse({"detail": "Invalid or expired token"}, status_code=401)
+
+        request.state.user = payload
+        return await call_next(request)
+
+
+def build_app(middleware) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(middleware)
+
+    @app.get("/me")
+    async def me(request: Request):
+        return {"user": request.state.user["sub"]}
+
+    return app
+
+
+async def measure(app: FastAPI, token: str, requests: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/me", headers=headers)
+
+        async def worker(count: int):
+            for _ in range(count):
+                response = await client.get("/me", headers=headers)
+                response.raise_for_status()
+
+        per_worker = requests // concurrency
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(per_worker) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return per_worker * concurrency / elapsed
+
+
+def run(requests: int, concurrency: int) -> dict:
+    token = create_access_token({"sub": "bench", "uid": 1})
+    results = {}
+    for label, middleware in (("base_http_middleware", LegacyJWTMiddleware), ("pure_asgi", JWTMiddleware)):
+        rps = asyncio.run(measure(build_app(middleware), token, requests, concurrency))
+        results[label] = {"requests_per_second": round(rps, 1)}
+    results["speedup"] = round(
+        results["pure_asgi"]["requests_per_second"] / results["base_http_middleware"]["requests_per_second"], 2
+    )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(run(args.requests, args.concurrency), indent=2))
@@ -0,0 +1,130 @@
+"""
+Microbenchmark of JSON serialization on the hot paths: a 1k message REST page and
+a WebSocket event broadcast to 100 recipients, encoded per recipient or once.
+
+    python -m benchmarks.serialization [--messages 1000] [--recipients 100] [--rounds 50]
+
+Prints one JSON document with the cost per operation in microseconds.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+from pydantic import TypeAdapter
+
+from core import serialization
+from core.serialization import dumps, model_response
+from routers.ws_router import ConnectionManager, message_event
+from schemas import MessagePage
+
+
+def build_page(count: int) -> dict:
+    start = datetime(2026, 1, 1)
+    items = [
+        {
+            "id": i,
+            "text": f"Message number {i} with a bit of text to encode, ünïcödé included",
+            "sender_id": i % 7,
+            "recipient_id": i % 11,
+            "timestamp": start + timedelta(seconds=i),
+            "attachments": [],
+        }
+        for i in range(count)
+    ]
+    return {"items": items, "next_cursor": "eyJ2IjpbMTAwMF19"}
+
+
+def timed(func, rounds: int) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def response_model_path(adapter: TypeAdapter, page: dict) -> bytes:
+    # What FastAPI does for a returned dict: validate, convert to plain data, json.dumps
+    value = adapter.validate_python(page, from_attributes=True)
+    content = adapter.dump_python(value, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+class NullWebSocket:
+    def __init__(self, done: asyncio.Event, expected: list):
+        self.done = done
+        self.expected = expected
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.expected[0] -= 1
+        if not self.expected[0]:
+            self.done.set()
+
+
+async def time_broadcast(recipients: int, rounds: int, event: dict) -> float:
+    manager = ConnectionManager()
+    done = asyncio.Event()
+    expected = [0]
+    for user_id in range(recipients):
+        connection = await manager.connect(user_id, NullWebSocket(done, expected))
+        manager.subscribe(connection, "bench")
+
+    elapsed = 0.0
+    # The first round is a warm-up
+    for round_ in range(rounds + 1):
+        done.clear()
+        expected[0] = recipients
+        start = time.perf_counter()
+        await manager.broadcast("bench", event)
+        await done.wait()
+        if round_:
+            elapsed += time.perf_counter() - start
+
+    for devices in list(manager.user_connections.values()):
+        for connection in list(devices):
+            await connection.close()
+    return elapsed / rounds * 1e6
+
+
+def run(messages: int, recipients: int, rounds: int) -> dict:
+    page = build_page(messages)
+    adapter = TypeAdapter(MessagePage)
+    event = message_event("add", "1_2", {
+        "id": 1, "text": "Hello there, this is a chat message", "sender_id": 1, "recipient_id": 2
+    })
+
+    return {
+        "encoder": "orjson" if serialization.orjson is not None else "json",
+        f"page_{messages}_messages_us": {
+            "response_model": round(timed(lambda: response_model_path(adapter, page), rounds), 1),
+            "model_response": round(timed(lambda: model_response(MessagePage, page), rounds), 1),
+        },
+        f"encode_{messages}_events_us": {
+            "json": round(timed(lambda: [json.dumps(m, default=str) for m in page["items"]], rounds), 1),
+            "dumps": round(timed(lambda: [dumps(m) for m in page["items"]], rounds), 1),
+        },
+        f"broadcast_{recipients}_recipients_us": {
+            "encode_per_recipient": round(timed(
+                lambda: [json.dumps(event, separators=(",", ":"), ensure_ascii=False) for _ in range(recipients)],
+                rounds
+            ), 1),
+            "encode_once": round(timed(lambda: dumps(event), rounds), 1),
+            "end_to_end": round(asyncio.run(time_broadcast(recipients, rounds, event)), 1),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--recipients", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(run(args.messages, args.recipients, args.rounds), indent=2))
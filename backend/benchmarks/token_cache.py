@@ -0,0 +1,73 @@
+"""
+Microbenchmark of JWT verification and JWTMiddleware overhead with and without the verified-token cache.
+
+    python -m benchmarks.token_cache [--requests 5000]
+
+Prints one JSON document with the per-call cost in microseconds.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+import httpx
+from fastapi import FastAPI
+
+from core import auth
+from core.cache import TTLCache
+from core.middleware import JWTMiddleware
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(JWTMiddleware)
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+def time_verify(token: str, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        auth.verify_token(token)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+async def time_requests(app: FastAPI, token: str, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/ping", headers=headers)
+        start = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/ping", headers=headers)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def run(requests: int) -> dict:
+    token = auth.create_access_token({"sub": "bench", "uid": 1})
+    app = build_app()
+    cached_cache = auth._verified_tokens
+    results = {}
+    for label, cache in (("uncached", TTLCache(maxsize=0)), ("cached", cached_cache)):
+        auth._verified_tokens = cache
+        results[label] = {
+            "verify_token_us": round(time_verify(token, requests), 2),
+            "request_us": round(asyncio.run(time_requests(app, token, requests)), 2),
+        }
+    auth._verified_tokens = cached_cache
+    results["cache"] = auth.token_cache_stats()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.requests), indent=2))
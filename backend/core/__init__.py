@@ -1,6 +1,9 @@
-from .database import Base, engine, get_db,DATABASE_URL
-from .security import hash_password, verify_password
-from .auth import create_access_token, verify_token
+from .database import Base, engine, get_db, AsyncSessionLocal, DATABASE_URL
+from .security import (
+    hash_password, verify_password, hash_password_async, verify_password_async,
+    verify_and_update_password, shutdown_password_pool
+)
+from .auth import create_access_token, current_user_id, require_admin, verify_token, invalidate_token, revoke_token, token_cache_stats
 from .middleware import JWTMiddleware
 
-__all__ = ["Base", "engine", "get_db", "hash_password", "verify_password","DATABASE_URL", "create_access_token","verify_token","JWTMiddleware"]
+__all__ = ["Base", "engine", "get_db", "AsyncSessionLocal", "hash_password", "verify_password", "hash_password_async", "verify_password_async", "verify_and_update_password", "shutdown_password_pool","DATABASE_URL", "create_access_token","current_user_id","require_admin","verify_token","invalidate_token","revoke_token","token_cache_stats","JWTMiddleware"]
@@ -1,12 +1,24 @@
 from datetime import datetime, timedelta,timezone
-from typing import Optional
+from hashlib import sha256
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, Request, status
 from jose import JWTError, jwt
 import os
+import time
+from .cache import TTLCache
+from .config import ADMIN_USERNAMES, TOKEN_CACHE_MAX_TTL, TOKEN_CACHE_SIZE
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Decoded payloads of tokens already verified, keyed by token digest, kept until `exp`
+_verified_tokens = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_MAX_TTL)
+# Digests of tokens revoked before their expiry (logout), with that expiry. No size bound:
+# evicting one would accept its token again. Entries go once the token has expired, and
+# every worker gets them from the revoked_tokens table and the broker (services.revocations)
+_revoked_tokens: Dict[bytes, float] = {}
+
 # JWT Generation
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -15,10 +27,91 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def _token_digest(token: str) -> bytes:
+    return sha256(token.encode()).digest()
+
+def _decode_token(token: str):
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
 # JWT Check
 def verify_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if not token:
+        return None
+    digest = _token_digest(token)
+    if digest in _revoked_tokens:
+        return None
+    payload = _verified_tokens.get(digest)
+    if payload is not None:
         return payload
-    except JWTError:
+
+    payload = _decode_token(token)
+    if payload and payload.get("exp") is not None:
+        _verified_tokens.set(digest, payload, expires_at=payload["exp"])
+    return payload
+
+def invalidate_token(token: str):
+    """
+    Forgets a cached verification, the next use of the token is decoded again.
+    """
+    _verified_tokens.pop(_token_digest(token))
+
+def revoke_token(token: str) -> Optional[Tuple[bytes, float]]:
+    """
+    Rejects the token in this process from now until it expires (logout, compromised token).
+    Returns its digest and expiry for the other workers to be told, None if it was not valid.
+    """
+    payload = verify_token(token)
+    digest = _token_digest(token)
+    _verified_tokens.pop(digest)
+    if not payload or payload.get("exp") is None:
         return None
+    mark_revoked(digest, payload["exp"])
+    return digest, float(payload["exp"])
+
+def mark_revoked(digest: bytes, expires_at: float):
+    """
+    Rejects the token with this digest until `expires_at`, revoked here or by another worker.
+    """
+    if expires_at > time.time():
+        _revoked_tokens[digest] = expires_at
+        _verified_tokens.pop(digest)
+
+def prune_revoked(now: Optional[float] = None) -> int:
+    """
+    Forgets revocations of tokens that have expired, and would be rejected anyway.
+    """
+    now = time.time() if now is None else now
+    expired = [digest for digest, expires_at in list(_revoked_tokens.items()) if expires_at <= now]
+    for digest in expired:
+        _revoked_tokens.pop(digest, None)
+    return len(expired)
+
+def token_cache_stats() -> dict:
+    return {"verified": _verified_tokens.stats(), "revoked": len(_revoked_tokens)}
+
+def current_user_id(request: Request) -> int:
+    """
+    Dependency returning the id of the authenticated user, set by JWTMiddleware.
+    """
+    user = getattr(request.state, "user", None) or {}
+    user_id = user.get("uid")
+    if user_id is None:
+        # Tokens issued before user ids were embedded
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has no user id, please log in again",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user_id
+
+def require_admin(request: Request) -> dict:
+    """
+    Dependency restricting a route to the users listed in ADMIN_USERNAMES.
+    """
+    user = getattr(request.state, "user", None) or {}
+    if user.get("sub") not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return user
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from .serialization import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7999
+# Room left in each notification for the envelope around a part of a larger event
+PART_ENVELOPE_SIZE = 160
+
+
+class Broker(ABC):
+    """
+    Fan-out backplane between processes serving WebSockets.
+    Every process delivers an event to its own sockets first and then publishes it,
+    the broker hands events published by other processes to `handler`.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler):
+        self.handler = handler
+
+    async def stop(self):
+        self.handler = None
+
+    @abstractmethod
+    async def publish(self, event: dict):
+        ...
+
+
+class InProcessBroker(Broker):
+    """
+    Single process deployments: local delivery already reached every socket.
+    """
+
+    async def publish(self, event: dict):
+        pass
+
+
+class PostgresBroker(Broker):
+    """
+    Uses LISTEN/NOTIFY on the application database, so several workers or pods
+    share events without extra infrastructure. One pooled connection per process
+    is held for LISTEN, publishing borrows a connection for a single transaction.
+
+    Events too large for one notification are split into parts notified in the same
+    transaction. PostgreSQL delivers them together and in order, and listeners join
+    them back before handing the event on.
+    """
+
+    def __init__(self, engine: AsyncEngine, channel: str = "messenger_events", reconnect_delay: float = 1.0):
+        super().__init__()
+        self.engine = engine
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._connection: Optional[AsyncConnection] = None
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._consumer: Optional[asyncio.Task] = None
+        self._reconnect: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Parts received so far, by (origin, event id)
+        self._parts: Dict[Tuple[str, str], List[str]] = {}
+        self.split_events = 0
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self._stopping = False
+        # A single consumer keeps remote events in the order they were notified
+        self._consumer = asyncio.create_task(self._consume())
+        await self._listen()
+
+    async def stop(self):
+        self._stopping = True
+        for task in (self._reconnect, self._consumer):
+            if task:
+                task.cancel()
+        await self._close_connection()
+        await super().stop()
+
+    async def publish(self, event: dict):
+        payloads = self.payloads(event)
+        async with self.engine.connect() as conn:
+            for payload in payloads:
+                await conn.execute(
+                    text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": payload}
+                )
+            await conn.commit()
+
+    def payloads(self, event: dict) -> List[str]:
+        """
+        The notifications carrying the event: one, or its parts when it does not fit.
+        """
+        payload = dumps({"origin": self.node_id, "event": event})
+        if len(payload.encode()) <= NOTIFY_PAYLOAD_LIMIT:
+            return [payload]
+
+        data = dumps(event)
+        budget = NOTIFY_PAYLOAD_LIMIT - PART_ENVELOPE_SIZE
+        pieces: List[str] = []
+        start = 0
+        while start < len(data):
+            size = budget
+            # Escaping and multi-byte characters make a piece longer once encoded
+            while len(dumps(data[start:start + size]).encode()) > budget:
+                size = size * 3 // 4
+            pieces.append(data[start:start + size])
+            start += size
+
+        event_id = uuid.uuid4().hex
+        self.split_events += 1
+        return [
+            dumps({"origin": self.node_id, "id": event_id, "part": index, "parts": len(pieces), "data": piece})
+            for index, piece in enumerate(pieces)
+        ]
+
+    async def _listen(self):
+        self._connection = await self.engine.connect()
+        raw = await self._connection.get_raw_connection()
+        driver = raw.driver_connection
+        await driver.add_listener(self.channel, self._on_notify)
+        driver.add_termination_listener(self._on_terminated)
+        logger.info("Listening on channel %s as node %s", self.channel, self.node_id)
+
+    async def _close_connection(self):
+        if self._connection is None:
+            return
+        try:
+            await self._connection.close()
+        except Exception:
+            logger.exception("Failed to close LISTEN connection")
+        self._connection = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            message = loads(payload)
+        except ValueError:
+            logger.warning("Dropping malformed notification on %s", channel)
+            return
+        if message.get("origin") == self.node_id:
+            return
+        if "parts" in message:
+            key = (message["origin"], message["id"])
+            parts = self._parts.setdefault(key, [])
+            if len(parts) != message["part"]:
+                # Only after LISTEN was lost in the middle of an event
+                logger.warning("Dropping event %s from %s, part %d is missing", message["id"], message["origin"], len(parts))
+                del self._parts[key]
+                return
+            parts.append(message["data"])
+            if len(parts) < message["parts"]:
+                return
+            del self._parts[key]
+            self._inbox.put_nowait(loads("".join(parts)))
+            return
+        self._inbox.put_nowait(message["event"])
+
+    def _on_terminated(self, connection):
+        if not self._stopping:
+            logger.warning("LISTEN connection lost, reconnecting")
+            self._reconnect = asyncio.create_task(self._relisten())
+
+    async def _relisten(self):
+        await self._close_connection()
+        # The rest of any event cut off by the lost connection will never come
+        self._parts.clear()
+        while not self._stopping:
+            try:
+                await self._listen()
+                return
+            except Exception:
+                logger.exception("LISTEN reconnect failed")
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def _consume(self):
+        while True:
+            event = await self._inbox.get()
+            try:
+                await self.handler(event)
+            except Exception:
+                logger.exception("Failed to deliver remote event")
+
+
+def create_broker(backend: str, engine: AsyncEngine) -> Broker:
+    if backend == "postgres":
+        return PostgresBroker(engine)
+    if backend == "memory":
+        return InProcessBroker()
+    raise ValueError(f"Unknown broker backend: {backend}")
@@ -0,0 +1,246 @@
+import logging
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from .serialization import dumps, loads
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # redis is optional, only needed for the shared cache backend
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Returned by cache backends on a miss, so that None can be cached as a value
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded LRU map whose entries also expire.
+    Expiry is in wall-clock seconds so it can be aligned with JWT `exp` claims.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, MISSING)
+            if entry is MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None):
+        """
+        Stores `value` until `expires_at` (epoch seconds), or for `ttl` seconds,
+        whichever comes first. Falls back to the cache-wide ttl.
+        """
+        if self.maxsize <= 0:
+            return
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        deadline = now + ttl if ttl is not None else None
+        if expires_at is not None:
+            deadline = expires_at if deadline is None else min(deadline, expires_at)
+        if deadline is not None and deadline <= now:
+            return
+        with self._lock:
+            self._data[key] = (deadline, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, MISSING)
+        return default if entry is MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (deadline, _) in self._data.items() if deadline is not None and deadline <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, MISSING) is not MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def memory_usage(self) -> int:
+        """
+        Approximate bytes held by the keys and values, walking containers. O(size).
+        """
+        with self._lock:
+            entries = list(self._data.items())
+        return sys.getsizeof(self._data) + sum(_size_of(key) + _size_of(value) for key, (_, value) in entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": self.memory_usage(),
+        }
+
+def _size_of(value: Any) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_size_of(k) + _size_of(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_size_of(v) for v in value)
+    return size
+
+
+class CacheBackend(ABC):
+    """
+    Storage behind a read-through cache. Keys are strings and values plain JSON data.
+    `get` returns MISSING when the key is not cached.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        ...
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        ...
+
+
+class LocalCacheBackend(CacheBackend):
+    """
+    In-process TTL/LRU backend. Each worker has its own copy, so invalidation
+    only reaches the process it happens in: keep the TTL short with several workers.
+    Also the stand-in for the shared backend in tests.
+    """
+
+    name = "memory"
+
+    def __init__(self, maxsize: int = 10000, ttl: Optional[float] = 60):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Any:
+        return self.cache.get(key, MISSING)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.cache.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.cache.pop(key)
+
+    async def stats(self) -> dict:
+        return {"backend": self.name, **self.cache.stats()}
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis backend shared by every worker and pod, so an invalidation is seen everywhere.
+    Eviction is left to Redis (maxmemory-policy allkeys-lru). Errors count as misses:
+    the cache being down slows requests but does not fail them.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, ttl: Optional[float] = 60, prefix: str = "messenger:cache:"):
+        if redis is None:
+            raise RuntimeError("The redis cache backend needs the redis package")
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Any:
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception:
+            self.errors += 1
+            logger.warning("Cache get failed for %s", key, exc_info=True)
+            return MISSING
+        if raw is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            await self.client.set(self.prefix + key, dumps(value), px=int(ttl * 1000) if ttl else None)
+        except Exception:
+            self.errors += 1
+            logger.warning("Cache set failed for %s", key, exc_info=True)
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        try:
+            await self.client.delete(*(self.prefix + key for key in keys))
+        except Exception:
+            self.errors += 1
+            logger.exception("Cache invalidation failed for %s", keys)
+
+    async def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+        try:
+            info = await self.client.info("memory")
+            stats["memory_bytes"] = info.get("used_memory")
+        except Exception:
+            stats["memory_bytes"] = None
+        return stats
+
+
+def create_cache_backend(backend: str, maxsize: int, ttl: Optional[float], url: Optional[str] = None) -> CacheBackend:
+    if backend == "memory":
+        return LocalCacheBackend(maxsize=maxsize, ttl=ttl)
+    if backend == "redis":
+        return RedisCacheBackend(url, ttl=ttl)
+    raise ValueError(f"Unknown cache backend: {backend}")
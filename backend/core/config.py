@@ -9,4 +9,106 @@ DB_HOST = os.getenv("POSTGRES_HOST", "db")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 DB_NAME = os.getenv("POSTGRES_DB")
 
-DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
\ No newline at end of file
+DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Connection pool of the application engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Statements slower than SLOW_QUERY_MS are counted, and this fraction of them logged
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1.0"))
+
+# WebSocket fan-out backplane: "memory" for a single process, "postgres" for several workers/pods
+BROKER_BACKEND = os.getenv("BROKER_BACKEND", "memory")
+
+# Per-connection outbound queue: size, policy when full (drop_oldest | coalesce | disconnect)
+# and how long a single send may take before the client is considered dead
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_QUEUE_POLICY = os.getenv("WS_QUEUE_POLICY", "drop_oldest")
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+# Heartbeat: every WS_HEARTBEAT_INTERVAL seconds sockets get a ping, and those that sent
+# nothing (pong or otherwise) for WS_HEARTBEAT_TIMEOUT seconds are evicted
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "25"))
+WS_HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "75"))
+
+# Presence and typing: changes are sent in one frame per recipient every PRESENCE_TICK_MS,
+# a user is announced offline PRESENCE_OFFLINE_GRACE seconds after their last socket closed,
+# and typing stops by itself TYPING_TIMEOUT seconds after the last typing frame
+PRESENCE_TICK_MS = float(os.getenv("PRESENCE_TICK_MS", "250"))
+PRESENCE_OFFLINE_GRACE = float(os.getenv("PRESENCE_OFFLINE_GRACE", "5"))
+TYPING_TIMEOUT = float(os.getenv("TYPING_TIMEOUT", "6"))
+
+# Write-behind batching of messages sent over WebSockets: flushed at
+# MESSAGE_BATCH_SIZE messages or MESSAGE_BATCH_DELAY_MS after the first one
+MESSAGE_BATCHING = os.getenv("MESSAGE_BATCHING", "false").lower() in ("1", "true", "yes")
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "100"))
+MESSAGE_BATCH_DELAY_MS = float(os.getenv("MESSAGE_BATCH_DELAY_MS", "5"))
+
+# Verified JWT cache: max entries and the longest an entry may live before being re-verified
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_TTL = float(os.getenv("TOKEN_CACHE_MAX_TTL", "300"))
+
+# Revoked tokens are announced to the other workers right away; every
+# TOKEN_REVOCATION_SYNC_INTERVAL seconds each one also reloads them from the database
+# in case it missed an announcement, and expired ones are deleted
+TOKEN_REVOCATION_SYNC_INTERVAL = float(os.getenv("TOKEN_REVOCATION_SYNC_INTERVAL", "60"))
+
+# Password hashing: bcrypt cost factor and the pool bcrypt runs in (thread | process)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# In-process cache of user search results for hot type-ahead prefixes
+USER_SEARCH_CACHE_SIZE = int(os.getenv("USER_SEARCH_CACHE_SIZE", "2048"))
+USER_SEARCH_CACHE_TTL = float(os.getenv("USER_SEARCH_CACHE_TTL", "30"))
+
+# Read-through cache of user and chat facts: "memory" per process or "redis" shared
+# (needs the redis package and CACHE_REDIS_URL). Missing users are cached for less time.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://redis:6379/0")
+DIRECTORY_CACHE_SIZE = int(os.getenv("DIRECTORY_CACHE_SIZE", "50000"))
+DIRECTORY_CACHE_TTL = float(os.getenv("DIRECTORY_CACHE_TTL", "300"))
+DIRECTORY_NEGATIVE_TTL = float(os.getenv("DIRECTORY_NEGATIVE_TTL", "30"))
+
+# Users allowed to use admin-only routes such as the NDJSON exports (comma separated)
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
+# Attachment blobs: storage directory, upload size limit and optional nginx offload.
+# With ATTACHMENT_ACCEL_REDIRECT set (e.g. /protected-media) downloads are answered with
+# X-Accel-Redirect and the proxy serves the file with sendfile.
+ATTACHMENTS_DIR = os.getenv("ATTACHMENTS_DIR", "media")
+ATTACHMENT_MAX_SIZE = int(os.getenv("ATTACHMENT_MAX_SIZE", str(50 * 1024 * 1024)))
+ATTACHMENT_ACCEL_REDIRECT = os.getenv("ATTACHMENT_ACCEL_REDIRECT", "").rstrip("/")
+
+# Image previews: thumbnails fit in THUMBNAIL_SIZE x THUMBNAIL_SIZE and are rendered by
+# THUMBNAIL_WORKERS processes. Uploads past THUMBNAIL_QUEUE_SIZE pending jobs get no preview.
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", str(min(2, os.cpu_count() or 1))))
+THUMBNAIL_QUEUE_SIZE = int(os.getenv("THUMBNAIL_QUEUE_SIZE", "1000"))
+THUMBNAIL_MAX_RETRIES = int(os.getenv("THUMBNAIL_MAX_RETRIES", "3"))
+
+# Monthly partitions of messages: how many months ahead are created (at startup and then
+# every MESSAGE_PARTITION_CHECK_INTERVAL seconds), and where archived months are written.
+# `python -m services.partitions archive` detaches months older than MESSAGE_HOT_MONTHS.
+MESSAGE_PARTITION_MONTHS_AHEAD = int(os.getenv("MESSAGE_PARTITION_MONTHS_AHEAD", "3"))
+MESSAGE_PARTITION_CHECK_INTERVAL = float(os.getenv("MESSAGE_PARTITION_CHECK_INTERVAL", "3600"))
+MESSAGE_HOT_MONTHS = int(os.getenv("MESSAGE_HOT_MONTHS", "12"))
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", "archive")
+
+# Token bucket limits on message writes (add, update, delete), over REST and WebSockets:
+# sustained rate per second and burst size, per user across all of their devices and per
+# WebSocket connection. A rate of 0 disables that limit. Per-user buckets are kept in
+# process ("memory", idle buckets dropped every RATE_LIMIT_COMPACT_INTERVAL seconds) or
+# in Redis ("redis", shared by every worker, needs the redis package).
+MESSAGE_RATE_PER_USER = float(os.getenv("MESSAGE_RATE_PER_USER", "5"))
+MESSAGE_BURST_PER_USER = float(os.getenv("MESSAGE_BURST_PER_USER", "20"))
+MESSAGE_RATE_PER_CONNECTION = float(os.getenv("MESSAGE_RATE_PER_CONNECTION", "3"))
+MESSAGE_BURST_PER_CONNECTION = float(os.getenv("MESSAGE_BURST_PER_CONNECTION", "10"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", CACHE_REDIS_URL)
+RATE_LIMIT_COMPACT_INTERVAL = float(os.getenv("RATE_LIMIT_COMPACT_INTERVAL", "60"))
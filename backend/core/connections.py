@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Hashable, Optional, Set, Union
+from fastapi import WebSocket
+from .metrics import ws_delivery
+from .ratelimit import TokenBucket
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# What to do when a client does not keep up and its queue is full
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+QUEUE_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# Close code sent to consumers evicted for being too slow ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close code sent to sockets evicted for missing their heartbeats ("going away")
+STALE_CLOSE_CODE = 1001
+
+
+class Connection:
+    """
+    A WebSocket with its own bounded outbound queue, drained by a dedicated writer task.
+    Enqueueing never awaits, so one slow or dead client cannot stall the others.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        multiplexed: bool = False,
+        max_queue: int = 256,
+        policy: str = DROP_OLDEST,
+        send_timeout: float = 10.0,
+        on_close: Optional[Callable[["Connection"], None]] = None,
+    ):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.websocket = websocket
+        self.user_id = user_id
+        # A multiplexed session serves every chat of its user, the legacy per-chat socket only its own
+        self.multiplexed = multiplexed
+        self.subscriptions: Set[str] = set()
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.on_close = on_close
+
+        # Entries are [coalesce_key, message, queued_at] so a coalesced update can replace its payload in place
+        self._queue: deque = deque()
+        self._pending: Dict[Hashable, list] = {}
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.closed = False
+        # Last time anything was received from the client, for the heartbeat
+        self.last_seen = time.monotonic()
+        # The client's own write limit, lives and dies with the socket (see core/ratelimit.py)
+        self.rate_bucket: Optional[TokenBucket] = None
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: Union[str, dict], coalesce_key: Optional[Hashable] = None) -> bool:
+        """
+        Queues a message for this client. Returns False when the message was not queued.
+        Pass the JSON text of events going to several clients, it is sent as is;
+        dicts are encoded when sent.
+        Messages sharing a coalesce_key supersede each other under the coalesce policy.
+        """
+        if self.closed:
+            return False
+
+        if self.policy == COALESCE and coalesce_key is not None and coalesce_key in self._pending:
+            self._pending[coalesce_key][1] = message
+            self.coalesced += 1
+            return True
+
+        if len(self._queue) >= self.max_queue:
+            if self.policy == DISCONNECT:
+                logger.warning("Disconnecting slow consumer: user %s", self.user_id)
+                self.dropped += 1
+                self.evict(SLOW_CONSUMER_CLOSE_CODE)
+                return False
+            key = self._queue.popleft()[0]
+            self._forget(key)
+            self.dropped += 1
+
+        entry = [coalesce_key, message, time.perf_counter()]
+        self._queue.append(entry)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = entry
+        self._ready.set()
+        return True
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def evict(self, code: int):
+        """
+        Drops the connection at once and closes the socket in the background,
+        so a dead client cannot hold up the caller.
+        """
+        if self.closed:
+            return
+        self._shutdown()
+        asyncio.create_task(self._close_socket(code))
+
+    async def close(self, code: Optional[int] = None):
+        if self.closed:
+            return
+        self._shutdown()
+        if code is not None:
+            await self._close_socket(code)
+
+    def stats(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "subscriptions": len(self.subscriptions),
+            "depth": self.depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def _forget(self, key: Optional[Hashable]):
+        if key is not None:
+            self._pending.pop(key, None)
+
+    def _shutdown(self):
+        self.closed = True
+        self._queue.clear()
+        self._pending.clear()
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if self.on_close:
+            self.on_close(self)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                key, message, queued_at = self._queue.popleft()
+                self._forget(key)
+                if not isinstance(message, str):
+                    message = dumps(message)
+                await asyncio.wait_for(self.websocket.send_text(message), self.send_timeout)
+                self.sent += 1
+                ws_delivery.observe(time.perf_counter() - queued_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.info("Writer for user %s stopped: %r", self.user_id, exc)
+            self._shutdown()
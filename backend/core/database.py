@@ -1,8 +1,23 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from core.config import DATABASE_URL
+from core.config import (
+    DATABASE_URL, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT
+)
+from core.metrics import InstrumentedPool, instrument_engine
+
+# No echo: statements are counted and timed by instrument_engine, slow ones logged
+engine = create_async_engine(
+    DATABASE_URL,
+    future=True,
+    poolclass=InstrumentedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+instrument_engine(engine)
 
 AsyncSessionLocal = sessionmaker(
     bind=engine, class_=AsyncSession, expire_on_commit=False
@@ -0,0 +1,21 @@
+from typing import AsyncIterator
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+from .database import AsyncSessionLocal
+from .serialization import dumps_bytes
+
+EXPORT_BATCH_SIZE = 1000
+
+async def _ndjson_rows(stmt: Select, batch_size: int) -> AsyncIterator[bytes]:
+    # The session lives as long as the response body, not the request dependencies
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        async for rows in result.mappings().partitions():
+            yield b"".join(dumps_bytes(dict(row)) + b"\n" for row in rows)
+
+def ndjson_export(stmt: Select, batch_size: int = EXPORT_BATCH_SIZE) -> StreamingResponse:
+    """
+    Streams the rows of `stmt` as newline-delimited JSON through a server-side cursor,
+    holding at most `batch_size` rows in memory.
+    """
+    return StreamingResponse(_ndjson_rows(stmt, batch_size), media_type="application/x-ndjson")
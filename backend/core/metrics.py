@@ -0,0 +1,274 @@
+import logging
+import random
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from .config import SLOW_QUERY_MS, SLOW_QUERY_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("messenger.slow_query")
+
+# Metrics in the Prometheus text exposition format, without a client library.
+# They are only updated from the event loop thread, so no locking is needed.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+LabelValues = Tuple[str, ...]
+Sample = Union[float, Dict[LabelValues, float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Unlabelled counters are exposed from the start, at 0
+        self._values: Dict[LabelValues, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value set by the code, or read from `callback` at scrape time. A callback returns
+    a number, or a {label values: number} dict for labelled gauges.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Sample]] = None
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *labelvalues: str):
+        self._values[labelvalues] = value
+
+    def samples(self) -> List[str]:
+        values = self._values
+        if self.callback is not None:
+            sample = self.callback()
+            values = sample if isinstance(sample, dict) else {(): sample}
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values.items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: [count per bucket (non cumulative, +Inf last), sum]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *labelvalues: str) -> int:
+        series = self._series.get(labelvalues)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Sample]] = None
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        rendered = []
+        for metric in self._metrics.values():
+            try:
+                rendered.append(metric.render())
+            except Exception:
+                # A failing callback must not take the whole scrape down
+                logger.exception("Failed to collect metric %s", metric.name)
+        return "\n".join(rendered) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+db_pool_wait = REGISTRY.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection", buckets=QUERY_BUCKETS
+)
+db_pool_timeouts = REGISTRY.counter("db_pool_checkout_timeouts_total", "Checkouts that gave up waiting for a connection")
+db_query_duration = REGISTRY.histogram(
+    "db_query_duration_seconds", "SQL statement execution time by kind", ("statement",), buckets=QUERY_BUCKETS
+)
+db_query_errors = REGISTRY.counter("db_query_errors_total", "SQL statements that raised")
+db_slow_queries = REGISTRY.counter("db_slow_queries_total", f"SQL statements slower than {SLOW_QUERY_MS:g} ms")
+ws_broadcast_fanout = REGISTRY.histogram(
+    "ws_broadcast_fanout_seconds", "Time to hand one event to the queues of all its local recipients", buckets=QUERY_BUCKETS
+)
+ws_broadcast_recipients = REGISTRY.histogram(
+    "ws_broadcast_recipients", "Local sockets reached per event", buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+)
+ws_delivery = REGISTRY.histogram(
+    "ws_delivery_seconds", "Time from queueing an event for a socket to having written it"
+)
+rate_limited = REGISTRY.counter("rate_limited_total", "Writes rejected by a rate limit", ("scope",))
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    The engine's pool, timing how long every checkout waits for a free connection.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_timeouts.inc()
+            raise
+        finally:
+            db_pool_wait.observe(time.perf_counter() - start)
+
+def pool_usage(engine: AsyncEngine) -> Dict[LabelValues, float]:
+    pool = engine.sync_engine.pool
+    return {
+        ("size",): pool.size(),
+        ("checked_out",): pool.checkedout(),
+        ("checked_in",): pool.checkedin(),
+        ("overflow",): max(pool.overflow(), 0),
+    }
+
+def _statement_kind(statement: str) -> str:
+    head = statement.lstrip().split(None, 1)
+    return head[0].upper() if head else "UNKNOWN"
+
+def instrument_engine(engine: AsyncEngine):
+    """
+    Counts and times every statement through engine events, and logs the slow ones:
+    a sample of SLOW_QUERY_SAMPLE_RATE of the statements slower than SLOW_QUERY_MS.
+    """
+    sync_engine = engine.sync_engine
+    REGISTRY.gauge(
+        "db_pool_connections", "DB pool connections by state", ("state",), callback=lambda: pool_usage(engine)
+    )
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_query_duration.observe(elapsed, _statement_kind(statement))
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            db_slow_queries.inc()
+            if random.random() < SLOW_QUERY_SAMPLE_RATE:
+                slow_query_logger.warning("%.1f ms: %s", elapsed * 1000, " ".join(statement.split())[:2000])
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        db_query_errors.inc()
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
@@ -1,27 +1,104 @@
-from fastapi import Request
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+import re
+import time
+from typing import Callable, Iterable
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from .auth import verify_token
+from .metrics import http_request_duration
 
-OPEN_ROUTES = ["/users/login", "/users/register","/docs","/openapi.json","/users","/ws"]
+# Paths reachable without a token: exact routes, and prefixes covering a whole subtree
+# /metrics is open for scrapers, the /health routes are not: they need a token
+OPEN_ROUTES = ["/users/login", "/users/register", "/openapi.json", "/metrics"]
+OPEN_PREFIXES = ["/docs", "/redoc", "/ws"]
 
-class JWTMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: ASGIApp):
-        super().__init__(app)
+def compile_route_matcher(routes: Iterable[str], prefixes: Iterable[str]) -> Callable[[str], bool]:
+    """
+    Builds a single regex for the open routes. Routes match exactly (trailing slash allowed),
+    prefixes only on a segment boundary, so "/ws" does not open "/wsx".
+    """
+    alternatives = []
+    routes = [re.escape(route.rstrip("/")) for route in routes]
+    prefixes = [re.escape(prefix.rstrip("/")) for prefix in prefixes]
+    if routes:
+        alternatives.append(f"(?:{'|'.join(routes)})/?")
+    if prefixes:
+        alternatives.append(f"(?:{'|'.join(prefixes)})(?:/.*)?")
+    if not alternatives:
+        return lambda path: False
+    pattern = re.compile(f"^(?:{'|'.join(alternatives)})$", re.DOTALL)
+    return lambda path: pattern.match(path) is not None
+
+class JWTMiddleware:
+    """
+    Pure ASGI middleware: requests pass straight through to the app, without the
+    extra task and body streams BaseHTTPMiddleware wraps around every response.
+    The token payload is stored as `request.state.user`.
+    """
+
+    def __init__(self, app: ASGIApp, open_routes: Iterable[str] = OPEN_ROUTES, open_prefixes: Iterable[str] = OPEN_PREFIXES):
+        self.app = app
+        self.is_open = compile_route_matcher(open_routes, open_prefixes)
 
-    async def dispatch(self, request: Request, call_next):
-        if any(request.url.path.startswith(route) for route in OPEN_ROUTES):
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # WebSockets authenticate through ws_auth_required
+        if scope["type"] != "http" or self.is_open(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        auth_header = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                auth_header = value.decode("latin-1")
+                break
 
-        auth_header = request.headers.get("Authorization")
         if not auth_header or not auth_header.startswith("Bearer "):
-            return JSONResponse({"detail": "Not authenticated"}, status_code=401)
+            response = JSONResponse({"detail": "Not authenticated"}, status_code=401)
+            await response(scope, receive, send)
+            return
 
-        token = auth_header.split(" ")[1]
+        token = auth_header[len("Bearer "):]
         payload = verify_token(token)
         if not payload:
-            return JSONResponse({"detail": "Invalid or expired token"}, status_code=401)
+            response = JSONResponse({"detail": "Invalid or expired token"}, status_code=401)
+            await response(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["user"] = payload
+        await self.app(scope, receive, send)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request into http_request_duration_seconds.
+    Requests are labelled with the route template (/messages/{user1_id}/{user2_id}),
+    never the raw path, so the number of series stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
 
-        request.state.user = payload
-        return await call_next(request)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope, none if rejected before routing
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status)
+            )
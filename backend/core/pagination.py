@@ -0,0 +1,33 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, status
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Cursors are opaque to clients: a urlsafe base64 of the JSON encoded sort key
+def encode_cursor(*values) -> str:
+    parts = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(parts, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """
+    Decodes a cursor produced by encode_cursor back into its sort key.
+    `types` gives the expected type of every part (datetime, int, float, str).
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(parts, list) or len(parts) != len(types):
+            raise ValueError("cursor arity mismatch")
+        return tuple(
+            datetime.fromisoformat(part) if type_ is datetime else type_(part)
+            for part, type_ in zip(parts, types)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
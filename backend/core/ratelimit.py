@@ -0,0 +1,211 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # redis is optional, only needed for the shared rate limit backend
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Holds up to `burst` tokens and refills at `rate` tokens per second.
+    Each action takes one; a bucket refilled to `burst` is the same as a new one.
+    """
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float, cost: float = 1) -> float:
+        """
+        Takes `cost` tokens. Returns 0 if they were there, otherwise the seconds until
+        they will be, and takes nothing.
+        """
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / rate
+
+    def full_at(self, rate: float, burst: float) -> float:
+        return self.updated + (burst - self.tokens) / rate
+
+
+class RateLimitBackend(ABC):
+    """
+    Storage of token buckets by key. `acquire` returns 0 when the action is allowed,
+    otherwise the seconds to wait before retrying.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def acquire(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        ...
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        ...
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """
+    In-process buckets: a dict lookup per check. Each worker has its own buckets, so with
+    N workers a user gets up to N times the limit. Buckets that have refilled completely
+    are dropped every `compact_interval` seconds, during a check, so the dict only holds
+    recently active keys.
+    """
+
+    name = "memory"
+
+    def __init__(self, compact_interval: float = 60.0):
+        self.compact_interval = compact_interval
+        # Key: bucket key, Value: (bucket, rate, burst), the latter two for compaction
+        self._buckets: Dict[str, tuple] = {}
+        self._next_compaction = time.monotonic() + compact_interval
+        self.allowed = 0
+        self.limited = 0
+        self.compacted = 0
+
+    async def acquire(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        return self.take(key, rate, burst, cost)
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        if now >= self._next_compaction:
+            self.compact(now)
+        entry = self._buckets.get(key)
+        if entry is None:
+            entry = self._buckets[key] = (TokenBucket(burst, now), rate, burst)
+        retry_after = entry[0].take(rate, burst, now, cost)
+        if retry_after:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def compact(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        full = [key for key, (bucket, rate, burst) in self._buckets.items() if bucket.full_at(rate, burst) <= now]
+        for key in full:
+            del self._buckets[key]
+        self.compacted += len(full)
+        self._next_compaction = now + self.compact_interval
+        return len(full)
+
+    async def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "buckets": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "compacted": self.compacted,
+        }
+
+
+# Refills and takes from a bucket stored as a hash, in one round trip. Time comes from
+# the Redis server so every worker sees the same clock. The key expires once the bucket
+# would be full again, which is the compaction of the shared backend.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Buckets shared by every worker and pod, so a limit holds across all of them.
+    While Redis cannot be reached checks fall back to local buckets: limits get looser
+    per worker but are never lifted altogether.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "messenger:ratelimit:", fallback: Optional[LocalRateLimitBackend] = None):
+        if redis is None:
+            raise RuntimeError("The redis rate limit backend needs the redis package")
+        self.client = redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.prefix = prefix
+        self.fallback = fallback or LocalRateLimitBackend()
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    async def acquire(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        try:
+            retry_after = float(await self.script(keys=[self.prefix + key], args=[rate, burst, cost]))
+        except Exception:
+            self.errors += 1
+            logger.warning("Rate limit check failed for %s, using local buckets", key, exc_info=True)
+            return await self.fallback.acquire(key, rate, burst, cost)
+        if retry_after:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    async def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "errors": self.errors,
+            "fallback": await self.fallback.stats(),
+        }
+
+
+class RateLimit:
+    """
+    A limit of `rate` actions per second with bursts of up to `burst`, per key.
+    """
+
+    def __init__(self, backend: RateLimitBackend, rate: float, burst: float, prefix: str = ""):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    async def acquire(self, key, cost: float = 1) -> float:
+        """
+        Returns 0 when the action is allowed, otherwise the seconds to wait before retrying.
+        """
+        if not self.enabled:
+            return 0.0
+        return await self.backend.acquire(f"{self.prefix}{key}", self.rate, self.burst, cost)
+
+
+def create_rate_limit_backend(backend: str, compact_interval: float, url: Optional[str] = None) -> RateLimitBackend:
+    if backend == "memory":
+        return LocalRateLimitBackend(compact_interval=compact_interval)
+    if backend == "redis":
+        return RedisRateLimitBackend(url, fallback=LocalRateLimitBackend(compact_interval=compact_interval))
+    raise ValueError(f"Unknown rate limit backend: {backend}")
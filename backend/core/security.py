@@ -1,9 +1,56 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
 from passlib.context import CryptContext
+from .config import BCRYPT_ROUNDS, PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Raising bcrypt__rounds marks older hashes as deprecated, they are rehashed on next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password : str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+# bcrypt is CPU bound: it runs in a bounded pool so logins never block the event loop.
+# At most PASSWORD_HASH_WORKERS hashes run at once, further calls wait their turn.
+_executor: Optional[Executor] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if PASSWORD_HASH_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+async def _run_in_pool(func, *args):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+    async with _slots:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_pool(verify_password, plain_password, hashed_password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies the password and, when its hash uses outdated settings, returns a new hash to store.
+    """
+    return await _run_in_pool(verify_and_update, plain_password, hashed_password)
+
+def shutdown_password_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,53 @@
+import json
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any
+from fastapi import Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def dumps(obj: Any) -> str:
+    """
+    Compact JSON text, datetimes as ISO 8601. Encode an event once with this and
+    send the same string to every recipient.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default).decode()
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False)
+
+def dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+def model_response(schema, content: Any, status_code: int = 200) -> Response:
+    """
+    Validates `content` (dicts, rows or ORM objects) against `schema` once and writes the
+    JSON directly from pydantic-core. Return it from an endpoint declaring the same
+    response_model: FastAPI passes responses through as they are, instead of validating,
+    converting to dicts and encoding with json.dumps itself.
+    Fields are written under their aliases, as response_model does.
+    """
+    adapter = _adapter(schema)
+    body = adapter.dump_json(adapter.validate_python(content, from_attributes=True), by_alias=True)
+    return Response(body, status_code=status_code, media_type="application/json")
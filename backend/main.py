@@ -1,11 +1,44 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse
 from sqlalchemy import text
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
-from core import get_db, JWTMiddleware
-from routers import users_router,messages_router,ws_router
+from core import get_db, JWTMiddleware, token_cache_stats, shutdown_password_pool
+from core.metrics import render_metrics
+from core.middleware import MetricsMiddleware
+from routers import users_router,messages_router,ws_router,attachments_router,sync_router,groups_router
+from routers.ws_router import manager, message_rate_limit, pipeline
+from routers.attachments import thumbnails
+from routers.users import user_search_stats
+from services.directory import directory
+from services.partitions import ensure_partitions, maintain_partitions
+from services.revocations import maintain_revocations
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # messages has no default partition: without the current month every insert fails,
+    # so a process that cannot create the months ahead does not start
+    await ensure_partitions()
+    await manager.start()
+    if pipeline:
+        pipeline.start()
+    thumbnails.start()
+    # Then keeps creating the months ahead periodically
+    partitions = asyncio.create_task(maintain_partitions())
+    # Loads the tokens revoked before this process started, then resyncs periodically
+    revocations = asyncio.create_task(maintain_revocations())
+    yield
+    revocations.cancel()
+    partitions.cancel()
+    await thumbnails.stop()
+    if pipeline:
+        await pipeline.stop()
+    await manager.stop()
+    shutdown_password_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(JWTMiddleware)
 
@@ -23,12 +56,46 @@ app.add_middleware(
 )
 # ========================================
 
+# Outermost, so the latency includes authentication and CORS
+app.add_middleware(MetricsMiddleware)
+
 @app.get("/health")
 async def health_check(db: AsyncSession = Depends(get_db)):
     result = await db.execute(text("SELECT 1"))
     scalar = result.scalar()
     return {"status": "ok", "db": scalar}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus text format. Open, unlike /health which needs a token: scrapers carry
+    no user token, so expose it inside the network only.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/websockets")
+async def websocket_stats():
+    return manager.stats()
+
+@app.get("/health/auth")
+async def auth_stats():
+    return token_cache_stats()
+
+@app.get("/health/rate-limits")
+async def rate_limit_stats():
+    return await message_rate_limit.backend.stats()
+
+@app.get("/health/cache")
+async def cache_stats():
+    return {"directory": await directory.stats(), "user_search": user_search_stats()}
+
+@app.get("/health/thumbnails")
+async def thumbnail_stats():
+    return thumbnails.stats()
+
 app.include_router(users_router)
 app.include_router(messages_router)
-app.include_router(ws_router)
\ No newline at end of file
+app.include_router(ws_router)
+app.include_router(attachments_router)
+app.include_router(sync_router)
+app.include_router(groups_router)
\ No newline at end of file
@@ -1,5 +1,9 @@
 from .users import User
 from .messages import Message
 from .attachments import Attachment
+from .conversations import Conversation
+from .message_changes import MessageChange
+from .groups import Group, GroupMember
+from .tokens import RevokedToken
 
-__all__ = ["User", "Message", "Attachment"]
\ No newline at end of file
+__all__ = ["User", "Message", "Attachment", "Conversation", "MessageChange", "Group", "GroupMember", "RevokedToken"]
\ No newline at end of file
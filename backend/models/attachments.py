@@ -8,9 +8,17 @@ class Attachment(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255), nullable=False)
     url = Column(String(1024), nullable=False)
-    content_type = Column(String(50), nullable=False)
+    content_type = Column(String(255), nullable=False)
     size = Column(Integer, nullable=False)
     uploaded_at = Column(DateTime, default=func.now())
-    
-    message_id = Column(Integer, ForeignKey("messages.id",ondelete="CASCADE"),nullable=False)
-    message = relationship("Message", back_populates="attachments")
+    # Key of the blob in the content-addressed store, shared by identical files
+    sha256 = Column(String(64), nullable=False, index=True)
+    uploader_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True, index=True)
+    # Filled in by the thumbnail pipeline for images, empty until it has run
+    thumbnail_url = Column(String(1024), nullable=True)
+    placeholder = Column(String(128), nullable=True)
+
+    # Uploads are stored first and linked to their message when it is sent.
+    # No foreign key: messages is partitioned, deleting a message deletes its attachments in services
+    message_id = Column(Integer, nullable=True, index=True)
+    message = relationship("Message", primaryjoin="foreign(Attachment.message_id) == Message.id", back_populates="attachments")
@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Index, CheckConstraint, func
+from sqlalchemy.orm import relationship
+from core import Base
+
+class Conversation(Base):
+    """
+    One row per pair of users that exchanged messages, keyed by the ordered
+    pair (lowest id first) so both directions share the same row.
+    """
+    __tablename__ = "conversations"
+    __table_args__ = (
+        CheckConstraint("user_low_id <= user_high_id", name="ck_conversations_ordered_pair"),
+        Index("ix_conversations_low_activity", "user_low_id", "last_activity"),
+        Index("ix_conversations_high_activity", "user_high_id", "last_activity"),
+    )
+
+    user_low_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    user_high_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
+    # No foreign key to the partitioned messages table, kept current by refresh_conversation
+    last_message_id = Column(Integer, nullable=True)
+    last_activity = Column(DateTime, default=func.now(), nullable=False)
+
+    # Unread counters, one per side of the pair: messages from the other side
+    # past that side's read watermark
+    unread_low = Column(Integer, default=0, nullable=False)
+    unread_high = Column(Integer, default=0, nullable=False)
+
+    # Receipts as high-water marks: the newest message id each side has read or
+    # received, everything up to it included. Only ever move forward.
+    last_read_low = Column(Integer, default=0, nullable=False)
+    last_read_high = Column(Integer, default=0, nullable=False)
+    last_delivered_low = Column(Integer, default=0, nullable=False)
+    last_delivered_high = Column(Integer, default=0, nullable=False)
+
+    last_message = relationship("Message", primaryjoin="foreign(Conversation.last_message_id) == Message.id")
@@ -0,0 +1,29 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, func
+from core import Base
+
+class Group(Base):
+    """
+    A group chat. Its messages are stored once, with Message.group_id set instead
+    of a recipient, whatever the number of members.
+    """
+    __tablename__ = "groups"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), nullable=False)
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+
+    # Like Conversation: no foreign key to the partitioned messages table, kept current by services/groups.py
+    last_message_id = Column(Integer, nullable=True)
+    last_activity = Column(DateTime, default=func.now(), nullable=False)
+
+class GroupMember(Base):
+    __tablename__ = "group_members"
+    __table_args__ = (
+        # A user's groups; the primary key serves a group's members
+        Index("ix_group_members_user", "user_id", "group_id"),
+    )
+
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    joined_at = Column(DateTime, default=func.now(), nullable=False)
@@ -0,0 +1,25 @@
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Index, Integer, String, func
+from core import Base
+
+# Kinds of change, as stored in MessageChange.op
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+
+class MessageChange(Base):
+    """
+    Append-only log of message writes, one row per affected user, read by /sync.
+    Deletes stay here as tombstones after the message itself is gone.
+    """
+    __tablename__ = "message_changes"
+    __table_args__ = (
+        # A client's delta: one index range past its cursor
+        Index("ix_message_changes_user_seq", "user_id", "seq"),
+    )
+
+    seq = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # No foreign key: the tombstone outlives the message
+    message_id = Column(Integer, nullable=False)
+    op = Column(String(6), nullable=False)
+    changed_at = Column(DateTime, default=func.now(), nullable=False)
@@ -1,18 +1,47 @@
-from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey,func 
-from sqlalchemy.orm import relationship
+from sqlalchemy import CheckConstraint, Column, Computed, Integer, Text, DateTime, ForeignKey, Index, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from core import Base
 
 class Message(Base):
+    """
+    A direct message has a recipient, a group message a group_id and no recipient:
+    it is stored once for all of the group's members.
+
+    Range partitioned by timestamp, one partition per month (see services/partitions.py).
+    The primary key has to include the partition key, so no other table can hold a
+    foreign key to messages.id: services/messages.py deletes what used to cascade.
+    """
     __tablename__ = "messages"
+    __table_args__ = (
+        CheckConstraint("(recipient_id IS NULL) <> (group_id IS NULL)", name="ck_messages_recipient_or_group"),
+        # Serves keyset pagination of a conversation, one direction per index range
+        Index("ix_messages_conversation", "sender_id", "recipient_id", "timestamp", "id"),
+        # Index-only count of a user's unread messages from one peer past the read watermark
+        Index("ix_messages_unread", "recipient_id", "sender_id", "id"),
+        # Keyset pagination of a group's history
+        Index("ix_messages_group", "group_id", "timestamp", "id"),
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    # Unique through the sequence, lookups by id use the primary key index
+    id = Column(Integer, primary_key=True, autoincrement=True)
     text = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=func.now())
+    timestamp = Column(DateTime, primary_key=True, default=func.now(), server_default=func.now())
+    # Maintained by PostgreSQL, the 'simple' configuration does not assume a language
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('simple', text)", persisted=True)))
 
     sender_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"),nullable=False)
-    recipient_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"),nullable=False)
+    recipient_id = Column(Integer, ForeignKey("users.id",ondelete="CASCADE"),nullable=True)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=True)
 
     sender = relationship("User", back_populates="messages_sent", foreign_keys=[sender_id])
     recipient = relationship("User", back_populates="messages_received", foreign_keys=[recipient_id])
 
-    attachments = relationship("Attachment", back_populates="message", passive_deletes=True)
\ No newline at end of file
+    attachments = relationship(
+        "Attachment",
+        primaryjoin="Message.id == foreign(Attachment.message_id)",
+        back_populates="message",
+        passive_deletes=True
+    )
\ No newline at end of file
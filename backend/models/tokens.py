@@ -0,0 +1,12 @@
+from sqlalchemy import Column, DateTime, LargeBinary
+from core import Base
+
+class RevokedToken(Base):
+    """
+    Tokens logged out before their expiry, by SHA-256 digest. Rows past expires_at are
+    deleted periodically: their tokens are rejected for having expired.
+    """
+    __tablename__ = "revoked_tokens"
+
+    digest = Column(LargeBinary(32), primary_key=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -1,9 +1,14 @@
-from sqlalchemy import Column, Integer, String, DateTime, func
+from sqlalchemy import Column, Integer, String, DateTime, Index, func, text
 from sqlalchemy.orm import relationship
 from core import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # User search: substring/similarity through pg_trgm, short prefixes through the btree
+        Index("ix_users_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}),
+        Index("ix_users_username_lower_prefix", text("lower(username) text_pattern_ops")),
+    )
 
     id = Column(Integer, primary_key=True, index=True,autoincrement=True)
     username = Column(String(50), unique=True, nullable=False)
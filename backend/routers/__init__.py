@@ -2,5 +2,8 @@
 from .messages import router as messages_router
 from .users import router as users_router
 from .ws_router import ws_router
+from .attachments import router as attachments_router
+from .sync import router as sync_router
+from .groups import router as groups_router
 
-__all__ = ["messages_router", "users_router","ws_router"]
+__all__ = ["messages_router", "users_router","ws_router","attachments_router","sync_router","groups_router"]
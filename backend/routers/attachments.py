@@ -0,0 +1,142 @@
+import mimetypes
+import os
+from typing import Optional
+from urllib.parse import quote
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core import AsyncSessionLocal, current_user_id, get_db
+from core.metrics import REGISTRY
+from core.config import (
+    ATTACHMENTS_DIR, ATTACHMENT_ACCEL_REDIRECT, ATTACHMENT_MAX_SIZE,
+    THUMBNAIL_SIZE, THUMBNAIL_WORKERS, THUMBNAIL_QUEUE_SIZE, THUMBNAIL_MAX_RETRIES
+)
+from models import Attachment, Message
+from schemas import AttachmentRead
+from services.directory import directory
+from services.storage import BlobTooLarge, LocalBlobStore
+from services.thumbnails import THUMBNAIL_CONTENT_TYPE, THUMBNAIL_SUFFIX, ThumbnailQueue
+
+router = APIRouter(prefix="/attachments", tags=["attachments"])
+
+blob_store = LocalBlobStore(ATTACHMENTS_DIR)
+thumbnails = ThumbnailQueue(
+    AsyncSessionLocal,
+    blob_store,
+    size=THUMBNAIL_SIZE,
+    workers=THUMBNAIL_WORKERS,
+    max_queue=THUMBNAIL_QUEUE_SIZE,
+    max_retries=THUMBNAIL_MAX_RETRIES
+)
+REGISTRY.gauge("thumbnail_backlog", "Image preview jobs waiting", callback=lambda: thumbnails.stats()["backlog"])
+
+@router.post("/upload", response_model=AttachmentRead, status_code=status.HTTP_201_CREATED)
+async def upload_attachment(
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255),
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Uploads one file as the raw request body, streamed to disk chunk by chunk.
+    Send the file's type as Content-Type and its name as `filename`. Link the returned
+    id by listing it in the `attachments` of the message that uses it.
+    Images get a thumbnail and a placeholder shortly after, in the background.
+    """
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > ATTACHMENT_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File too large")
+
+    try:
+        sha256, size = await blob_store.save_stream(request.stream(), ATTACHMENT_MAX_SIZE)
+    except BlobTooLarge:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File too large")
+
+    filename = os.path.basename(filename)
+    content_type = request.headers.get("content-type") or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    attachment = Attachment(
+        filename=filename,
+        url="",
+        content_type=content_type[:255],
+        size=size,
+        sha256=sha256,
+        uploader_id=user_id
+    )
+    db.add(attachment)
+    await db.flush()
+    attachment.url = f"{router.prefix}/{attachment.id}"
+    await db.commit()
+    await db.refresh(attachment)
+    if thumbnails.accepts(attachment.content_type):
+        thumbnails.submit(attachment.id, sha256)
+    return attachment
+
+async def get_readable_attachment(attachment_id: int, user_id: int, db: AsyncSession) -> Attachment:
+    """
+    Only the uploader and the participants of the message an attachment
+    belongs to, or the members of its group, can read it.
+    """
+    result = await db.execute(
+        select(Attachment, Message.sender_id, Message.recipient_id, Message.group_id)
+        .outerjoin(Message, Message.id == Attachment.message_id)
+        .where(Attachment.id == attachment_id)
+    )
+    row = result.first()
+    if row and user_id in (row.Attachment.uploader_id, row.sender_id, row.recipient_id):
+        return row.Attachment
+    if row and row.group_id is not None and user_id in (await directory.group_members(row.group_id) or ()):
+        return row.Attachment
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+
+@router.get("/{attachment_id}")
+async def download_attachment(
+    attachment_id: int,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Serves the file with HTTP Range support.
+    """
+    attachment = await get_readable_attachment(attachment_id, user_id, db)
+    if not blob_store.exists(attachment.sha256):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment content missing")
+    return blob_response(attachment.sha256, attachment.content_type, attachment.filename)
+
+@router.get("/{attachment_id}/thumbnail")
+async def download_thumbnail(
+    attachment_id: int,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Serves the image's WebP thumbnail, 404 until it has been generated.
+    """
+    attachment = await get_readable_attachment(attachment_id, user_id, db)
+    if not attachment.thumbnail_url or not blob_store.exists(attachment.sha256, THUMBNAIL_SUFFIX):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Thumbnail not available")
+    return blob_response(attachment.sha256, THUMBNAIL_CONTENT_TYPE, suffix=THUMBNAIL_SUFFIX)
+
+def blob_response(
+    sha256: str,
+    content_type: str,
+    filename: Optional[str] = None,
+    suffix: Optional[str] = None
+) -> Response:
+    # Blobs are immutable: the same URL always has the same bytes
+    headers = {"Cache-Control": "private, max-age=31536000, immutable"}
+    if ATTACHMENT_ACCEL_REDIRECT:
+        # The reverse proxy streams the file itself (sendfile) and handles Range
+        headers["X-Accel-Redirect"] = f"{ATTACHMENT_ACCEL_REDIRECT}/{blob_store.relative_path(sha256, suffix)}"
+        if filename:
+            headers["Content-Disposition"] = f"inline; filename*=utf-8''{quote(filename)}"
+        return Response(headers=headers, media_type=content_type)
+    # FileResponse answers Range requests and uses the server's pathsend extension when offered
+    return FileResponse(
+        blob_store.path_for(sha256, suffix),
+        media_type=content_type,
+        filename=filename,
+        headers=headers,
+        content_disposition_type="inline"
+    )
@@ -0,0 +1,209 @@
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import and_, tuple_
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+from core import current_user_id, get_db
+from core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from core.serialization import model_response
+from models import Group, GroupMember, Message, User
+from routers.messages import ensure_users_exist
+from routers.ws_router import manager
+from schemas import GroupCreate, GroupMemberAdd, GroupMemberPage, GroupRead, MessagePage
+from services import add_members, create_group, remove_member
+from services.directory import directory
+
+router = APIRouter(
+    prefix="/groups",
+    tags=["groups"]
+)
+
+GROUP_COLUMNS = (Group.id, Group.name, Group.created_by, Group.created_at, Group.last_activity)
+
+async def ensure_member(group_id: int, user_id: int):
+    # Groups the caller is not in are reported missing, whether they exist or not
+    members = await directory.group_members(group_id)
+    if not members or user_id not in members:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group not found")
+
+def group_row(row) -> dict:
+    return {
+        "id": row.id,
+        "name": row.name,
+        "created_by": row.created_by,
+        "created_at": row.created_at,
+        "last_activity": row.last_activity,
+        "last_message": None if row.message_id is None else {
+            "id": row.message_id,
+            "text": row.text,
+            "sender_id": row.sender_id,
+            "timestamp": row.timestamp,
+        },
+    }
+
+@router.post("", response_model=GroupRead, status_code=status.HTTP_201_CREATED)
+async def create(
+    group_in: GroupCreate,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Creates a group with the caller and `member_ids` as its members.
+    """
+    await ensure_users_exist(user_id, *group_in.member_ids)
+    group = await create_group(db, group_in.name, user_id, group_in.member_ids)
+    await manager.group_changed(group.id)
+    return model_response(GroupRead, {
+        "id": group.id,
+        "name": group.name,
+        "created_by": group.created_by,
+        "created_at": group.created_at,
+        "last_activity": group.last_activity,
+    })
+
+@router.get("", response_model=List[GroupRead])
+async def list_groups(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Lists the caller's groups, most recent activity first, with a preview of the last message.
+    """
+    stmt = (
+        select(
+            *GROUP_COLUMNS,
+            Message.id.label("message_id"),
+            Message.text,
+            Message.sender_id,
+            Message.timestamp,
+        )
+        .select_from(GroupMember)
+        .join(Group, Group.id == GroupMember.group_id)
+        .outerjoin(Message, Message.id == Group.last_message_id)
+        .where(GroupMember.user_id == user_id)
+        .order_by(Group.last_activity.desc())
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+    return model_response(List[GroupRead], [group_row(row) for row in result])
+
+@router.get("/{group_id}/members", response_model=GroupMemberPage)
+async def list_members(
+    group_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Lists the group's members by user id, one page at a time.
+    """
+    await ensure_member(group_id, user_id)
+    stmt = (
+        select(GroupMember.user_id, User.username, GroupMember.joined_at)
+        .join(User, User.id == GroupMember.user_id)
+        .where(GroupMember.group_id == group_id)
+        .order_by(GroupMember.user_id)
+        .limit(limit + 1)
+    )
+    if cursor:
+        (last_id,) = decode_cursor(cursor, int)
+        stmt = stmt.where(GroupMember.user_id > last_id)
+    result = await db.execute(stmt)
+    members = [dict(row._mapping) for row in result]
+
+    next_cursor = None
+    if len(members) > limit:
+        members = members[:limit]
+        next_cursor = encode_cursor(members[-1]["user_id"])
+    return model_response(GroupMemberPage, {"items": members, "next_cursor": next_cursor})
+
+@router.post("/{group_id}/members", status_code=status.HTTP_204_NO_CONTENT)
+async def add_member(
+    group_id: int,
+    member: GroupMemberAdd,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Any member can add users to the group.
+    """
+    await ensure_member(group_id, user_id)
+    await ensure_users_exist(member.user_id)
+    added = await add_members(db, group_id, [member.user_id])
+    await db.commit()
+    if added:
+        await manager.group_changed(group_id)
+
+@router.delete("/{group_id}/members/{member_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_member(
+    group_id: int,
+    member_id: int,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Members can leave the group, its creator can also remove others.
+    The removed user's sockets stop receiving the group's events right away.
+    """
+    await ensure_member(group_id, user_id)
+    if member_id != user_id:
+        result = await db.execute(select(Group.created_by).where(Group.id == group_id))
+        if result.scalar() != user_id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the creator can remove members")
+    if not await remove_member(db, group_id, member_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not a member of the group")
+    await db.commit()
+    await manager.group_changed(group_id, removed_user_ids=[member_id])
+
+@router.get("/{group_id}/messages", response_model=MessagePage)
+async def get_group_messages(
+    group_id: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Returns one page of the group's history in chronological order, with the same
+    cursors as the history of a direct chat. Group messages are not in /sync:
+    `after` is how a member catches up on a group.
+    """
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either 'before' or 'after', not both"
+        )
+    await ensure_member(group_id, user_id)
+
+    key = tuple_(Message.timestamp, Message.id)
+    backwards = after is None
+    # A single range of ix_messages_group; the plain timestamp bound prunes partitions
+    stmt = select(Message).options(selectinload(Message.attachments)).where(Message.group_id == group_id)
+    if backwards:
+        stmt = stmt.order_by(Message.timestamp.desc(), Message.id.desc())
+        if before:
+            timestamp, last_id = decode_cursor(before, datetime, int)
+            stmt = stmt.where(and_(key < tuple_(timestamp, last_id), Message.timestamp <= timestamp))
+    else:
+        stmt = stmt.order_by(Message.timestamp.asc(), Message.id.asc())
+        timestamp, last_id = decode_cursor(after, datetime, int)
+        stmt = stmt.where(and_(key > tuple_(timestamp, last_id), Message.timestamp >= timestamp))
+
+    result = await db.execute(stmt.limit(limit + 1))
+    messages = list(result.scalars().all())
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        last = messages[-1]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+    if backwards:
+        messages.reverse()
+
+    return model_response(MessagePage, {"items": messages, "next_cursor": next_cursor})
@@ -1,106 +1,394 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import and_, or_
+import math
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from sqlalchemy import and_, case, func, or_, tuple_, union_all
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload,aliased
+from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import Dict, List, Optional
 
-from core import get_db
-from models import Message, User
-from schemas import MessageCreate, MessageRead,UserRead
+from core import current_user_id, get_db, require_admin
+from core.export import ndjson_export
+from core.metrics import rate_limited
+from core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from core.serialization import model_response
+from models import Attachment, Conversation, GroupMember, Message, User
+from routers.ws_router import broadcast_receipt, message_rate_limit
+from schemas import ContactRead, MessageCreate, MessageRead, MessagePage, MessageSearchPage, ReadReceipt, ReadReceiptCreate
+import services.messages as message_service
+from services import involving, mark_read, receipt_state
+from services.directory import directory
+
+# Must match the configuration of the messages.search_vector generated column
+SEARCH_CONFIG = "simple"
+SNIPPET_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=20, MinWords=5, MaxFragments=2"
 
 router = APIRouter(
     prefix="/messages",
     tags=["messages"]
 )
 
-@router.get("/", response_model=List[MessageRead])
-async def get_messages(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Message)
-        .options(
-            selectinload(Message.attachments),
-            selectinload(Message.sender),
-            selectinload(Message.recipient)
+MESSAGE_COLUMNS = (
+    Message.id, Message.text, Message.sender_id, Message.recipient_id, Message.group_id, Message.timestamp
+)
+ATTACHMENT_COLUMNS = (
+    Attachment.id, Attachment.message_id, Attachment.filename, Attachment.url,
+    Attachment.content_type, Attachment.size, Attachment.uploaded_at,
+    Attachment.thumbnail_url, Attachment.placeholder
+)
+
+async def ensure_users_exist(*user_ids: int):
+    # Answered from the directory cache instead of failing on the foreign key
+    if not await directory.users_exist(user_ids):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+async def ensure_group_member(group_id: int, user_id: int):
+    members = await directory.group_members(group_id)
+    if members is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Group not found")
+    if user_id not in members:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of the group")
+
+def ensure_sender(message: Message, user_id: int):
+    if message.sender_id != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the sender can change the message")
+
+async def limit_message_writes(request: Request):
+    """
+    Dependency applying the per-user message rate limit, the same bucket the user's
+    sockets draw from. Over the limit the request is answered with 429 and a structured
+    detail before the body is processed any further.
+    """
+    user = getattr(request.state, "user", None) or {}
+    key = user.get("uid") or user.get("sub")
+    if key is None:
+        return
+    retry_after = await message_rate_limit.acquire(key)
+    if retry_after:
+        rate_limited.inc("user")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail={"code": "rate_limited", "detail": "Too many messages, slow down", "retry_after": round(retry_after, 3)},
+            headers={"Retry-After": str(math.ceil(retry_after))}
         )
-        .order_by(Message.timestamp)
-    )
-    messages = result.scalars().all()
-    return messages
 
-@router.post("/add", status_code=status.HTTP_201_CREATED)
-async def create_message(message: MessageCreate, db: AsyncSession = Depends(get_db)):
-    new_message = Message(
+@router.get("/", response_model=MessagePage)
+async def get_messages(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    admin: dict = Depends(require_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Admin only: lists all messages by id, one page at a time. Only the columns MessageRead needs
+    are selected, attachments come from a second query for the page only.
+    """
+    stmt = select(*MESSAGE_COLUMNS).order_by(Message.id).limit(limit + 1)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, int)
+        stmt = stmt.where(Message.id > last_id)
+    result = await db.execute(stmt)
+    messages = [dict(row._mapping) for row in result]
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1]["id"])
+
+    await add_attachments(db, messages)
+    return model_response(MessagePage, {"items": messages, "next_cursor": next_cursor})
+
+async def add_attachments(db: AsyncSession, messages: List[dict]):
+    """
+    Fills in the attachments of projected message rows with one query for all of them.
+    """
+    attachments: Dict[int, List[dict]] = {}
+    if messages:
+        result = await db.execute(
+            select(*ATTACHMENT_COLUMNS).where(Attachment.message_id.in_([m["id"] for m in messages]))
+        )
+        for row in result:
+            attachments.setdefault(row.message_id, []).append(dict(row._mapping))
+    for message in messages:
+        message["attachments"] = attachments.get(message["id"], [])
+
+@router.get("/export")
+async def export_messages(admin: dict = Depends(require_admin)):
+    """
+    Admin only: every message as NDJSON, streamed from a server-side cursor.
+    """
+    return ndjson_export(select(*MESSAGE_COLUMNS).order_by(Message.id))
+
+@router.post("/add", status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_message_writes)])
+async def create_message(
+    message: MessageCreate,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    The sender is the caller from the token, whatever sender_id the body gives.
+    """
+    if message.group_id is not None:
+        await ensure_group_member(message.group_id, user_id)
+    else:
+        await ensure_users_exist(user_id, message.recipient_id)
+    return await message_service.create_message(
+        db,
         text=message.text,
-        sender_id=message.sender_id,
-        recipient_id=message.recipient_id
+        sender_id=user_id,
+        recipient_id=message.recipient_id,
+        attachment_ids=message.attachments or (),
+        group_id=message.group_id
     )
-    db.add(new_message)
-    await db.commit()
-    await db.refresh(new_message)
-    return new_message
 
-@router.delete("/delete/{message_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_message(message_id:int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Message).where(Message.id == message_id))
-    message_to_delete = result.scalars().first()
+@router.delete(
+    "/delete/{message_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(limit_message_writes)]
+)
+async def delete_message(
+    message_id:int,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    message_to_delete = await message_service.get_message(db, message_id)
     if not message_to_delete:
         raise HTTPException(status_code=404, detail="Message not found")
-    await db.delete(message_to_delete)
-    await db.commit()
+    ensure_sender(message_to_delete, user_id)
+    await message_service.delete_message(db, message_to_delete)
 
-@router.put("/update/{message_id}", response_model=MessageRead, status_code=status.HTTP_200_OK)
-async def update_message(message_id:int, message: MessageCreate, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Message).where(Message.id == message_id).options(selectinload(Message.attachments)))
-    message_to_update = result.scalars().first()
+@router.put(
+    "/update/{message_id}", response_model=MessageRead, status_code=status.HTTP_200_OK,
+    dependencies=[Depends(limit_message_writes)]
+)
+async def update_message(
+    message_id:int,
+    message: MessageCreate,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    message_to_update = await message_service.get_message(db, message_id, with_attachments=True)
 
     if not message_to_update:
         raise HTTPException(status_code=404,detail="Message not found")
-    
-    message_to_update.text = message.text
-    message_to_update.sender_id = message.sender_id
-    message_to_update.recipient_id = message.recipient_id
+    ensure_sender(message_to_update, user_id)
+    # Only the text is edited. A group message ignores the rest of the body, a direct
+    # one refuses a body that would credit it to someone else or move it
+    if message_to_update.group_id is None and (
+        message.sender_id != user_id or message.recipient_id != message_to_update.recipient_id
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="The sender and recipient of a message cannot be changed"
+        )
+
+    return await message_service.update_message(db, message_to_update, text=message.text)
+
+
+@router.get("/contacts", response_model=List[ContactRead])
+async def get_contacts(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Lists the user's conversations, most recent first, with a preview of the last message.
+    Reads only the conversations table and the rows it points at.
+    The caller comes from the token; a current_user_id query parameter is ignored.
+    """
+    is_low = Conversation.user_low_id == user_id
+    peer_id = case((is_low, Conversation.user_high_id), else_=Conversation.user_low_id)
+    unread_count = case((is_low, Conversation.unread_low), else_=Conversation.unread_high)
+    last_read = case((is_low, Conversation.last_read_low), else_=Conversation.last_read_high)
+    peer_delivered = case((is_low, Conversation.last_delivered_high), else_=Conversation.last_delivered_low)
+    peer_read = case((is_low, Conversation.last_read_high), else_=Conversation.last_read_low)
+    stmt = (
+        select(
+            User.id,
+            User.username,
+            User.email,
+            User.created_at,
+            Conversation.last_activity,
+            unread_count.label("unread_count"),
+            last_read.label("last_read_message_id"),
+            peer_delivered.label("peer_delivered_message_id"),
+            peer_read.label("peer_read_message_id"),
+            Message.id.label("message_id"),
+            Message.text,
+            Message.sender_id,
+            Message.timestamp,
+        )
+        .select_from(Conversation)
+        .join(User, User.id == peer_id)
+        .outerjoin(Message, Message.id == Conversation.last_message_id)
+        .where(involving(user_id))
+        .where(User.id != user_id)
+        .order_by(Conversation.last_activity.desc())
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+
+    return model_response(List[ContactRead], [
+        {
+            "id": row.id,
+            "username": row.username,
+            "email": row.email,
+            "created_at": row.created_at,
+            "last_activity": row.last_activity,
+            "unread_count": row.unread_count,
+            "last_read_message_id": row.last_read_message_id,
+            "peer_delivered_message_id": row.peer_delivered_message_id,
+            "peer_read_message_id": row.peer_read_message_id,
+            "last_message": None if row.message_id is None else {
+                "id": row.message_id,
+                "text": row.text,
+                "sender_id": row.sender_id,
+                "timestamp": row.timestamp,
+            },
+        }
+        for row in result
+    ])
+
+@router.post("/read", response_model=ReadReceipt)
+async def mark_conversation_read(
+    receipt: ReadReceiptCreate,
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Marks everything up to `message_id` in the conversation with `peer_id` as read:
+    one write whatever the number of messages. Both users' sockets get a "read" event.
+    """
+    state = await mark_read(db, user_id, receipt.peer_id, receipt.message_id)
+    if state is None:
+        # Already read that far: nothing to write or announce
+        state = await receipt_state(db, user_id, receipt.peer_id)
+        if state is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Conversation not found")
+        return {"peer_id": receipt.peer_id, **state}
 
-    db.add(message_to_update)
     await db.commit()
-    await db.refresh(message_to_update)
+    await broadcast_receipt("read", user_id, receipt.peer_id, state)
+    return {"peer_id": receipt.peer_id, **state}
 
-    return message_to_update
+@router.get("/search", response_model=MessageSearchPage)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=256),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Full-text search over the caller's conversations and groups, best matches first.
+    `q` accepts web search syntax ("quoted phrases", -excluded, or).
+    Snippets highlight matches with <mark> and are only built for the returned page.
+    """
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    rank = func.ts_rank_cd(Message.search_vector, query).label("rank")
 
+    matches = (
+        select(Message.id, Message.timestamp, rank)
+        .where(Message.search_vector.op("@@")(query))
+        .where(or_(
+            Message.sender_id == user_id,
+            Message.recipient_id == user_id,
+            Message.group_id.in_(select(GroupMember.group_id).where(GroupMember.user_id == user_id))
+        ))
+    )
+    if cursor:
+        last_rank, last_id = decode_cursor(cursor, float, int)
+        matches = matches.where(tuple_(rank, Message.id) < tuple_(last_rank, last_id))
+    page = matches.order_by(rank.desc(), Message.id.desc()).limit(limit + 1).subquery()
 
-@router.get("/contacts", response_model=List[UserRead])
-async def get_contacts(current_user_id: int, db: AsyncSession = Depends(get_db)):
-    user_alias = aliased(User)
+    snippet = func.ts_headline(SEARCH_CONFIG, Message.text, query, SNIPPET_OPTIONS).label("snippet")
     stmt = (
-        select(user_alias)
-        .join(
-            Message,
-            or_(
-                (Message.sender_id == current_user_id) & (Message.recipient_id == user_alias.id),
-                (Message.recipient_id == current_user_id) & (Message.sender_id == user_alias.id)
-            )
+        select(
+            Message.id, Message.sender_id, Message.recipient_id, Message.group_id, Message.timestamp,
+            page.c.rank, snippet
         )
-        .where(user_alias.id != current_user_id) 
-        .distinct()
+        # By the whole primary key, each row is read from its own partition only
+        .join(page, and_(page.c.id == Message.id, page.c.timestamp == Message.timestamp))
+        .order_by(page.c.rank.desc(), Message.id.desc())
     )
     result = await db.execute(stmt)
-    contacts = result.scalars().all()
-    return contacts
+    items = [dict(row._mapping) for row in result]
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["rank"], items[-1]["id"])
+    return model_response(MessageSearchPage, {"items": items, "next_cursor": next_cursor})
+
+@router.get("/{user1_id}/{user2_id}", response_model=MessagePage)
+async def get_messages_between_users(
+    user1_id: int,
+    user2_id: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Returns one page of the conversation in chronological order, to its two users only.
+    Without a cursor the newest page is returned, `before` scrolls back in history
+    and `after` fetches newer messages. `next_cursor` continues in the same direction.
+    """
+    if user_id not in (user1_id, user2_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a participant of the conversation")
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either 'before' or 'after', not both"
+        )
+
+    key = tuple_(Message.timestamp, Message.id)
+    backwards = after is None
+    # The plain timestamp bound is implied by the row comparison, but only it lets
+    # PostgreSQL skip the monthly partitions of messages the page cannot be in
+    if backwards:
+        order = (Message.timestamp.desc(), Message.id.desc())
+        keyset = None
+        if before:
+            timestamp, last_id = decode_cursor(before, datetime, int)
+            keyset = and_(key < tuple_(timestamp, last_id), Message.timestamp <= timestamp)
+    else:
+        order = (Message.timestamp.asc(), Message.id.asc())
+        timestamp, last_id = decode_cursor(after, datetime, int)
+        keyset = and_(key > tuple_(timestamp, last_id), Message.timestamp >= timestamp)
+
+    # One bounded index range scan per direction of the conversation,
+    # so the cost of a page does not depend on how deep into history it is
+    branches = []
+    for sender_id, recipient_id in ((user1_id, user2_id), (user2_id, user1_id)):
+        branch = select(Message.id, Message.timestamp).where(
+            Message.sender_id == sender_id,
+            Message.recipient_id == recipient_id
+        )
+        if keyset is not None:
+            branch = branch.where(keyset)
+        branches.append(branch.order_by(*order).limit(limit + 1).subquery())
+    # Looked up by the whole primary key, so each row is fetched from its own partition
+    page_keys = union_all(*(select(branch.c.id, branch.c.timestamp) for branch in branches))
 
-@router.get("/{user1_id}/{user2_id}", response_model=List[MessageRead])
-async def get_messages_between_users(user1_id: int, user2_id: int, db: AsyncSession = Depends(get_db)):
     stmt = (
         select(Message)
         .options(selectinload(Message.attachments))
-        .where(
-            or_(
-                and_(Message.sender_id == user1_id, Message.recipient_id == user2_id),
-                and_(Message.sender_id == user2_id, Message.recipient_id == user1_id),
-            )
-        )
-        .order_by(Message.timestamp)
+        .where(tuple_(Message.id, Message.timestamp).in_(page_keys))
+        .order_by(*order)
+        .limit(limit + 1)
     )
+    if keyset is not None:
+        stmt = stmt.where(keyset)
 
     result = await db.execute(stmt)
-    messages = result.scalars().all()
-    return messages
+    messages = list(result.scalars().all())
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        last = messages[-1]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+    if backwards:
+        messages.reverse()
+
+    return model_response(MessagePage, {"items": messages, "next_cursor": next_cursor})
@@ -0,0 +1,57 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from core import current_user_id, get_db
+from core.serialization import model_response
+from models import Message
+from routers.messages import MESSAGE_COLUMNS, add_attachments
+from schemas import SyncPage
+from services.changes import changes_since, current_seq
+
+SYNC_BATCH_SIZE = 500
+MAX_SYNC_BATCH_SIZE = 2000
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+
+@router.get("", response_model=SyncPage)
+async def sync(
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(SYNC_BATCH_SIZE, ge=1, le=MAX_SYNC_BATCH_SIZE),
+    user_id: int = Depends(current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Catches a client up after it was offline: the messages created, edited or deleted
+    in the caller's conversations since `since`, folded to one entry per message.
+    Apply `upserts` and `deletes`, then call again with `cursor` while `has_more`.
+    Without `since` only the current cursor is returned, to start from after a full load.
+    Group messages are not logged per member, groups catch up through /groups/{id}/messages.
+    """
+    if since is None:
+        return model_response(SyncPage, {"cursor": await current_seq(db, user_id)})
+
+    upsert_ids, delete_ids, cursor, has_more = await changes_since(db, user_id, since, limit)
+
+    messages = []
+    if upsert_ids:
+        result = await db.execute(
+            select(*MESSAGE_COLUMNS).where(
+                Message.id.in_(upsert_ids),
+                or_(Message.sender_id == user_id, Message.recipient_id == user_id)
+            )
+        )
+        found = {row.id: dict(row._mapping) for row in result}
+        messages = [found[message_id] for message_id in upsert_ids if message_id in found]
+        # Deleted or moved away in a later batch, no longer the caller's to see
+        delete_ids += [message_id for message_id in upsert_ids if message_id not in found]
+    await add_attachments(db, messages)
+
+    return model_response(SyncPage, {
+        "upserts": messages,
+        "deletes": delete_ids,
+        "cursor": cursor,
+        "has_more": has_more,
+    })
@@ -1,19 +1,32 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete
+from sqlalchemy import delete, func
 from models import User
-from schemas import UserCreate, UserRead
-from core import hash_password, get_db
+from schemas import UserCreate, UserPage, UserRead
+from core import hash_password_async, get_db
 from fastapi.security import OAuth2PasswordBearer,OAuth2PasswordRequestForm
-from core import verify_password, create_access_token
+from core import verify_and_update_password, create_access_token, revoke_token, require_admin
+from core.cache import TTLCache
+from core.config import USER_SEARCH_CACHE_SIZE, USER_SEARCH_CACHE_TTL
+from core.export import ndjson_export
+from core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from core.serialization import model_response
+from services import delete_user_messages
+from services.revocations import store_revocation
+from routers.ws_router import manager
+
+USER_SEARCH_PAGE_SIZE = 20
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Recent search results by (term, limit, offset): type-ahead repeats the same prefixes
+_search_cache = TTLCache(maxsize=USER_SEARCH_CACHE_SIZE, ttl=USER_SEARCH_CACHE_TTL)
+
 @router.post("/register", response_model=UserRead)
 async def register_user(user_in: UserCreate, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User).where(User.username == user_in.username or User.email == user_in.email ))
@@ -26,30 +39,95 @@ async def register_user(user_in: UserCreate, db: AsyncSession = Depends(get_db))
     user = User(
         username=user_in.username,
         email=user_in.email,
-        password_hash=hash_password(user_in.password)
+        password_hash=await hash_password_async(user_in.password)
     )
     db.add(user)
     await db.commit()
     await db.refresh(user)
+    invalidate_user_search()
+    # Drops "no such user" entries cached for this id or name, in every process
+    await manager.user_changed(user.id, user.username)
     return user
 
 
-@router.get("/", response_model=List[UserRead])
-async def get_all_users(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User))
-    users = result.scalars().all()
-    return users
+USER_COLUMNS = (User.id, User.username, User.email, User.created_at)
+
+@router.get("/", response_model=UserPage)
+async def get_all_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db)
+):
+    stmt = select(*USER_COLUMNS).order_by(User.id).limit(limit + 1)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, int)
+        stmt = stmt.where(User.id > last_id)
+    result = await db.execute(stmt)
+    users = [dict(row._mapping) for row in result]
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1]["id"])
+    return model_response(UserPage, {"items": users, "next_cursor": next_cursor})
+
+@router.get("/export")
+async def export_users(admin: dict = Depends(require_admin)):
+    """
+    Admin only: every user as NDJSON, streamed from a server-side cursor.
+    """
+    return ndjson_export(select(*USER_COLUMNS).order_by(User.id))
 
 @router.get("/{user_name}", response_model=List[UserRead])
-async def get_user_by_id(user_name:str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).where(User.username.ilike(f"%{user_name}%")))
-    users = result.scalars().all()
+async def get_user_by_id(
+    user_name: str,
+    limit: int = Query(USER_SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Type-ahead user search: prefix matches first, then by trigram similarity.
+    Terms shorter than a trigram only match as a prefix.
+    """
+    term = user_name.strip().lower()
+    cache_key = (term, limit, offset)
+    users = _search_cache.get(cache_key)
+    if users is None:
+        users = await _search_users(db, term, limit, offset)
+        _search_cache.set(cache_key, users)
+
     if not users:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User does not exist"
         )
-    return users
+    return model_response(List[UserRead], users)
+
+async def _search_users(db: AsyncSession, term: str, limit: int, offset: int) -> List[dict]:
+    escaped = _escape_like(term)
+    # Served by ix_users_username_lower_prefix
+    is_prefix = func.lower(User.username).like(f"{escaped}%", escape="!")
+    stmt = select(*USER_COLUMNS)
+    if len(term) < 3:
+        stmt = stmt.where(is_prefix).order_by(func.lower(User.username))
+    else:
+        # Served by the pg_trgm GIN index ix_users_username_trgm
+        stmt = stmt.where(User.username.ilike(f"%{escaped}%", escape="!")).order_by(
+            is_prefix.desc(),
+            func.similarity(User.username, term).desc(),
+            User.username
+        )
+    result = await db.execute(stmt.limit(limit).offset(offset))
+    return [dict(row._mapping) for row in result]
+
+def _escape_like(term: str) -> str:
+    return term.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+
+def invalidate_user_search():
+    _search_cache.clear()
+
+def user_search_stats() -> dict:
+    return _search_cache.stats()
 
 @router.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends(),
@@ -58,27 +136,50 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(),
     result = await db.execute(select(User).where(User.username == form_data.username))
     user = result.scalars().first()
 
-    if not user or not verify_password(form_data.password, user.password_hash):
+    verified, new_hash = (False, None)
+    if user:
+        verified, new_hash = await verify_and_update_password(form_data.password, user.password_hash)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    token = create_access_token({"sub": user.username})
+    if new_hash:
+        # Hash made with an older cost factor, upgrade it transparently
+        user.password_hash = new_hash
+        await db.commit()
+
+    token = create_access_token({"sub": user.username, "uid": user.id})
     return {"access_token": token, "token_type": "bearer","user_id":user.id,"username":user.username}
 
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    """
+    Revokes the token on every worker until it expires.
+    """
+    revoked = revoke_token(token)
+    if revoked is None:
+        return
+    await store_revocation(db, *revoked)
+    await manager.token_revoked(*revoked)
+
 @router.delete("/delete/{user_name}", response_model=dict)
 async def delete_user_by_username(user_name: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(User).where(User.username == user_name))
-    user = result.scalars().first()
-    if not user:
+    # Not from the directory: it may still hold a "no such user" entry for a new user
+    result = await db.execute(select(User.id).where(User.username == user_name))
+    user_id = result.scalar()
+    if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User does not exist"
         )
     
-    await db.execute(delete(User).where(User.username == user_name))
+    await delete_user_messages(db, user_id)
+    await db.execute(delete(User).where(User.id == user_id))
     await db.commit()
+    invalidate_user_search()
+    await manager.user_changed(user_id, user_name)
 
     return {"detail": f"User '{user_name}' deleted successfully"}
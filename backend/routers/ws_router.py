@@ -1,11 +1,47 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import List, Dict
-from sqlalchemy import select
+import asyncio
+import logging
+import time
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Dict, Iterable, List, Optional, Set, Union
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from core import get_db, verify_token
-from models import Message
+from core import AsyncSessionLocal, engine, verify_token
+from core.auth import mark_revoked
+from core.broker import Broker, InProcessBroker, create_broker
+from core.config import (
+    BROKER_BACKEND, MESSAGE_BATCHING, MESSAGE_BATCH_DELAY_MS, MESSAGE_BATCH_SIZE,
+    MESSAGE_BURST_PER_CONNECTION, MESSAGE_BURST_PER_USER, MESSAGE_RATE_PER_CONNECTION, MESSAGE_RATE_PER_USER,
+    RATE_LIMIT_BACKEND, RATE_LIMIT_COMPACT_INTERVAL, RATE_LIMIT_REDIS_URL,
+    PRESENCE_OFFLINE_GRACE, PRESENCE_TICK_MS, TYPING_TIMEOUT,
+    WS_HEARTBEAT_INTERVAL, WS_HEARTBEAT_TIMEOUT, WS_QUEUE_POLICY, WS_QUEUE_SIZE, WS_SEND_TIMEOUT
+)
+from core.connections import STALE_CLOSE_CODE, Connection
+from core.metrics import REGISTRY, rate_limited, ws_broadcast_fanout, ws_broadcast_recipients
+from core.ratelimit import RateLimit, TokenBucket, create_rate_limit_backend
+from core.serialization import dumps
 from functools import wraps
-from schemas import MessageRead
+from models import Message
+from schemas import ClientFrame
+import services.messages as message_service
+from services import mark_delivered, mark_read, ordered_pair
+from services.directory import directory
+from services.message_pipeline import MessageWritePipeline
+from services.presence import PRESENCE_EVENT, PresenceTracker
+
+logger = logging.getLogger(__name__)
+
+# Client actions that write messages, and count against the rate limits
+WRITE_ACTIONS = ("add", "update", "delete")
+# Sent to every socket each heartbeat interval, answered with {"action": "pong"}
+PING = dumps({"action": "ping"})
+PONG = dumps({"action": "pong"})
+# Broker events of this kind tell other processes a group's members changed
+GROUP_MEMBERS_EVENT = "group_members"
+# Broker events of this kind tell other processes a user was created or deleted
+USER_CHANGED_EVENT = "user_changed"
+# Broker events of this kind tell other processes a token was revoked
+TOKEN_REVOKED_EVENT = "token_revoked"
 
 ws_router = APIRouter(prefix="/ws", tags=["websockets"])
 
@@ -15,54 +51,614 @@ def get_chat_id(user1_id: int, user2_id: int) -> str:
     Returns string in order from lowest to biggest so that the order won
     't matter.
     """
-    sorted_ids = sorted([user1_id, user2_id])
-    return f"{sorted_ids[0]}_{sorted_ids[1]}"
+    low, high = ordered_pair(user1_id, user2_id)
+    return f"{low}_{high}"
+
+def chat_participants(chat_id: str) -> Optional[Set[int]]:
+    """
+    Parses a chat_id built by get_chat_id back into its user ids, None if malformed.
+    """
+    try:
+        low, high = (int(part) for part in chat_id.split("_"))
+    except (AttributeError, ValueError):
+        return None
+    return {low, high}
+
+def group_chat_id(group_id: int) -> str:
+    return f"g{group_id}"
+
+def chat_group_id(chat_id: str) -> Optional[int]:
+    """
+    Parses a chat_id built by group_chat_id back into the group id, None for a
+    direct chat or if malformed.
+    """
+    if not isinstance(chat_id, str) or not chat_id.startswith("g"):
+        return None
+    try:
+        return int(chat_id[1:])
+    except ValueError:
+        return None
+
+def message_chat_id(message) -> str:
+    if message.group_id is not None:
+        return group_chat_id(message.group_id)
+    return get_chat_id(message.sender_id, message.recipient_id)
 
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(
+        self,
+        broker: Optional[Broker] = None,
+        queue_size: int = WS_QUEUE_SIZE,
+        queue_policy: str = WS_QUEUE_POLICY,
+        send_timeout: float = WS_SEND_TIMEOUT,
+        heartbeat_interval: float = WS_HEARTBEAT_INTERVAL,
+        heartbeat_timeout: float = WS_HEARTBEAT_TIMEOUT
+    ):
         # Save active chats
         # Key: chat_id (string, example "1_2")
-        # Value: dictionary {user_id: WebSocket}
-        self.active_chats: Dict[str, Dict[int, WebSocket]] = {}
+        # Value: connections subscribed to the chat
+        self.active_chats: Dict[str, Set[Connection]] = {}
+        # Key: user_id, Value: every connection (device) of that user
+        self.user_connections: Dict[int, Set[Connection]] = {}
+        # Key: user_id, Value: the active chats that user takes part in, whoever subscribed
+        self.user_chats: Dict[int, Set[str]] = {}
+        # Carries events to the sockets held by other workers/pods
+        self.broker = broker or InProcessBroker()
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.presence = PresenceTracker(
+            self,
+            tick=PRESENCE_TICK_MS / 1000,
+            offline_grace=PRESENCE_OFFLINE_GRACE,
+            typing_timeout=TYPING_TIMEOUT,
+            beacon_interval=heartbeat_interval,
+            node_timeout=heartbeat_timeout
+        )
+        # Totals carried over from connections that are gone
+        self.closed_dropped = 0
+        self.evicted = 0
 
-    async def connect(self, chat_id: str, user_id: int, websocket: WebSocket):
+    async def start(self):
+        await self.broker.start(self._deliver_remote)
+        self.presence.start()
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        await self.presence.stop()
+        await self.broker.stop()
+
+    async def connect(self, user_id: int, websocket: WebSocket, multiplexed: bool = False) -> Connection:
         await websocket.accept()
-        if chat_id not in self.active_chats:
-            self.active_chats[chat_id] = {}
-        self.active_chats[chat_id][user_id] = websocket
-        print(f"User {user_id} connected to chat {chat_id}")
-
-    def disconnect(self, chat_id: str, user_id: int):
-        if chat_id in self.active_chats and user_id in self.active_chats[chat_id]:
-            del self.active_chats[chat_id][user_id]
-            if not self.active_chats[chat_id]:
+        connection = Connection(
+            websocket,
+            user_id,
+            multiplexed=multiplexed,
+            max_queue=self.queue_size,
+            policy=self.queue_policy,
+            send_timeout=self.send_timeout,
+            on_close=self.disconnect
+        )
+        connection.start()
+        self.user_connections.setdefault(user_id, set()).add(connection)
+        self.presence.connected(user_id)
+        logger.debug("User %s connected", user_id)
+        return connection
+
+    def disconnect(self, connection: Connection):
+        for chat_id in list(connection.subscriptions):
+            self.unsubscribe(connection, chat_id)
+        devices = self.user_connections.get(connection.user_id)
+        if devices is None or connection not in devices:
+            return
+        devices.discard(connection)
+        if not devices:
+            del self.user_connections[connection.user_id]
+            self.presence.disconnected(connection.user_id)
+        self.closed_dropped += connection.dropped
+        if not connection.closed:
+            asyncio.create_task(connection.close())
+        logger.debug("User %s disconnected", connection.user_id)
+
+    def subscribe(self, connection: Connection, chat_id: str):
+        connection.subscriptions.add(chat_id)
+        subscribers = self.active_chats.get(chat_id)
+        if subscribers is None:
+            subscribers = self.active_chats[chat_id] = set()
+            for user_id in chat_participants(chat_id) or ():
+                self.user_chats.setdefault(user_id, set()).add(chat_id)
+        subscribers.add(connection)
+
+    def unsubscribe(self, connection: Connection, chat_id: str):
+        connection.subscriptions.discard(chat_id)
+        subscribers = self.active_chats.get(chat_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
                 del self.active_chats[chat_id]
-        print(f"User {user_id} disconnected from chat {chat_id}")
+                for user_id in chat_participants(chat_id) or ():
+                    chats = self.user_chats.get(user_id)
+                    if chats is not None:
+                        chats.discard(chat_id)
+                        if not chats:
+                            del self.user_chats[user_id]
+
+    def watchers(self, user_id: int) -> Set[Connection]:
+        """
+        Sockets of other users subscribed to a chat with `user_id`: the audience of their presence.
+        """
+        watchers = set()
+        for chat_id in self.user_chats.get(user_id, ()):
+            watchers.update(self.active_chats[chat_id])
+        return {connection for connection in watchers if connection.user_id != user_id}
+
+    def chat_targets(self, chat_id: str, exclude_user_id: Optional[int] = None) -> Set[Connection]:
+        """
+        Sockets an event of the chat goes to: its subscribers and its participants' sessions.
+        """
+        targets = self._targets(chat_id, chat_participants(chat_id) or ())
+        return {connection for connection in targets if connection.user_id != exclude_user_id}
+
+    async def send_personal_message(self, user_id: int, message: dict, coalesce_key: Optional[str] = None):
+        """
+        Delivers to every device of the user, whatever chats they are subscribed to.
+        """
+        payload = dumps(message)
+        self._send_local(None, (user_id,), payload, coalesce_key, all_connections=True)
+        await self.broker.publish({
+            "chat_id": None, "user_ids": [user_id], "message": payload, "coalesce_key": coalesce_key
+        })
+
+    async def broadcast(self, chat_id: str, message: dict, user_ids: Iterable[int] = (), coalesce_key: Optional[str] = None):
+        """
+        Delivers to the chat's subscribers and to the multiplexed sessions of `user_ids`,
+        so participants get the event on every device even without subscribing.
+        The event is encoded once: every socket, and every other node, gets the same text.
+        """
+        user_ids = list(user_ids)
+        payload = dumps(message)
+        self._send_local(chat_id, user_ids, payload, coalesce_key)
+        await self.broker.publish({
+            "chat_id": chat_id, "user_ids": user_ids, "message": payload, "coalesce_key": coalesce_key
+        })
+
+    def online(self, user_ids: Set[int]) -> List[int]:
+        """
+        The users among `user_ids` with a socket on this process. Walks whichever of the
+        two is smaller, so a large group with few members online costs what they do.
+        """
+        if len(user_ids) <= len(self.user_connections):
+            return [user_id for user_id in user_ids if user_id in self.user_connections]
+        return [user_id for user_id in self.user_connections if user_id in user_ids]
+
+    async def broadcast_group(
+        self,
+        group_id: int,
+        message: dict,
+        member_ids: Set[int],
+        coalesce_key: Optional[str] = None
+    ):
+        """
+        Delivers to the group chat's subscribers and to the multiplexed sessions of its
+        online members. The broker event names the group only, a member list would not
+        fit in it: other processes look the members up in their own directory cache.
+        """
+        chat_id = group_chat_id(group_id)
+        payload = dumps(message)
+        self._send_local(chat_id, self.online(member_ids), payload, coalesce_key)
+        await self.broker.publish({
+            "chat_id": chat_id, "user_ids": [], "group_id": group_id, "message": payload, "coalesce_key": coalesce_key
+        })
+
+    async def group_changed(self, group_id: int, removed_user_ids: Iterable[int] = ()):
+        """
+        To call once a change to the group's members is committed: drops the cached
+        member list and the removed users' subscriptions to the group, on every process.
+        """
+        removed_user_ids = list(removed_user_ids)
+        await self._apply_group_change(group_id, removed_user_ids)
+        await self.broker.publish({"kind": GROUP_MEMBERS_EVENT, "group_id": group_id, "removed": removed_user_ids})
 
-    async def send_personal_message(self, chat_id: str, user_id: int, message: dict):
-        ws = self.active_chats.get(chat_id, {}).get(user_id)
-        if ws:
-            await ws.send_json(message)
+    async def user_changed(self, user_id: int, username: str):
+        """
+        To call once a user is created or deleted: drops the cached facts about the
+        user, "no such user" entries included, on every process.
+        """
+        await directory.invalidate_user(user_id, username)
+        await self.broker.publish({"kind": USER_CHANGED_EVENT, "user_id": user_id, "username": username})
 
-    async def broadcast(self, chat_id: str, message: dict):
-        for ws in self.active_chats.get(chat_id, {}).values():
-            await ws.send_json(message)
+    async def token_revoked(self, digest: bytes, expires_at: float):
+        """
+        Makes the other processes reject a token this one revoked.
+        """
+        await self.broker.publish({"kind": TOKEN_REVOKED_EVENT, "digest": digest.hex(), "expires_at": expires_at})
 
-manager = ConnectionManager()
+    def stats(self) -> dict:
+        """
+        Queue depth and drop counters, slowest clients first.
+        """
+        connections = [c for devices in self.user_connections.values() for c in devices]
+        connections.sort(key=lambda c: (c.depth, c.dropped), reverse=True)
+        return {
+            "connections": len(connections),
+            "users": len(self.user_connections),
+            "chats": len(self.active_chats),
+            "queued": sum(c.depth for c in connections),
+            "dropped": self.closed_dropped + sum(c.dropped for c in connections),
+            "evicted": self.evicted,
+            "presence": self.presence.stats(),
+            "slowest": [c.stats() for c in connections[:10] if c.depth or c.dropped],
+        }
+
+    def _send_local(
+        self,
+        chat_id: Optional[str],
+        user_ids: Iterable[int],
+        message: Union[str, dict],
+        coalesce_key: Optional[str] = None,
+        all_connections: bool = False
+    ):
+        # Enqueue only: every connection's writer task does the actual sending
+        start = time.perf_counter()
+        targets = self._targets(chat_id, user_ids, all_connections)
+        for connection in targets:
+            connection.enqueue(message, coalesce_key)
+        ws_broadcast_fanout.observe(time.perf_counter() - start)
+        ws_broadcast_recipients.observe(len(targets))
+
+    def _targets(self, chat_id: Optional[str], user_ids: Iterable[int], all_connections: bool = False) -> Set[Connection]:
+        targets = set(self.active_chats.get(chat_id, ())) if chat_id else set()
+        for user_id in user_ids:
+            for connection in self.user_connections.get(user_id, ()):
+                if all_connections or connection.multiplexed:
+                    targets.add(connection)
+        return targets
+
+    async def _heartbeat_loop(self):
+        """
+        Pings every socket and evicts those silent for longer than heartbeat_timeout.
+        A dead peer may never raise WebSocketDisconnect, this is what frees its chats.
+        """
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            deadline = time.monotonic() - self.heartbeat_timeout
+            for connection in [c for devices in self.user_connections.values() for c in devices]:
+                if connection.last_seen < deadline:
+                    logger.info("Evicting stale socket of user %s", connection.user_id)
+                    self.evicted += 1
+                    connection.evict(STALE_CLOSE_CODE)
+                else:
+                    connection.enqueue(PING, coalesce_key="ping")
+
+    async def _apply_group_change(self, group_id: int, removed_user_ids: List[int]):
+        await directory.invalidate_group(group_id)
+        chat_id = group_chat_id(group_id)
+        for user_id in removed_user_ids:
+            for connection in list(self.user_connections.get(user_id, ())):
+                if chat_id in connection.subscriptions:
+                    self.unsubscribe(connection, chat_id)
+                    connection.enqueue({"action": "unsubscribed", "chat_id": chat_id})
+
+    async def _deliver_remote(self, event: dict):
+        kind = event.get("kind")
+        if kind == PRESENCE_EVENT:
+            self.presence.apply_remote(event)
+            return
+        if kind == GROUP_MEMBERS_EVENT:
+            await self._apply_group_change(event["group_id"], event["removed"])
+            return
+        if kind == USER_CHANGED_EVENT:
+            await directory.invalidate_user(event["user_id"], event["username"])
+            return
+        if kind == TOKEN_REVOKED_EVENT:
+            mark_revoked(bytes.fromhex(event["digest"]), event["expires_at"])
+            return
+        user_ids = event["user_ids"]
+        if event.get("group_id") is not None:
+            user_ids = self.online(await directory.group_members(event["group_id"]) or set())
+        self._send_local(
+            event["chat_id"],
+            user_ids,
+            event["message"],
+            event.get("coalesce_key"),
+            all_connections=event["chat_id"] is None
+        )
+
+manager = ConnectionManager(create_broker(BROKER_BACKEND, engine))
+
+REGISTRY.gauge(
+    "ws_connections", "Open WebSocket connections",
+    callback=lambda: sum(len(devices) for devices in manager.user_connections.values())
+)
+REGISTRY.gauge("ws_users", "Users with at least one open WebSocket", callback=lambda: len(manager.user_connections))
+REGISTRY.gauge("ws_chats", "Chats with at least one subscriber", callback=lambda: len(manager.active_chats))
+REGISTRY.gauge("ws_online_users", "Users shown online", callback=lambda: manager.presence.stats()["online"])
+REGISTRY.gauge(
+    "ws_queued_messages", "Events waiting in outbound socket queues",
+    callback=lambda: sum(c.depth for devices in manager.user_connections.values() for c in devices)
+)
+
+# Optional micro-batching of new messages, see MessageWritePipeline
+pipeline = MessageWritePipeline(
+    AsyncSessionLocal, max_batch=MESSAGE_BATCH_SIZE, max_delay=MESSAGE_BATCH_DELAY_MS / 1000
+) if MESSAGE_BATCHING else None
+
+# Message writes per user, over REST and every socket of the user.
+# Shared by all workers with RATE_LIMIT_BACKEND=redis
+message_rate_limit = RateLimit(
+    create_rate_limit_backend(RATE_LIMIT_BACKEND, RATE_LIMIT_COMPACT_INTERVAL, RATE_LIMIT_REDIS_URL),
+    MESSAGE_RATE_PER_USER,
+    MESSAGE_BURST_PER_USER,
+    prefix="messages:user:"
+)
+
+async def check_message_rate(connection: Connection) -> float:
+    """
+    Seconds before the connection may write again, 0 if it may go ahead now.
+    Its own bucket is checked first and in process, then its user's. connection.user_id
+    is the token's uid on both endpoints, so a user cannot spread writes over other ids.
+    """
+    if MESSAGE_RATE_PER_CONNECTION > 0:
+        now = time.monotonic()
+        if connection.rate_bucket is None:
+            connection.rate_bucket = TokenBucket(MESSAGE_BURST_PER_CONNECTION, now)
+        retry_after = connection.rate_bucket.take(MESSAGE_RATE_PER_CONNECTION, MESSAGE_BURST_PER_CONNECTION, now)
+        if retry_after:
+            rate_limited.inc("connection")
+            return retry_after
+    retry_after = await message_rate_limit.acquire(connection.user_id)
+    if retry_after:
+        rate_limited.inc("user")
+    return retry_after
 
 def ws_auth_required(func):
     @wraps(func)
     async def wrapper(websocket: WebSocket, *args, **kwargs):
         token = websocket.query_params.get("token")
-        print("Incoming WS connection, token:", token)
         user = verify_token(token)
         if not user:
             await websocket.close(code=1008)
             return
+        websocket.state.user = user
         await func(websocket, *args, **kwargs)
     return wrapper
 
+async def chat_members(chat_id: str) -> Optional[Set[int]]:
+    """
+    The users of a direct or group chat, None if the chat_id is malformed or they are gone.
+    """
+    group_id = chat_group_id(chat_id)
+    if group_id is not None:
+        return await directory.group_members(group_id)
+    participants = chat_participants(chat_id)
+    if not participants or not await directory.users_exist(participants):
+        return None
+    return participants
+
+async def receive_frame(websocket: WebSocket, connection: Connection) -> Optional[ClientFrame]:
+    """
+    Waits for the next client frame and validates it. A frame that is not valid JSON or
+    does not fit ClientFrame is answered with a "bad_request" error and None is returned.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    connection.touch()
+    try:
+        return ClientFrame.model_validate_json(message.get("text") or message.get("bytes") or "")
+    except ValidationError as exc:
+        connection.enqueue(error_event("bad_request", exc.errors()[0]["msg"]))
+        return None
+
+class NotMessageSender(Exception):
+    """
+    Raised when a user other than the sender tries to update or delete a message.
+    """
+
+def message_event(action: str, chat_id: str, message: dict) -> dict:
+    return {"action": action, "chat_id": chat_id, "message": message}
+
+def error_event(code: str, detail: str, client_id: Optional[str] = None, retry_after: Optional[float] = None) -> dict:
+    event = {"action": "error", "error": {"code": code, "detail": detail}}
+    if retry_after is not None:
+        event["error"]["retry_after"] = round(retry_after, 3)
+    if client_id is not None:
+        event["client_id"] = client_id
+    return event
+
+async def handle_message_action(
+    connection: Connection,
+    action: str,
+    message_data: dict,
+    client_id: Optional[str] = None
+):
+    """
+    Applies an add/update/delete and fans the result out to the chat it belongs to.
+    A session is borrowed for this unit of work only, an idle socket holds no DB connection.
+    New messages carrying a client_id are acknowledged to the sender once committed,
+    or answered with an error frame so the client can retry.
+    A new message carries either a recipient_id or, for a group, a group_id.
+    Writes past the rate limits are answered with a "rate_limited" error carrying
+    retry_after, in seconds, and never reach the database. Only the sender of a
+    message may update or delete it, anyone else gets a "forbidden" error.
+    """
+    if action in WRITE_ACTIONS:
+        retry_after = await check_message_rate(connection)
+        if retry_after:
+            connection.enqueue(error_event("rate_limited", "Too many messages, slow down", client_id, retry_after))
+            return
+
+    if action == "add":
+        # A connection only speaks for its token's user, whatever sender_id the client sent
+        message_data["sender_id"] = connection.user_id
+    group_id = message_data.get("group_id") if action == "add" else None
+    if group_id is not None:
+        members = await directory.group_members(group_id)
+        if not members or message_data.get("sender_id") not in members:
+            connection.enqueue(error_event("forbidden", f"Not a member of group {group_id}", client_id))
+            return
+    elif action == "add" and not await directory.user_exists(message_data.get("recipient_id")):
+        # Would only fail on the foreign key, and take the rest of its batch down with it
+        connection.enqueue(error_event("not_found", "Recipient does not exist", client_id))
+        return
+
+    try:
+        if action == "add" and pipeline is not None:
+            new_message = await pipeline.submit(
+                text=message_data["text"],
+                sender_id=message_data["sender_id"],
+                recipient_id=message_data.get("recipient_id"),
+                attachment_ids=message_data.get("attachments") or (),
+                group_id=group_id
+            )
+        else:
+            async with AsyncSessionLocal() as db:
+                new_message = await _apply_message_action(db, action, message_data, connection.user_id)
+    except NotMessageSender:
+        connection.enqueue(error_event("forbidden", f"Only the sender can {action} the message", client_id))
+        return
+    except SQLAlchemyError:
+        logger.exception("Failed to %s message", action)
+        connection.enqueue(error_event("not_saved", f"Could not {action} the message", client_id))
+        return
+
+    if new_message is not None:
+        if client_id is not None:
+            connection.enqueue({"action": "ack", "client_id": client_id, "message": {"id": new_message.id}})
+        # Sending ends typing, without waiting for the timeout
+        manager.presence.typing(new_message.sender_id, message_chat_id(new_message), False)
+        await _broadcast_added(new_message)
+
+def receipt_event(action: str, chat_id: str, user_id: int, state: dict) -> dict:
+    return {
+        "action": action,
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "message_id": state["last_read"] if action == "read" else state["last_delivered"],
+        "unread_count": state["unread_count"],
+    }
+
+async def broadcast_receipt(action: str, user_id: int, peer_id: int, state: dict):
+    """
+    Tells every device of both users that user_id has read (or received) up to a message.
+    Coalesced per chat, reader and kind: a burst of receipts while scrolling leaves only
+    the newest watermark queued for a slow client.
+    """
+    chat_id = get_chat_id(user_id, peer_id)
+    await manager.broadcast(
+        chat_id,
+        receipt_event(action, chat_id, user_id, state),
+        user_ids=(user_id, peer_id),
+        coalesce_key=f"{action}:{chat_id}:{user_id}"
+    )
+
+async def handle_receipt(
+    connection: Connection,
+    action: str,
+    reader_id: int,
+    peer_id: int,
+    message_id,
+    client_id: Optional[str] = None
+):
+    """
+    Moves reader_id's read or delivery watermark in the chat with peer_id.
+    reader_id is the token's uid, never an id the client sent.
+    Receipts that do not move it are not broadcast.
+    """
+    if not isinstance(message_id, int):
+        connection.enqueue(error_event("bad_request", "message_id must be an integer", client_id))
+        return
+    mark = mark_read if action == "read" else mark_delivered
+    try:
+        async with AsyncSessionLocal() as db:
+            state = await mark(db, reader_id, peer_id, message_id)
+            await db.commit()
+    except SQLAlchemyError:
+        logger.exception("Failed to record %s receipt", action)
+        connection.enqueue(error_event("not_saved", f"Could not record the {action} receipt", client_id))
+        return
+    if state is not None:
+        await broadcast_receipt(action, reader_id, peer_id, state)
+
+async def broadcast_message_event(message, event: dict, coalesce_key: Optional[str] = None):
+    """
+    Sends an event about the message to the chat it belongs to: both users of a direct
+    chat, or the online members of a group.
+    """
+    if message.group_id is not None:
+        members = await directory.group_members(message.group_id) or set()
+        await manager.broadcast_group(message.group_id, event, members, coalesce_key=coalesce_key)
+    else:
+        await manager.broadcast(
+            event["chat_id"], event, user_ids=(message.sender_id, message.recipient_id), coalesce_key=coalesce_key
+        )
+
+async def _broadcast_added(new_message: Message):
+    message_out = message_event("add", message_chat_id(new_message), {
+        "id": new_message.id,
+        "text": new_message.text,
+        "sender_id": new_message.sender_id,
+        "recipient_id": new_message.recipient_id,
+        "group_id": new_message.group_id
+    })
+
+    await broadcast_message_event(new_message, message_out)
+
+async def _apply_message_action(
+    db: AsyncSession,
+    action: str,
+    message_data: dict,
+    user_id: int
+) -> Optional[Message]:
+    """
+    Returns the new message for "add", whose broadcast is left to the caller.
+    Raises NotMessageSender when user_id did not send the message to update or delete.
+    """
+    if action == "add":
+        return await message_service.create_message(
+            db,
+            text=message_data["text"],
+            sender_id=message_data["sender_id"],
+            recipient_id=message_data.get("recipient_id"),
+            attachment_ids=message_data.get("attachments") or (),
+            group_id=message_data.get("group_id")
+        )
+
+    if action == "update":
+        msg = await message_service.get_message(db, message_data["id"])
+        if msg and msg.sender_id != user_id:
+            raise NotMessageSender()
+        if msg:
+            msg = await message_service.update_message(db, msg, text=message_data["text"])
+
+            message_out = message_event("update", message_chat_id(msg), {
+                "id": msg.id,
+                "text": msg.text,
+                "sender_id": msg.sender_id,
+                "recipient_id": msg.recipient_id,
+                "group_id": msg.group_id
+            })
+
+            await broadcast_message_event(msg, message_out, coalesce_key=f"message:{msg.id}")
+    elif action == "delete":
+        msg = await message_service.get_message(db, message_data["id"])
+        if msg and msg.sender_id != user_id:
+            raise NotMessageSender()
+        if msg:
+            chat_id = message_chat_id(msg)
+            await message_service.delete_message(db, msg)
+
+            message_out = message_event("delete", chat_id, {"id": msg.id})
+
+            await broadcast_message_event(msg, message_out, coalesce_key=f"message:{msg.id}")
+
 @ws_router.websocket("/test")
 async def websocket_test(ws: WebSocket):
     await ws.accept()
@@ -70,79 +666,120 @@ async def websocket_test(ws: WebSocket):
         data = await ws.receive_text()
         await ws.send_text(f"Echo: {data}")
 
+@ws_router.websocket("/session")
+@ws_auth_required
+async def session_endpoint(websocket: WebSocket):
+    """
+    One socket per user for all of their chats.
+    Client frames: {"action": "subscribe" | "unsubscribe", "chat_id": ...},
+    {"action": "add" | "update" | "delete", "message": {...}},
+    where a new message has a recipient_id or a group_id,
+    {"action": "read" | "delivered", "chat_id": ..., "message_id": ...},
+    {"action": "typing", "chat_id": ..., "typing": true | false}
+    and {"action": "ping" | "pong"}.
+    Chats are "low_high" for two users and "g<group_id>" for groups.
+    Every event sent back carries the chat_id it belongs to, except "presence"
+    frames, which batch presence and typing changes of any chat (see PresenceTracker).
+    Subscribing to a direct chat is answered with the current presence of the peer.
+    Read and delivery receipts are tracked in direct chats only.
+    """
+    user_id = websocket.state.user.get("uid")
+    if user_id is None:
+        # Tokens issued before user ids were embedded, the client has to log in again
+        await websocket.close(code=1008)
+        return
+    connection = await manager.connect(user_id, websocket, multiplexed=True)
+
+    try:
+        while True:
+            frame = await receive_frame(websocket, connection)
+            if frame is None:
+                continue
+            action = frame.action
+            chat_id = frame.chat_id
+
+            if action in ("ping", "pong"):
+                if action == "ping":
+                    connection.enqueue(PONG)
+
+            elif action in ("subscribe", "unsubscribe"):
+                members = await chat_members(chat_id)
+                if not members or user_id not in members:
+                    connection.enqueue(error_event("forbidden", f"Not a participant of chat {chat_id}"))
+                    continue
+                if action == "subscribe":
+                    manager.subscribe(connection, chat_id)
+                else:
+                    manager.unsubscribe(connection, chat_id)
+                connection.enqueue({"action": f"{action}d", "chat_id": chat_id})
+                # Not for groups: their members' presence is not pushed, there may be thousands
+                if action == "subscribe" and chat_group_id(chat_id) is None:
+                    snapshot = manager.presence.snapshot(chat_id, members, user_id)
+                    if snapshot is not None:
+                        connection.enqueue(snapshot)
+
+            elif action == "typing":
+                group_id = chat_group_id(chat_id)
+                participants = chat_participants(chat_id) if group_id is None else await directory.group_members(group_id)
+                if not participants or user_id not in participants:
+                    connection.enqueue(error_event("forbidden", f"Not a participant of chat {chat_id}"))
+                    continue
+                manager.presence.typing(user_id, chat_id, frame.typing)
+
+            elif action in ("read", "delivered"):
+                participants = chat_participants(chat_id)
+                if not participants or user_id not in participants:
+                    connection.enqueue(error_event("forbidden", f"Not a participant of chat {chat_id}"))
+                    continue
+                peer_id = next(iter(participants - {user_id}), user_id)
+                await handle_receipt(connection, action, user_id, peer_id, frame.message_id, frame.client_id)
+
+            elif action in ("add", "update", "delete"):
+                await handle_message_action(connection, action, frame.message.model_dump(), frame.client_id)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Whatever ended the loop, the socket must not stay registered
+        manager.disconnect(connection)
+
 @ws_router.websocket("/chat/{user_id}/{peer_id}")
 @ws_auth_required
 async def chat_endpoint(
     websocket: WebSocket,
     user_id: int,
-    peer_id: int,
-    db: AsyncSession = Depends(get_db)
+    peer_id: int
 ):
+    # The path names the chat, the token says who is in it: speaking as someone else is refused
+    if websocket.state.user.get("uid") != user_id:
+        await websocket.close(code=1008)
+        return
     chat_id = get_chat_id(user_id, peer_id)
-    await manager.connect(chat_id, user_id, websocket)
+    connection = await manager.connect(user_id, websocket)
+    manager.subscribe(connection, chat_id)
+    snapshot = manager.presence.snapshot(chat_id, (user_id, peer_id), user_id)
+    if snapshot is not None:
+        connection.enqueue(snapshot)
 
     try:
         while True:
-            data = await websocket.receive_json()
-            action = data.get("action")
-            message_data = data.get("message")
-
-            if action == "add":
-                new_message = Message(
-                    text=message_data["text"],
-                    sender_id=message_data["sender_id"],
-                    recipient_id=message_data["recipient_id"]
-                )
-                db.add(new_message)
-                await db.commit()
-                await db.refresh(new_message)
-
-                message_out = {
-                    "action": "add",
-                    "message": {
-                        "id": new_message.id,
-                        "text": new_message.text,
-                        "sender_id": new_message.sender_id,
-                        "recipient_id": new_message.recipient_id
-                    }
-                }
-
-                await manager.broadcast(chat_id, message_out)
-
-            elif action == "update":
-                result = await db.execute(select(Message).where(Message.id == message_data["id"]))
-                msg = result.scalars().first()
-                if msg:
-                    msg.text = message_data["text"]
-                    db.add(msg)
-                    await db.commit()
-                    await db.refresh(msg)
-
-                    message_out = {
-                        "action": "update",
-                        "message": {
-                            "id": msg.id,
-                            "text": msg.text,
-                            "sender_id": msg.sender_id,
-                            "recipient_id": msg.recipient_id
-                        }
-                    }
-
-                    await manager.broadcast(chat_id, message_out)
-            elif action == "delete":
-                result = await db.execute(select(Message).where(Message.id == message_data["id"]))
-                msg = result.scalars().first()
-                if msg:
-                    await db.delete(msg)
-                    await db.commit()
-
-                    message_out = {
-                        "action": "delete",
-                        "message": {"id": msg.id}
-                    }
-
-                    await manager.broadcast(chat_id, message_out)
+            frame = await receive_frame(websocket, connection)
+            if frame is None:
+                continue
+            action = frame.action
+            if action in ("ping", "pong"):
+                if action == "ping":
+                    connection.enqueue(PONG)
+                continue
+            if action == "typing":
+                manager.presence.typing(user_id, chat_id, frame.typing)
+                continue
+            if action in ("read", "delivered"):
+                message_id = frame.message.id if frame.message else None
+                await handle_receipt(connection, action, websocket.state.user["uid"], peer_id, message_id, frame.client_id)
+                continue
+            if action in WRITE_ACTIONS:
+                await handle_message_action(connection, action, frame.message.model_dump(), frame.client_id)
     except WebSocketDisconnect:
-        manager.disconnect(chat_id, user_id)
-
-
+        pass
+    finally:
+        manager.disconnect(connection)
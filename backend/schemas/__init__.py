@@ -1,5 +1,7 @@
-from .users import UserRead,UserCreate
-from .messages import MessageCreate,MessageRead
+from .users import UserRead,UserCreate,UserPage,ContactRead
+from .messages import MessageCreate,MessageRead,MessagePage,MessageSearchResult,MessageSearchPage,ReadReceiptCreate,ReadReceipt,SyncPage
 from .attachments import AttachmentCreate,AttachmentRead
+from .ws import ClientFrame,ClientMessage
+from .groups import GroupCreate,GroupRead,GroupMemberAdd,GroupMemberRead,GroupMemberPage
 
-__all__ = ["UserRead", "UserCreate", "MessageCreate","MessageRead","AttachmentCreate","AttachmentRead"]
\ No newline at end of file
+__all__ = ["UserRead", "UserCreate", "UserPage", "ContactRead", "MessageCreate","MessageRead","MessagePage","MessageSearchResult","MessageSearchPage","ReadReceiptCreate","ReadReceipt","SyncPage","AttachmentCreate","AttachmentRead","GroupCreate","GroupRead","GroupMemberAdd","GroupMemberRead","GroupMemberPage","ClientFrame","ClientMessage"]
\ No newline at end of file
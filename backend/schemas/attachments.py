@@ -14,6 +14,9 @@ class AttachmentCreate(AttachmentBase):
 class AttachmentRead(AttachmentBase):
     id: int
     uploaded_at: datetime
+    # Image previews, null until generated and for other file types
+    thumbnail_url: Optional[str] = None
+    placeholder: Optional[str] = None
 
     class Config:
         orm_mode = True
\ No newline at end of file
@@ -0,0 +1,38 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+from .users import LastMessagePreview
+
+
+class GroupCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    # Members besides the creator, who always joins
+    member_ids: List[int] = []
+
+
+class GroupRead(BaseModel):
+    id: int
+    name: str
+    created_by: Optional[int] = None
+    created_at: datetime
+    last_activity: datetime
+    last_message: Optional[LastMessagePreview] = None
+
+    class Config:
+        orm_mode = True
+
+
+class GroupMemberAdd(BaseModel):
+    user_id: int
+
+
+class GroupMemberRead(BaseModel):
+    user_id: int
+    username: str
+    joined_at: datetime
+
+
+class GroupMemberPage(BaseModel):
+    items: List[GroupMemberRead] = []
+    next_cursor: Optional[str] = None
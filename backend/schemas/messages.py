@@ -1,5 +1,5 @@
 from __future__ import annotations
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
 from typing import Optional, List
 
@@ -8,11 +8,19 @@ from .attachments import AttachmentRead
 class MessageBase(BaseModel):
     text: str
     sender_id: int
-    recipient_id: int
+    # A direct message has a recipient, a group message a group_id
+    recipient_id: Optional[int] = None
+    group_id: Optional[int] = None
 
 class MessageCreate(MessageBase):
     attachments: Optional[List[int]] = []
 
+    @model_validator(mode="after")
+    def validate_target(self) -> "MessageCreate":
+        if (self.recipient_id is None) == (self.group_id is None):
+            raise ValueError("Give either recipient_id or group_id")
+        return self
+
 class MessageRead(MessageBase):
     id: int
     created_at: datetime = Field(..., alias="timestamp")
@@ -21,4 +29,41 @@ class MessageRead(MessageBase):
     class Config:
         orm_mode = True
 
-MessageRead.model_rebuild()
\ No newline at end of file
+class MessagePage(BaseModel):
+    items: List[MessageRead] = []
+    next_cursor: Optional[str] = None
+
+class MessageSearchResult(BaseModel):
+    id: int
+    sender_id: int
+    recipient_id: Optional[int] = None
+    group_id: Optional[int] = None
+    timestamp: datetime
+    rank: float
+    snippet: str
+
+class MessageSearchPage(BaseModel):
+    items: List[MessageSearchResult] = []
+    next_cursor: Optional[str] = None
+
+class SyncPage(BaseModel):
+    # Messages created or edited since the cursor, current state, in change order
+    upserts: List[MessageRead] = []
+    # Ids of messages to drop
+    deletes: List[int] = []
+    cursor: int
+    has_more: bool = False
+
+class ReadReceiptCreate(BaseModel):
+    peer_id: int
+    message_id: int
+
+class ReadReceipt(BaseModel):
+    peer_id: int
+    last_read: int
+    last_delivered: int
+    unread_count: int
+
+MessageRead.model_rebuild()
+MessagePage.model_rebuild()
+SyncPage.model_rebuild()
\ No newline at end of file
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, EmailStr, field_validator
 import re
 from datetime import datetime
+from typing import List, Optional
 
 
 class UserRead(BaseModel):
@@ -13,6 +14,11 @@ class UserRead(BaseModel):
         orm_mode = True
 
 
+class UserPage(BaseModel):
+    items: List[UserRead] = []
+    next_cursor: Optional[str] = None
+
+
 class UserCreate(BaseModel):
     username: str
     email: EmailStr
@@ -31,4 +37,20 @@ class UserCreate(BaseModel):
             raise ValueError("Password must contain at least one lowercase letter")
         if not re.search(r"[!@#$%^&*()_+=\-]", v):
             raise ValueError("Password must contain at least one special character")
-        return v
\ No newline at end of file
+        return v
+
+class LastMessagePreview(BaseModel):
+    id: int
+    text: str
+    sender_id: int
+    timestamp: datetime
+
+
+class ContactRead(UserRead):
+    last_activity: datetime
+    unread_count: int = 0
+    last_message: Optional[LastMessagePreview] = None
+    # Receipt watermarks: what the caller has read, what the contact has received and read
+    last_read_message_id: int = 0
+    peer_delivered_message_id: int = 0
+    peer_read_message_id: int = 0
@@ -0,0 +1,45 @@
+from typing import List, Optional, Union
+from pydantic import BaseModel, model_validator
+
+
+class ClientMessage(BaseModel):
+    """
+    The "message" of a client frame. Which fields are needed depends on the action.
+    """
+    id: Optional[int] = None
+    text: Optional[str] = None
+    sender_id: Optional[int] = None
+    recipient_id: Optional[int] = None
+    group_id: Optional[int] = None
+    attachments: List[int] = []
+
+
+class ClientFrame(BaseModel):
+    """
+    A frame received on /ws/session or /ws/chat. Frames that do not validate are
+    answered with a "bad_request" error frame and otherwise ignored.
+    """
+    action: str
+    chat_id: Optional[str] = None
+    message: Optional[ClientMessage] = None
+    message_id: Optional[int] = None
+    typing: bool = True
+    client_id: Optional[Union[str, int]] = None
+
+    @model_validator(mode="after")
+    def validate_message(self) -> "ClientFrame":
+        if self.action not in ("add", "update", "delete"):
+            return self
+        message = self.message
+        if message is None:
+            raise ValueError(f'"{self.action}" needs a message')
+        if self.action == "add":
+            if message.text is None:
+                raise ValueError("A new message needs a text")
+            if (message.recipient_id is None) == (message.group_id is None):
+                raise ValueError("Give either recipient_id or group_id")
+        elif message.id is None:
+            raise ValueError(f'"{self.action}" needs the message id')
+        elif self.action == "update" and message.text is None:
+            raise ValueError('"update" needs the new text')
+        return self
@@ -0,0 +1,14 @@
+from .conversations import (
+    ordered_pair, touch_conversation, touch_conversations, refresh_conversation, involving,
+    mark_read, mark_delivered, receipt_state
+)
+from .groups import create_group, add_members, remove_member, group_member_ids, touch_groups, refresh_group
+from .messages import (
+    create_message, create_messages, get_message, update_message, delete_message, delete_user_messages
+)
+
+__all__ = ["ordered_pair", "touch_conversation", "touch_conversations", "refresh_conversation", "involving",
+           "mark_read", "mark_delivered", "receipt_state",
+           "create_group", "add_members", "remove_member", "group_member_ids", "touch_groups", "refresh_group",
+           "create_message", "create_messages", "get_message", "update_message", "delete_message",
+           "delete_user_messages"]
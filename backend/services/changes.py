@@ -0,0 +1,75 @@
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import MessageChange
+from models.message_changes import DELETE, INSERT, UPDATE
+
+# Class id of the advisory locks taken per user while appending to the change log
+CHANGE_LOG_LOCK = 7341
+
+def participant_changes(message, op: str) -> List[Tuple[int, int, str]]:
+    """
+    (user_id, message_id, op) for each participant of the message.
+    Group messages are not logged: a row per member would undo storing them once.
+    Members catch up on a group from its history instead.
+    """
+    if getattr(message, "group_id", None) is not None:
+        return []
+    return [(user_id, message.id, op) for user_id in {message.sender_id, message.recipient_id}]
+
+async def record_changes(db: AsyncSession, changes: Iterable[Tuple[int, int, str]]):
+    """
+    Appends (user_id, message_id, op) rows to the change log.
+
+    Must be the last statement before the commit. The transaction first takes an advisory
+    lock per affected user, in id order, and keeps it until it commits. Two writers touching
+    the same user thus draw their sequence numbers in commit order, so a client that synced
+    up to seq N can never see a row below N appear afterwards.
+    """
+    rows = [{"user_id": user_id, "message_id": message_id, "op": op} for user_id, message_id, op in changes]
+    if not rows:
+        return
+    user_ids = sorted({row["user_id"] for row in rows})
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(:lock, u) FROM unnest(CAST(:user_ids AS integer[])) AS u"),
+        {"lock": CHANGE_LOG_LOCK, "user_ids": user_ids}
+    )
+    await db.execute(insert(MessageChange), rows)
+
+async def current_seq(db: AsyncSession, user_id: int) -> int:
+    """
+    The user's latest sequence number, where a client that just loaded everything starts syncing.
+    """
+    result = await db.execute(select(func.max(MessageChange.seq)).where(MessageChange.user_id == user_id))
+    return result.scalar() or 0
+
+async def changes_since(db: AsyncSession, user_id: int, since: int, limit: int) -> Tuple[List[int], List[int], int, bool]:
+    """
+    Reads up to `limit` log rows past `since` and folds them into the net effect per message:
+    ids to (re)fetch, in log order, and ids to delete. A message created and deleted within
+    the batch is left out altogether.
+    Returns (upsert_ids, delete_ids, cursor, has_more).
+    """
+    result = await db.execute(
+        select(MessageChange.seq, MessageChange.message_id, MessageChange.op)
+        .where(MessageChange.user_id == user_id, MessageChange.seq > since)
+        .order_by(MessageChange.seq)
+        .limit(limit + 1)
+    )
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    created = set()
+    latest: Dict[int, str] = {}
+    for row in rows:
+        if row.op == INSERT:
+            created.add(row.message_id)
+        # Re-inserting moves the message to its newest position in the order
+        latest.pop(row.message_id, None)
+        latest[row.message_id] = row.op
+
+    upsert_ids = [message_id for message_id, op in latest.items() if op in (INSERT, UPDATE)]
+    delete_ids = [message_id for message_id, op in latest.items() if op == DELETE and message_id not in created]
+    cursor = rows[-1].seq if rows else since
+    return upsert_ids, delete_ids, cursor, has_more
@@ -0,0 +1,172 @@
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Conversation, Message
+
+def ordered_pair(user1_id: int, user2_id: int) -> Tuple[int, int]:
+    """
+    Returns the two ids from lowest to biggest, the key of a conversation.
+    """
+    return (user1_id, user2_id) if user1_id <= user2_id else (user2_id, user1_id)
+
+async def touch_conversation(db: AsyncSession, message: Message):
+    """
+    Records a new message on its conversation, creating the row on first contact.
+    Must run in the same transaction as the message insert.
+    """
+    await touch_conversations(db, [message])
+
+async def touch_conversations(db: AsyncSession, messages: Iterable[Message]):
+    """
+    Batch form of touch_conversation: one upsert for all the pairs in `messages`.
+    """
+    touched: Dict[Tuple[int, int], dict] = {}
+    for message in messages:
+        low, high = ordered_pair(message.sender_id, message.recipient_id)
+        row = touched.setdefault((low, high), {
+            "user_low_id": low,
+            "user_high_id": high,
+            "last_message_id": message.id,
+            "last_activity": func.now(),
+            "unread_low": 0,
+            "unread_high": 0,
+        })
+        row["last_message_id"] = max(row["last_message_id"], message.id)
+        if low != high:
+            row["unread_low" if message.recipient_id == low else "unread_high"] += 1
+    if not touched:
+        return
+
+    # Rows are locked in key order so concurrent batches cannot deadlock
+    stmt = insert(Conversation).values([touched[key] for key in sorted(touched)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Conversation.user_low_id, Conversation.user_high_id],
+        set_={
+            # greatest() ignores NULL, so a concurrent older insert never wins
+            "last_message_id": func.greatest(Conversation.last_message_id, stmt.excluded.last_message_id),
+            "last_activity": func.greatest(Conversation.last_activity, stmt.excluded.last_activity),
+            "unread_low": Conversation.unread_low + stmt.excluded.unread_low,
+            "unread_high": Conversation.unread_high + stmt.excluded.unread_high,
+        }
+    )
+    await db.execute(stmt)
+
+async def refresh_conversation(db: AsyncSession, user1_id: int, user2_id: int):
+    """
+    Re-points the conversation at its newest remaining message after a delete
+    or a move, and drops it once no messages are left.
+    """
+    low, high = ordered_pair(user1_id, user2_id)
+    # Same per-direction index ranges as the history endpoint
+    newest = None
+    for sender_id, recipient_id in ((low, high), (high, low)):
+        result = await db.execute(
+            select(Message.id, Message.timestamp)
+            .where(Message.sender_id == sender_id, Message.recipient_id == recipient_id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(1)
+        )
+        row = result.first()
+        if row and (newest is None or (row.timestamp, row.id) > (newest.timestamp, newest.id)):
+            newest = row
+        if low == high:
+            break
+
+    pair = and_(Conversation.user_low_id == low, Conversation.user_high_id == high)
+    if newest is None:
+        await db.execute(delete(Conversation).where(pair))
+        return
+    stmt = insert(Conversation).values(
+        user_low_id=low,
+        user_high_id=high,
+        last_message_id=newest.id,
+        last_activity=newest.timestamp,
+    )
+    set_ = {
+        "last_message_id": stmt.excluded.last_message_id,
+        "last_activity": stmt.excluded.last_activity,
+    }
+    if low != high:
+        # A removed message may have been unread
+        set_["unread_low"] = unread_after(low, high, Conversation.last_read_low)
+        set_["unread_high"] = unread_after(high, low, Conversation.last_read_high)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[Conversation.user_low_id, Conversation.user_high_id],
+        set_=set_
+    ))
+
+def unread_after(user_id: int, peer_id: int, watermark):
+    """
+    Number of messages from peer_id to user_id past the watermark, as a scalar subquery.
+    Answered by an index-only range scan of ix_messages_unread.
+    """
+    return (
+        select(func.count())
+        .select_from(Message)
+        .where(Message.recipient_id == user_id, Message.sender_id == peer_id, Message.id > watermark)
+        .scalar_subquery()
+    )
+
+async def mark_read(db: AsyncSession, user_id: int, peer_id: int, message_id: int) -> Optional[dict]:
+    """
+    Moves user_id's read watermark in the conversation with peer_id up to message_id
+    and recounts what is left unread: one row written however many messages that covers.
+    Reading also implies delivery. Returns the new receipt state, None if nothing moved.
+    """
+    return await _advance_watermark(db, user_id, peer_id, message_id, read=True)
+
+async def mark_delivered(db: AsyncSession, user_id: int, peer_id: int, message_id: int) -> Optional[dict]:
+    """
+    Moves user_id's delivery watermark, see mark_read.
+    """
+    return await _advance_watermark(db, user_id, peer_id, message_id, read=False)
+
+async def receipt_state(db: AsyncSession, user_id: int, peer_id: int) -> Optional[dict]:
+    """
+    user_id's side of the conversation with peer_id, None if they never talked.
+    """
+    low, high = ordered_pair(user_id, peer_id)
+    side = "low" if user_id == low else "high"
+    result = await db.execute(
+        select(
+            getattr(Conversation, f"last_read_{side}").label("last_read"),
+            getattr(Conversation, f"last_delivered_{side}").label("last_delivered"),
+            getattr(Conversation, f"unread_{side}").label("unread_count"),
+        ).where(Conversation.user_low_id == low, Conversation.user_high_id == high)
+    )
+    row = result.first()
+    return dict(row._mapping) if row else None
+
+async def _advance_watermark(db: AsyncSession, user_id: int, peer_id: int, message_id: int, read: bool) -> Optional[dict]:
+    if user_id == peer_id:
+        return None
+    low, high = ordered_pair(user_id, peer_id)
+    side = "low" if user_id == low else "high"
+    last_read = getattr(Conversation, f"last_read_{side}")
+    last_delivered = getattr(Conversation, f"last_delivered_{side}")
+    unread = getattr(Conversation, f"unread_{side}")
+
+    # Never past the conversation's newest message, so future messages cannot be pre-read
+    watermark = func.least(message_id, Conversation.last_message_id)
+    values = {last_delivered: func.greatest(last_delivered, watermark)}
+    moved = last_delivered < watermark
+    if read:
+        values[last_read] = watermark
+        values[unread] = unread_after(user_id, peer_id, watermark)
+        moved = last_read < watermark
+
+    result = await db.execute(
+        update(Conversation)
+        .where(Conversation.user_low_id == low, Conversation.user_high_id == high, moved)
+        .values(values)
+        .returning(last_read.label("last_read"), last_delivered.label("last_delivered"), unread.label("unread_count"))
+    )
+    row = result.first()
+    return dict(row._mapping) if row else None
+
+def involving(user_id: int):
+    """
+    Filter for the conversations a user takes part in. Each side is served by its own index.
+    """
+    return or_(Conversation.user_low_id == user_id, Conversation.user_high_id == user_id)
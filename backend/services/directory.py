@@ -0,0 +1,136 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
+from core import AsyncSessionLocal
+from core.cache import MISSING, CacheBackend, create_cache_backend
+from core.config import (
+    CACHE_BACKEND, CACHE_REDIS_URL, DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_TTL, DIRECTORY_NEGATIVE_TTL
+)
+from models import User
+from .groups import group_member_ids
+
+
+class Directory:
+    """
+    Read-through cache of small, rarely changing facts: a user's name by id, a user's id
+    by name, whether the users of a chat exist and who the members of a group are.
+
+    A miss loads the fact with its own short-lived session; concurrent misses on the same
+    key share one query. Unknown users are cached too, for `negative_ttl` only, so a
+    client retrying with a bad id does not reach the database every time.
+    Whoever changes a user must call `invalidate_user`, whoever changes a group's members
+    `invalidate_group` (through ConnectionManager.group_changed, which reaches every process).
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        session_factory: sessionmaker,
+        ttl: Optional[float] = None,
+        negative_ttl: Optional[float] = None
+    ):
+        self.backend = backend
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Keys invalidated while being loaded: the loaded value may predate the change
+        self._stale: Set[str] = set()
+        self.loads = 0
+
+    async def username(self, user_id: int) -> Optional[str]:
+        return await self._read_through(f"user:{user_id}", lambda: self._load_username(user_id))
+
+    async def user_id(self, username: str) -> Optional[int]:
+        return await self._read_through(f"username:{username}", lambda: self._load_user_id(username))
+
+    async def user_exists(self, user_id: int) -> bool:
+        return await self.username(user_id) is not None
+
+    async def users_exist(self, user_ids: Iterable[int]) -> bool:
+        """
+        Whether every user of a chat still exists, e.g. before subscribing to it.
+        """
+        for user_id in user_ids:
+            if not await self.user_exists(user_id):
+                return False
+        return True
+
+    async def group_members(self, group_id: int) -> Optional[Set[int]]:
+        """
+        The ids of the group's members, None if there is no such group.
+        """
+        members = await self._read_through(f"group:{group_id}", lambda: self._load_group_members(group_id))
+        return None if members is None else set(members)
+
+    async def invalidate_user(self, user_id: Optional[int] = None, username: Optional[str] = None):
+        keys = []
+        if user_id is not None:
+            keys.append(f"user:{user_id}")
+        if username is not None:
+            keys.append(f"username:{username}")
+        await self._invalidate(keys)
+
+    async def invalidate_group(self, group_id: int):
+        await self._invalidate([f"group:{group_id}"])
+
+    async def stats(self) -> dict:
+        return {**await self.backend.stats(), "loads": self.loads}
+
+    async def _invalidate(self, keys: List[str]):
+        self._stale.update(key for key in keys if key in self._loading)
+        await self.backend.delete(*keys)
+
+    async def _read_through(self, key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+        value = await self.backend.get(key)
+        if value is not MISSING:
+            return value
+
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await load()
+            self.loads += 1
+            if key not in self._stale:
+                await self.backend.set(key, value, ttl=self.ttl if value is not None else self.negative_ttl)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Retrieved here so that a load nobody else waited for does not log a warning
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+            self._stale.discard(key)
+
+    async def _load_username(self, user_id: int) -> Optional[str]:
+        async with self.session_factory() as db:
+            result = await db.execute(select(User.username).where(User.id == user_id))
+            return result.scalar()
+
+    async def _load_user_id(self, username: str) -> Optional[int]:
+        async with self.session_factory() as db:
+            result = await db.execute(select(User.id).where(User.username == username))
+            return result.scalar()
+
+    async def _load_group_members(self, group_id: int) -> Optional[List[int]]:
+        # Cached as a plain list, the backends hold JSON data
+        async with self.session_factory() as db:
+            return await group_member_ids(db, group_id)
+
+
+directory = Directory(
+    create_cache_backend(CACHE_BACKEND, DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_TTL, CACHE_REDIS_URL),
+    AsyncSessionLocal,
+    ttl=DIRECTORY_CACHE_TTL,
+    negative_ttl=DIRECTORY_NEGATIVE_TTL
+)
@@ -0,0 +1,90 @@
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Group, GroupMember, Message
+
+# Membership changes here must be followed by ConnectionManager.group_changed once
+# committed, which drops the cached member lists on every process
+
+async def create_group(db: AsyncSession, name: str, creator_id: int, member_ids: Iterable[int] = ()) -> Group:
+    group = Group(name=name, created_by=creator_id)
+    db.add(group)
+    await db.flush()
+    await add_members(db, group.id, {creator_id, *member_ids})
+    await db.commit()
+    await db.refresh(group)
+    return group
+
+async def add_members(db: AsyncSession, group_id: int, user_ids: Iterable[int]) -> List[int]:
+    """
+    Adds users to the group and returns those who were not members yet.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return []
+    result = await db.execute(
+        insert(GroupMember)
+        .values([{"group_id": group_id, "user_id": user_id} for user_id in user_ids])
+        .on_conflict_do_nothing()
+        .returning(GroupMember.user_id)
+    )
+    return list(result.scalars())
+
+async def remove_member(db: AsyncSession, group_id: int, user_id: int) -> bool:
+    result = await db.execute(
+        delete(GroupMember)
+        .where(GroupMember.group_id == group_id, GroupMember.user_id == user_id)
+        .returning(GroupMember.user_id)
+    )
+    return result.first() is not None
+
+async def group_member_ids(db: AsyncSession, group_id: int) -> Optional[List[int]]:
+    """
+    Every member of the group, None if there is no such group.
+    """
+    result = await db.execute(
+        select(Group.id, GroupMember.user_id)
+        .outerjoin(GroupMember, GroupMember.group_id == Group.id)
+        .where(Group.id == group_id)
+    )
+    rows = result.all()
+    if not rows:
+        return None
+    return [row.user_id for row in rows if row.user_id is not None]
+
+async def touch_groups(db: AsyncSession, messages: Iterable[Message]):
+    """
+    Records new group messages on their groups: one row written per group,
+    whatever the number of members. Must run in the same transaction as the insert.
+    """
+    newest: Dict[int, int] = {}
+    for message in messages:
+        newest[message.group_id] = max(newest.get(message.group_id, 0), message.id)
+    # Rows are locked in key order so concurrent batches cannot deadlock
+    for group_id in sorted(newest):
+        await db.execute(
+            update(Group)
+            .where(Group.id == group_id)
+            .values(
+                # greatest() ignores NULL, so a concurrent older insert never wins
+                last_message_id=func.greatest(Group.last_message_id, newest[group_id]),
+                last_activity=func.now()
+            )
+        )
+
+async def refresh_group(db: AsyncSession, group_id: int):
+    """
+    Re-points the group at its newest remaining message after a delete.
+    """
+    result = await db.execute(
+        select(Message.id, Message.timestamp)
+        .where(Message.group_id == group_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(1)
+    )
+    newest = result.first()
+    values = {"last_message_id": newest.id if newest else None}
+    if newest:
+        values["last_activity"] = newest.timestamp
+    await db.execute(update(Group).where(Group.id == group_id).values(values))
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import List, Optional, Sequence, Tuple, Union
+from sqlalchemy import Row
+from sqlalchemy.orm import sessionmaker
+from models import Message
+from .messages import create_message, create_messages
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWritePipeline:
+    """
+    Write-behind queue for new messages coming from every socket.
+    Messages are grouped into micro-batches, flushed when `max_batch` is reached
+    or `max_delay` seconds after the first one arrived, and written with one
+    multi-row INSERT ... RETURNING in a single transaction.
+
+    Batches are flushed one at a time in arrival order and each sender is
+    resumed in that same order, so messages of a chat keep their order.
+    `submit` only returns once the row is committed, which is what the
+    acknowledgement sent to the client relies on.
+    """
+
+    def __init__(self, session_factory: sessionmaker, max_batch: int = 100, max_delay: float = 0.005):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops taking new batches after flushing everything already submitted.
+        """
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(
+        self,
+        text: str,
+        sender_id: int,
+        recipient_id: Optional[int] = None,
+        attachment_ids: Sequence[int] = (),
+        group_id: Optional[int] = None
+    ) -> Union[Message, Row]:
+        if self._task is None:
+            raise RuntimeError("Message pipeline is not running")
+        future = asyncio.get_running_loop().create_future()
+        values = {
+            "text": text, "sender_id": sender_id, "recipient_id": recipient_id, "group_id": group_id,
+            "attachment_ids": attachment_ids
+        }
+        await self._queue.put((values, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            async with self.session_factory() as db:
+                messages = await create_messages(db, [values for values, _ in batch])
+        except Exception:
+            logger.exception("Batch insert of %d messages failed, retrying one by one", len(batch))
+            await self._flush_one_by_one(batch)
+            return
+
+        self.batches += 1
+        self.written += len(messages)
+        for (_, future), message in zip(batch, messages):
+            if not future.done():
+                future.set_result(message)
+
+    async def _flush_one_by_one(self, batch: List[Tuple[dict, asyncio.Future]]):
+        # Isolates the offending rows so one bad message does not fail its whole batch
+        for values, future in batch:
+            try:
+                async with self.session_factory() as db:
+                    message = await create_message(db, **values)
+            except Exception as exc:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(exc)
+                continue
+            self.written += 1
+            if not future.done():
+                future.set_result(message)
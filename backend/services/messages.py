@@ -0,0 +1,121 @@
+from typing import List, Optional, Sequence
+from sqlalchemy import Row, delete, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from models import Attachment, Message
+from models.message_changes import DELETE, INSERT, UPDATE
+from .changes import participant_changes, record_changes
+from .conversations import ordered_pair, refresh_conversation, touch_conversation, touch_conversations
+from .groups import refresh_group, touch_groups
+
+# Every write to messages goes through here so the conversations and groups tables
+# and the change log are kept in step within the same transaction
+
+async def link_attachments(db: AsyncSession, message_id: int, sender_id: int, attachment_ids: Sequence[int]):
+    """
+    Attaches uploads to a message. Only the sender's own, not yet linked uploads are taken.
+    """
+    if not attachment_ids:
+        return
+    await db.execute(
+        update(Attachment)
+        .where(
+            Attachment.id.in_(list(attachment_ids)),
+            Attachment.uploader_id == sender_id,
+            Attachment.message_id.is_(None)
+        )
+        .values(message_id=message_id)
+    )
+
+async def delete_user_messages(db: AsyncSession, user_id: int):
+    """
+    Deletes the attachments of every message the user sent or received, before the
+    user is deleted. The messages and the user's own uploads cascade from users, but
+    nothing cascades from the partitioned messages table.
+    """
+    messages = select(Message.id).where(or_(Message.sender_id == user_id, Message.recipient_id == user_id))
+    await db.execute(delete(Attachment).where(Attachment.message_id.in_(messages)))
+
+async def create_message(
+    db: AsyncSession,
+    text: str,
+    sender_id: int,
+    recipient_id: Optional[int] = None,
+    attachment_ids: Sequence[int] = (),
+    group_id: Optional[int] = None
+) -> Message:
+    """
+    Creates a direct message to `recipient_id`, or a message to the group `group_id`.
+    Either way it is a single row, however many members the group has.
+    """
+    message = Message(text=text, sender_id=sender_id, recipient_id=recipient_id, group_id=group_id)
+    db.add(message)
+    await db.flush()
+    if group_id is not None:
+        await touch_groups(db, [message])
+    else:
+        await touch_conversation(db, message)
+    await link_attachments(db, message.id, sender_id, attachment_ids)
+    await record_changes(db, participant_changes(message, INSERT))
+    await db.commit()
+    await db.refresh(message)
+    return message
+
+async def create_messages(db: AsyncSession, items: List[dict]) -> List[Row]:
+    """
+    Inserts many messages with a single multi-row INSERT ... RETURNING.
+    The returned rows are in the same order as `items`.
+    Items may carry "attachment_ids" to link like create_message does.
+    """
+    items = [dict(item) for item in items]
+    attachment_ids = [item.pop("attachment_ids", None) for item in items]
+    result = await db.execute(
+        insert(Message).returning(
+            Message.id, Message.text, Message.timestamp, Message.sender_id, Message.recipient_id,
+            Message.group_id, sort_by_parameter_order=True
+        ),
+        items
+    )
+    messages = list(result.all())
+    await touch_conversations(db, [message for message in messages if message.group_id is None])
+    await touch_groups(db, [message for message in messages if message.group_id is not None])
+    for message, ids in zip(messages, attachment_ids):
+        await link_attachments(db, message.id, message.sender_id, ids)
+    await record_changes(db, [change for message in messages for change in participant_changes(message, INSERT)])
+    await db.commit()
+    return messages
+
+async def get_message(db: AsyncSession, message_id: int, with_attachments: bool = False) -> Optional[Message]:
+    stmt = select(Message).where(Message.id == message_id)
+    if with_attachments:
+        stmt = stmt.options(selectinload(Message.attachments))
+    result = await db.execute(stmt)
+    return result.scalars().first()
+
+async def update_message(db: AsyncSession, message: Message, text: str) -> Message:
+    """
+    Edits the text. A message never changes sender, recipient or group: its
+    conversation stays the same and needs no refresh.
+    """
+    message.text = text
+    db.add(message)
+    await db.flush()
+    await record_changes(db, participant_changes(message, UPDATE))
+    await db.commit()
+    await db.refresh(message)
+    return message
+
+async def delete_message(db: AsyncSession, message: Message):
+    group_id = message.group_id
+    pair = None if group_id is not None else ordered_pair(message.sender_id, message.recipient_id)
+    changes = participant_changes(message, DELETE)
+    # No foreign key cascades from messages
+    await db.execute(delete(Attachment).where(Attachment.message_id == message.id))
+    await db.delete(message)
+    await db.flush()
+    if group_id is not None:
+        await refresh_group(db, group_id)
+    else:
+        await refresh_conversation(db, *pair)
+    await record_changes(db, changes)
+    await db.commit()
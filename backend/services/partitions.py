@@ -0,0 +1,227 @@
+"""
+Monthly range partitions of the messages table: one partition per calendar month,
+named messages_YYYY_MM, holding [first of the month, first of the next month).
+
+Partitions for the current month and the next MESSAGE_PARTITION_MONTHS_AHEAD months
+are created at startup and then periodically. There is no DEFAULT partition, whose
+rows would block creating their month later: the app refuses to start when it cannot
+create the months it needs. Old months are archived by hand:
+
+    python -m services.partitions list
+    python -m services.partitions ensure [--ahead 3] [--since 2025-01-01]
+    python -m services.partitions archive [--hot-months 12] [--dir archive]
+
+Archiving detaches a month, writes it to <dir>/messages_YYYY_MM.csv.gz and drops it.
+To restore one, recreate its partition and load the file:
+    gunzip -c messages_YYYY_MM.csv.gz | psql -c "\\copy messages (id, text, timestamp, sender_id, recipient_id, group_id) FROM STDIN CSV HEADER"
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date
+from typing import List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from core import engine
+from core.config import (
+    MESSAGE_ARCHIVE_DIR, MESSAGE_HOT_MONTHS, MESSAGE_PARTITION_CHECK_INTERVAL, MESSAGE_PARTITION_MONTHS_AHEAD
+)
+
+logger = logging.getLogger(__name__)
+
+# Class id of the advisory lock serializing partition changes between workers
+PARTITION_LOCK = 7342
+PARTITION_NAME = re.compile(r"^messages_(\d{4})_(\d{2})$")
+ARCHIVE_COLUMNS = "id, text, timestamp, sender_id, recipient_id, group_id"
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"messages_{month:%Y_%m}"
+
+def partition_month(name: str) -> Optional[date]:
+    match = PARTITION_NAME.match(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+async def attached_partitions(conn: AsyncConnection) -> List[date]:
+    """
+    Months that currently have a partition attached to messages, oldest first.
+    """
+    result = await conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass AND NOT i.inhdetachpending
+    """))
+    return sorted(month for month in map(partition_month, result.scalars()) if month)
+
+async def ensure_partitions(
+    db_engine: AsyncEngine = engine,
+    ahead: int = MESSAGE_PARTITION_MONTHS_AHEAD,
+    today: Optional[date] = None,
+    since: Optional[date] = None
+) -> List[str]:
+    """
+    Creates the partitions missing from the current month, or the month of `since`
+    for back-dated imports, up to `ahead` months later. Returns the names of the
+    partitions created; nothing is locked when none is missing.
+    """
+    current = month_start(today or date.today())
+    month = month_start(min(since, current)) if since else current
+    wanted = []
+    while month <= add_months(current, ahead):
+        wanted.append(month)
+        month = add_months(month, 1)
+    async with db_engine.connect() as conn:
+        existing = set(await attached_partitions(conn))
+    if existing.issuperset(wanted):
+        return []
+
+    created = []
+    async with db_engine.begin() as conn:
+        # Creating a partition locks messages: rather give up and retry later than stall traffic
+        await conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:lock)"), {"lock": PARTITION_LOCK})
+        existing = set(await attached_partitions(conn))
+        for month in wanted:
+            if month in existing:
+                continue
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF messages "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(partition_name(month))
+    if created:
+        logger.info("Created message partitions %s", ", ".join(created))
+    return created
+
+async def maintain_partitions(interval: float = MESSAGE_PARTITION_CHECK_INTERVAL):
+    """
+    Keeps future partitions created for as long as the app runs. Started from the lifespan.
+    """
+    while True:
+        try:
+            await ensure_partitions()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to create message partitions")
+        await asyncio.sleep(interval)
+
+async def archive_partition(month: date, directory: str = MESSAGE_ARCHIVE_DIR, db_engine: AsyncEngine = engine) -> str:
+    """
+    Moves one month to cold storage and returns the path of its gzipped CSV.
+
+    The partition is detached concurrently, so reads and writes of the other months
+    go on meanwhile. Conversations and groups whose last message was in that month
+    lose their preview, and unread counts are recounted without the month's messages.
+    Read and delivery watermarks are left as they are: they are compared by id only,
+    and ids keep growing, so one pointing at an archived message still means the same.
+    Rerunning after a failure picks up where the previous run stopped.
+    """
+    name = partition_name(month)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.csv.gz")
+
+    # DETACH ... CONCURRENTLY cannot run inside a transaction block
+    async with db_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        result = await conn.execute(text("""
+            SELECT i.inhdetachpending FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'messages'::regclass AND c.relname = :name
+        """), {"name": name})
+        pending = result.scalar()
+        if pending is not None:
+            # A detach interrupted half way has to be finalized instead of started again
+            await conn.execute(text(
+                f"ALTER TABLE messages DETACH PARTITION {name} {'FINALIZE' if pending else 'CONCURRENTLY'}"
+            ))
+        elif (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is None:
+            raise ValueError(f"No partition {name}")
+
+        for table in ("conversations", "groups"):
+            await conn.execute(text(
+                f"UPDATE {table} SET last_message_id = NULL WHERE last_message_id IN (SELECT id FROM {name})"
+            ))
+        # Once detached, the month no longer counts: only conversations with unread messages in it change
+        await conn.execute(text(f"""
+            UPDATE conversations c SET
+                unread_low = (
+                    SELECT count(*) FROM messages m
+                    WHERE m.recipient_id = c.user_low_id AND m.sender_id = c.user_high_id AND m.id > c.last_read_low
+                ),
+                unread_high = (
+                    SELECT count(*) FROM messages m
+                    WHERE m.recipient_id = c.user_high_id AND m.sender_id = c.user_low_id AND m.id > c.last_read_high
+                )
+            WHERE c.user_low_id <> c.user_high_id
+              AND EXISTS (
+                  SELECT 1 FROM {name} a
+                  WHERE (a.recipient_id = c.user_low_id AND a.sender_id = c.user_high_id AND a.id > c.last_read_low)
+                     OR (a.recipient_id = c.user_high_id AND a.sender_id = c.user_low_id AND a.id > c.last_read_high)
+              )
+        """))
+
+        tmp_path = f"{path}.tmp"
+        raw = await conn.get_raw_connection()
+        with gzip.open(tmp_path, "wb") as archive:
+            async def write(chunk: bytes):
+                archive.write(chunk)
+
+            await raw.driver_connection.copy_from_query(
+                f"SELECT {ARCHIVE_COLUMNS} FROM {name} ORDER BY id", output=write, format="csv", header=True
+            )
+        os.replace(tmp_path, path)
+
+        await conn.execute(text(f"DROP TABLE {name}"))
+    logger.info("Archived message partition %s to %s", name, path)
+    return path
+
+async def archive_old_partitions(
+    hot_months: int = MESSAGE_HOT_MONTHS,
+    directory: str = MESSAGE_ARCHIVE_DIR,
+    today: Optional[date] = None
+) -> List[str]:
+    """
+    Archives every month that ended more than `hot_months` months ago.
+    """
+    cutoff = add_months(month_start(today or date.today()), -hot_months)
+    async with engine.connect() as conn:
+        # Every month table, also those a failed run left detached
+        result = await conn.execute(text("SELECT tablename FROM pg_tables WHERE schemaname = current_schema()"))
+        months = sorted(month for month in map(partition_month, result.scalars()) if month)
+    months = [month for month in months if add_months(month, 1) <= cutoff]
+    return [await archive_partition(month, directory) for month in months]
+
+
+async def _main(args) -> dict:
+    try:
+        if args.command == "ensure":
+            return {"created": await ensure_partitions(ahead=args.ahead, since=args.since)}
+        if args.command == "archive":
+            return {"archived": await archive_old_partitions(args.hot_months, args.dir)}
+        async with engine.connect() as conn:
+            return {"partitions": [partition_name(month) for month in await attached_partitions(conn)]}
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(prog="python -m services.partitions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list")
+    ensure = commands.add_parser("ensure")
+    ensure.add_argument("--ahead", type=int, default=MESSAGE_PARTITION_MONTHS_AHEAD)
+    ensure.add_argument("--since", type=date.fromisoformat, help="Also create the months back to this date")
+    archive = commands.add_parser("archive")
+    archive.add_argument("--hot-months", type=int, default=MESSAGE_HOT_MONTHS)
+    archive.add_argument("--dir", default=MESSAGE_ARCHIVE_DIR)
+    print(json.dumps(asyncio.run(_main(parser.parse_args())), indent=2))
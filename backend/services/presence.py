@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Broker events of this kind carry presence, not a chat event
+PRESENCE_EVENT = "presence"
+# Most entries per broker event, NOTIFY payloads are limited to 8000 bytes
+MAX_EVENT_ENTRIES = 300
+
+TypingKey = Tuple[str, int]
+
+
+class PresenceTracker:
+    """
+    Online/offline and typing state of users, in memory only: nothing is written
+    to the database.
+
+    Changes are coalesced before anyone hears of them. A user who reconnects within
+    `offline_grace` seconds never appears offline, typing again before `typing_timeout`
+    runs out sends nothing new, and each recipient gets at most one "presence" frame
+    per `tick` with the latest state of whatever changed in it:
+
+        {"action": "presence", "presence": [{"user_id": 2, "online": true}],
+         "typing": [{"chat_id": "1_2", "user_id": 2, "typing": false}]}
+
+    Presence goes to the sockets subscribed to a chat with the user, typing to the
+    sockets of the chat it happens in, never to the user's own sockets.
+
+    With several processes each one announces the changes of its own users through
+    the broker, with a beacon at least every `beacon_interval` seconds. Users of a
+    process not heard from for `node_timeout` seconds are taken offline. Every
+    `beacon_interval` each process also repeats all of its online users, so one that
+    was taken offline elsewhere after a silence, or that just started, is caught up.
+    """
+
+    def __init__(
+        self,
+        manager,
+        tick: float = 0.25,
+        offline_grace: float = 5.0,
+        typing_timeout: float = 6.0,
+        beacon_interval: float = 25.0,
+        node_timeout: float = 75.0
+    ):
+        # The ConnectionManager: sockets by user and chat, and the broker
+        self.manager = manager
+        self.tick = tick
+        self.offline_grace = offline_grace
+        self.typing_timeout = typing_timeout
+        self.beacon_interval = beacon_interval
+        self.node_timeout = node_timeout
+
+        # Users with a socket on this process, and their offline deadlines once they have none
+        self._local: Set[int] = set()
+        self._offline_at: Dict[int, float] = {}
+        # Users online on other processes, by process, and when each process was last heard
+        self._remote: Dict[int, Set[str]] = {}
+        self._nodes: Dict[str, float] = {}
+        # Users clients were last told are online
+        self._online: Set[int] = set()
+        # Typing on this process until the expiry time, or on another process
+        self._typing: Dict[TypingKey, float] = {}
+        self._remote_typing: Dict[TypingKey, str] = {}
+
+        # Changes to send to clients on the next tick, and to announce to other processes
+        self._changed_users: Set[int] = set()
+        self._changed_typing: Dict[TypingKey, bool] = {}
+        self._announce_users: Dict[int, bool] = {}
+        self._announce_typing: Dict[TypingKey, bool] = {}
+        self._last_beacon = 0.0
+        self._next_republish = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+        self.frames = 0
+        self.coalesced = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def connected(self, user_id: int):
+        if self._offline_at.pop(user_id, None) is not None:
+            # Back within the grace period, nobody saw them leave
+            self.coalesced += 1
+            return
+        if user_id not in self._local:
+            self._local.add(user_id)
+            self._changed_users.add(user_id)
+            self._announce_users[user_id] = True
+
+    def disconnected(self, user_id: int):
+        """
+        The user's last socket on this process is gone.
+        """
+        self._offline_at[user_id] = time.monotonic() + self.offline_grace
+        for key in [key for key in self._typing if key[1] == user_id]:
+            self._stop_typing(key)
+
+    def typing(self, user_id: int, chat_id: str, is_typing: bool = True):
+        key = (chat_id, user_id)
+        if not is_typing:
+            if key in self._typing:
+                self._stop_typing(key)
+            return
+        if key in self._typing:
+            self.coalesced += 1
+        else:
+            self._set_typing(key, True, announce=True)
+        self._typing[key] = time.monotonic() + self.typing_timeout
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self._local or bool(self._remote.get(user_id))
+
+    def snapshot(self, chat_id: str, user_ids, viewer_id: int) -> Optional[dict]:
+        """
+        The current frame for a socket that just subscribed to the chat of `user_ids`.
+        """
+        peers = [user_id for user_id in user_ids if user_id != viewer_id]
+        if not peers:
+            return None
+        typing = [
+            {"chat_id": chat_id, "user_id": user_id, "typing": True}
+            for user_id in peers
+            if (chat_id, user_id) in self._typing or (chat_id, user_id) in self._remote_typing
+        ]
+        return {
+            "action": "presence",
+            "presence": [{"user_id": user_id, "online": self.is_online(user_id)} for user_id in peers],
+            "typing": typing,
+        }
+
+    def apply_remote(self, event: dict):
+        node = event["node"]
+        self._nodes[node] = time.monotonic()
+        for user_id in event.get("online", ()):
+            self._remote.setdefault(user_id, set()).add(node)
+            self._changed_users.add(user_id)
+        for user_id in event.get("offline", ()):
+            self._remove_remote(user_id, node)
+        for chat_id, user_id, is_typing in event.get("typing", ()):
+            key = (chat_id, user_id)
+            if is_typing:
+                self._remote_typing[key] = node
+            else:
+                self._remote_typing.pop(key, None)
+            self._set_typing(key, is_typing)
+
+    def stats(self) -> dict:
+        return {
+            "online": len(self._online),
+            "typing": len(self._typing) + len(self._remote_typing),
+            "nodes": len(self._nodes),
+            "frames": self.frames,
+            "coalesced": self.coalesced,
+        }
+
+    def _set_typing(self, key: TypingKey, is_typing: bool, announce: bool = False):
+        if key in self._changed_typing and self._changed_typing[key] != is_typing:
+            # Started and stopped within one tick: nothing to tell
+            del self._changed_typing[key]
+            self.coalesced += 1
+        else:
+            self._changed_typing[key] = is_typing
+        if announce:
+            self._announce_typing[key] = is_typing
+
+    def _stop_typing(self, key: TypingKey):
+        del self._typing[key]
+        self._set_typing(key, False, announce=True)
+
+    def _remove_remote(self, user_id: int, node: str):
+        nodes = self._remote.get(user_id)
+        if nodes is None:
+            return
+        nodes.discard(node)
+        if not nodes:
+            del self._remote[user_id]
+        self._changed_users.add(user_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self._expire(time.monotonic())
+                self._send()
+                await self._announce()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Presence tick failed")
+
+    def _expire(self, now: float):
+        for user_id, deadline in list(self._offline_at.items()):
+            if deadline > now:
+                continue
+            del self._offline_at[user_id]
+            if user_id not in self.manager.user_connections:
+                self._local.discard(user_id)
+                self._changed_users.add(user_id)
+                self._announce_users[user_id] = False
+
+        for key, expiry in list(self._typing.items()):
+            if expiry <= now:
+                self._stop_typing(key)
+
+        for node, heard in list(self._nodes.items()):
+            if now - heard <= self.node_timeout:
+                continue
+            logger.warning("No presence from node %s for %.0f s, taking its users offline", node, now - heard)
+            del self._nodes[node]
+            for user_id in [user_id for user_id, nodes in self._remote.items() if node in nodes]:
+                self._remove_remote(user_id, node)
+            for key in [key for key, owner in self._remote_typing.items() if owner == node]:
+                del self._remote_typing[key]
+                self._set_typing(key, False)
+
+    def _send(self):
+        frames: Dict[object, dict] = {}
+
+        def frame_for(connection) -> dict:
+            frame = frames.get(connection)
+            if frame is None:
+                frame = frames[connection] = {"action": "presence", "presence": [], "typing": []}
+            return frame
+
+        for user_id in self._changed_users:
+            online = self.is_online(user_id)
+            if online == (user_id in self._online):
+                self.coalesced += 1
+                continue
+            if online:
+                self._online.add(user_id)
+            else:
+                self._online.discard(user_id)
+            entry = {"user_id": user_id, "online": online}
+            for connection in self.manager.watchers(user_id):
+                frame_for(connection)["presence"].append(entry)
+
+        for (chat_id, user_id), is_typing in self._changed_typing.items():
+            entry = {"chat_id": chat_id, "user_id": user_id, "typing": is_typing}
+            for connection in self.manager.chat_targets(chat_id, exclude_user_id=user_id):
+                frame_for(connection)["typing"].append(entry)
+
+        self._changed_users.clear()
+        self._changed_typing.clear()
+        for connection, frame in frames.items():
+            connection.enqueue(frame)
+        self.frames += len(frames)
+
+    async def _announce(self):
+        now = time.monotonic()
+        if now >= self._next_republish:
+            # On its own timer: a busy process announces every tick and never needs a beacon
+            self._next_republish = now + self.beacon_interval
+            for user_id in self._local:
+                self._announce_users.setdefault(user_id, True)
+        if not self._announce_users and not self._announce_typing and now - self._last_beacon < self.beacon_interval:
+            return
+        entries: List[tuple] = [("user", user_id, online) for user_id, online in self._announce_users.items()]
+        entries += [("typing", key, is_typing) for key, is_typing in self._announce_typing.items()]
+        self._announce_users.clear()
+        self._announce_typing.clear()
+        self._last_beacon = now
+
+        node = self.manager.broker.node_id
+        # An empty event is the beacon
+        for start in range(0, max(len(entries), 1), MAX_EVENT_ENTRIES):
+            chunk = entries[start:start + MAX_EVENT_ENTRIES]
+            await self.manager.broker.publish({
+                "kind": PRESENCE_EVENT,
+                "node": node,
+                "online": [user_id for kind, user_id, online in chunk if kind == "user" and online],
+                "offline": [user_id for kind, user_id, online in chunk if kind == "user" and not online],
+                "typing": [[key[0], key[1], is_typing] for kind, key, is_typing in chunk if kind == "typing"],
+            })
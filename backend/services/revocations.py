@@ -0,0 +1,55 @@
+"""
+Token revocations shared by every worker. A logout is stored in revoked_tokens and
+announced through the broker; each worker keeps the revocations in memory
+(core.auth) so verifying a token stays a dict lookup.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from core import AsyncSessionLocal
+from core.auth import mark_revoked, prune_revoked
+from core.config import TOKEN_REVOCATION_SYNC_INTERVAL
+from models import RevokedToken
+
+logger = logging.getLogger(__name__)
+
+async def store_revocation(db: AsyncSession, digest: bytes, expires_at: float):
+    await db.execute(
+        insert(RevokedToken)
+        .values(digest=digest, expires_at=datetime.fromtimestamp(expires_at, timezone.utc))
+        .on_conflict_do_nothing()
+    )
+    await db.commit()
+
+async def sync_revocations() -> int:
+    """
+    Deletes expired revocations and loads the others into this process.
+    Returns how many are in effect.
+    """
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= func.now()))
+        result = await db.execute(select(RevokedToken.digest, RevokedToken.expires_at))
+        rows = result.all()
+        await db.commit()
+    prune_revoked()
+    for digest, expires_at in rows:
+        mark_revoked(digest, expires_at.timestamp())
+    return len(rows)
+
+async def maintain_revocations(interval: float = TOKEN_REVOCATION_SYNC_INTERVAL):
+    """
+    Keeps this process's revocations in line with the table, including any whose
+    announcement it missed. Started from the lifespan.
+    """
+    while True:
+        try:
+            await sync_revocations()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to sync token revocations")
+        await asyncio.sleep(interval)
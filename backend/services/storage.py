@@ -0,0 +1,65 @@
+import hashlib
+import os
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+import anyio
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class LocalBlobStore:
+    """
+    Content-addressed files on the local filesystem: a blob lives at
+    <root>/<sha[:2]>/<sha[2:4]>/<sha>, so identical uploads share one file.
+    Files derived from a blob (e.g. thumbnails) sit next to it as <sha>.<suffix>.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, "tmp")
+
+    def relative_path(self, sha256: str, suffix: Optional[str] = None) -> str:
+        name = f"{sha256}.{suffix}" if suffix else sha256
+        return os.path.join(sha256[:2], sha256[2:4], name)
+
+    def path_for(self, sha256: str, suffix: Optional[str] = None) -> str:
+        return os.path.join(self.root, self.relative_path(sha256, suffix))
+
+    def exists(self, sha256: str, suffix: Optional[str] = None) -> bool:
+        return os.path.isfile(self.path_for(sha256, suffix))
+
+    async def save_stream(self, chunks: AsyncIterator[bytes], max_size: int) -> Tuple[str, int]:
+        """
+        Writes the stream chunk by chunk while hashing it, never holding more than one chunk
+        in memory. Returns (sha256, size). Raises BlobTooLarge past `max_size` bytes.
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with await anyio.open_file(tmp_path, "wb") as tmp:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if size > max_size:
+                        raise BlobTooLarge(f"Upload exceeds {max_size} bytes")
+                    digest.update(chunk)
+                    await tmp.write(chunk)
+
+            sha256 = digest.hexdigest()
+            final_path = self.path_for(sha256)
+            if os.path.exists(final_path):
+                # Same content already stored
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return sha256, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
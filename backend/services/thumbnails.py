@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from sqlalchemy import update
+from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
+from models import Attachment
+from . import blurhash
+from .storage import LocalBlobStore
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+    # Retrying cannot fix the file itself
+    PERMANENT_ERRORS: tuple = (UnidentifiedImageError, Image.DecompressionBombError)
+except ImportError:  # Pillow is optional, without it images simply get no previews
+    Image = None
+    PERMANENT_ERRORS = ()
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SUFFIX = "thumb.webp"
+THUMBNAIL_CONTENT_TYPE = "image/webp"
+PREVIEW_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp"}
+
+# Placeholders are computed from a tiny copy of the image, the result looks the same
+PLACEHOLDER_SAMPLE = 32
+
+
+def render_previews(source_path: str, thumbnail_path: str, size: int) -> str:
+    """
+    Writes a WebP thumbnail that fits in size x size next to the original and
+    returns the image's blurhash placeholder. Runs in a worker process.
+    """
+    with Image.open(source_path) as image:
+        # Lets JPEG decode at a reduced scale instead of full resolution
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size))
+        tmp_path = f"{thumbnail_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            thumbnail.save(tmp_path, "WEBP", quality=80)
+            os.replace(tmp_path, thumbnail_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        sample = thumbnail.convert("RGB")
+        sample.thumbnail((PLACEHOLDER_SAMPLE, PLACEHOLDER_SAMPLE))
+        return blurhash.encode(list(sample.getdata()), sample.width, sample.height)
+
+
+class ThumbnailQueue:
+    """
+    Background generation of image previews. Uploads enqueue a job and return at once;
+    `workers` coroutines take jobs off a bounded queue and hand the decoding and resizing
+    to a process pool of the same size, so at most `workers` images are processed at a
+    time and none of it runs on the API's event loop.
+
+    A failed job is retried up to `max_retries` times with exponential backoff. When the
+    queue is full the job is dropped and the attachment keeps no preview: previews are an
+    optimisation, an upload never waits for one.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        store: LocalBlobStore,
+        size: int = 320,
+        workers: int = 2,
+        max_queue: int = 1000,
+        max_retries: int = 3,
+        retry_delay: float = 1.0
+    ):
+        self.session_factory = session_factory
+        self.store = store
+        self.size = size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._retry_handles = set()
+
+        self.in_progress = 0
+        self.generated = 0
+        self.reused = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def accepts(self, content_type: Optional[str]) -> bool:
+        return self.enabled and content_type in PREVIEW_TYPES
+
+    def start(self):
+        if not self.enabled:
+            logger.warning("Pillow is not installed, image previews are disabled")
+            return
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Abandons pending jobs: their attachments stay without previews.
+        """
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, attachment_id: int, sha256: str) -> bool:
+        """
+        Queues previews for an attachment, returns False when they will not be generated.
+        """
+        if not self._tasks:
+            return False
+        return self._put((attachment_id, sha256, 0))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "backlog": self._queue.qsize(),
+            "in_progress": self.in_progress,
+            "generated": self.generated,
+            "reused": self.reused,
+            "retried": self.retried,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def _put(self, job: Tuple[int, str, int]) -> bool:
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning("Thumbnail queue full, no preview for attachment %s", job[0])
+            return False
+        return True
+
+    def _retry(self, job: Tuple[int, str, int]):
+        attachment_id, sha256, attempt = job
+        delay = self.retry_delay * 2 ** attempt
+
+        def put():
+            self._retry_handles.discard(handle)
+            self._put((attachment_id, sha256, attempt + 1))
+
+        handle = asyncio.get_running_loop().call_later(delay, put)
+        self._retry_handles.add(handle)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self.in_progress += 1
+            try:
+                await self._process(*job[:2])
+            except asyncio.CancelledError:
+                raise
+            except PERMANENT_ERRORS:
+                self.failed += 1
+                logger.warning("Attachment %s is not a readable image, no preview", job[0])
+            except Exception:
+                if job[2] < self.max_retries:
+                    self.retried += 1
+                    logger.warning("Preview of attachment %s failed, retrying", job[0], exc_info=True)
+                    self._retry(job)
+                else:
+                    self.failed += 1
+                    logger.exception("Preview of attachment %s failed for good", job[0])
+            finally:
+                self.in_progress -= 1
+                self._queue.task_done()
+
+    async def _process(self, attachment_id: int, sha256: str):
+        async with self.session_factory() as db:
+            # Identical content uploaded earlier already has its thumbnail next to the blob
+            result = await db.execute(
+                select(Attachment.placeholder)
+                .where(Attachment.sha256 == sha256, Attachment.placeholder.is_not(None))
+                .limit(1)
+            )
+            placeholder = result.scalar()
+            if placeholder is not None and self.store.exists(sha256, THUMBNAIL_SUFFIX):
+                self.reused += 1
+            else:
+                placeholder = await asyncio.get_running_loop().run_in_executor(
+                    self._executor,
+                    render_previews,
+                    self.store.path_for(sha256),
+                    self.store.path_for(sha256, THUMBNAIL_SUFFIX),
+                    self.size
+                )
+                self.generated += 1
+
+            await db.execute(
+                update(Attachment)
+                .where(Attachment.id == attachment_id)
+                .values(thumbnail_url=f"/attachments/{attachment_id}/thumbnail", placeholder=placeholder)
+            )
+            await db.commit()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The application modules are imported from backend/, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "test-secret")
@@ -0,0 +1,102 @@
+"""
+Editing a message over REST: only its sender may do it, and only its text changes.
+The database is replaced by the stored message the handlers look up.
+Also who may read a conversation's history and the list of all messages.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import services.messages as message_service
+from core import create_access_token, get_db
+from main import app
+
+SENDER_ID = 1
+RECIPIENT_ID = 2
+OTHER_ID = 3
+
+
+def headers(user_id: int) -> dict:
+    return {"Authorization": "Bearer " + create_access_token({"sub": f"user{user_id}", "uid": user_id})}
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """
+    The direct message 10 from SENDER_ID to RECIPIENT_ID, and the calls made to update it.
+    """
+    message = SimpleNamespace(
+        id=10, text="hello", sender_id=SENDER_ID, recipient_id=RECIPIENT_ID, group_id=None,
+        timestamp=datetime(2026, 1, 1), attachments=[]
+    )
+    updates = []
+
+    async def get_message(db, message_id, with_attachments=False):
+        return message if message_id == message.id else None
+
+    async def update_message(db, msg, text):
+        updates.append(text)
+        msg.text = text
+        return msg
+
+    async def no_db():
+        yield None
+
+    monkeypatch.setattr(message_service, "get_message", get_message)
+    monkeypatch.setattr(message_service, "update_message", update_message)
+    app.dependency_overrides[get_db] = no_db
+    yield SimpleNamespace(message=message, updates=updates)
+    app.dependency_overrides.pop(get_db, None)
+
+
+def put(user_id: int, body: dict):
+    # Without the lifespan: no broker, partition or revocation tasks reaching for a database
+    return TestClient(app).put("/messages/update/10", json=body, headers=headers(user_id))
+
+
+def test_sender_edits_the_text(stored):
+    response = put(SENDER_ID, {"text": "edited", "sender_id": SENDER_ID, "recipient_id": RECIPIENT_ID})
+    assert response.status_code == 200
+    assert stored.updates == ["edited"]
+    assert (stored.message.sender_id, stored.message.recipient_id) == (SENDER_ID, RECIPIENT_ID)
+
+
+def test_reattribution_is_refused(stored):
+    response = put(SENDER_ID, {"text": "edited", "sender_id": OTHER_ID, "recipient_id": RECIPIENT_ID})
+    assert response.status_code == 403
+    assert stored.updates == []
+    assert stored.message.sender_id == SENDER_ID
+
+
+def test_moving_to_another_chat_is_refused(stored):
+    response = put(SENDER_ID, {"text": "edited", "sender_id": SENDER_ID, "recipient_id": OTHER_ID})
+    assert response.status_code == 403
+    assert stored.updates == []
+    assert stored.message.recipient_id == RECIPIENT_ID
+
+
+def test_group_message_ignores_all_but_the_text(stored):
+    stored.message.recipient_id = None
+    stored.message.group_id = 7
+    response = put(SENDER_ID, {"text": "edited", "sender_id": OTHER_ID, "recipient_id": OTHER_ID})
+    assert response.status_code == 200
+    assert stored.updates == ["edited"]
+    assert (stored.message.sender_id, stored.message.recipient_id, stored.message.group_id) == (SENDER_ID, None, 7)
+
+
+def test_only_the_sender_may_edit(stored):
+    response = put(RECIPIENT_ID, {"text": "edited", "sender_id": RECIPIENT_ID, "recipient_id": RECIPIENT_ID})
+    assert response.status_code == 403
+    assert stored.updates == []
+
+
+def test_history_is_refused_to_others():
+    response = TestClient(app).get(f"/messages/{SENDER_ID}/{RECIPIENT_ID}", headers=headers(OTHER_ID))
+    assert response.status_code == 403
+
+
+def test_listing_all_messages_is_admin_only():
+    response = TestClient(app).get("/messages/", headers=headers(OTHER_ID))
+    assert response.status_code == 403
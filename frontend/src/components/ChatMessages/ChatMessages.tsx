@@ -30,10 +30,15 @@ export default function ChatMessages({
     message: Message | null;
   }>({ x: 0, y: 0, message: null });
   const [editingMessage, setEditingMessage] = useState<Message | null>(null);
+  const [peerOnline, setPeerOnline] = useState(false);
+  const [peerTyping, setPeerTyping] = useState(false);
+  const lastTypingSent = useRef(0);
 
   useEffect(() => {
     if (!selectedUser) return;
 
+    setPeerOnline(false);
+    setPeerTyping(false);
     ws.current = new WebSocket(
       `ws://localhost:8000/ws/chat/${currentUserId}/${
         selectedUser.id
@@ -61,6 +66,18 @@ export default function ChatMessages({
             prev.filter((msg) => msg.id !== data.message.id)
           );
           break;
+        case "presence":
+          for (const entry of data.presence) {
+            if (entry.user_id === selectedUser.id) setPeerOnline(entry.online);
+          }
+          for (const entry of data.typing) {
+            if (entry.user_id === selectedUser.id) setPeerTyping(entry.typing);
+          }
+          break;
+        case "ping":
+          // Unanswered pings get the socket closed by the server
+          ws.current?.send(JSON.stringify({ action: "pong" }));
+          break;
       }
     };
 
@@ -101,6 +118,17 @@ export default function ChatMessages({
     }
   };
 
+  const handleTyping = (value: string) => {
+    setText(value);
+    // The server keeps typing on for a few seconds, a refresh every 3 s is enough
+    const now = Date.now();
+    if (!value || now - lastTypingSent.current < 3000) return;
+    if (ws.current && ws.current.readyState === WebSocket.OPEN) {
+      ws.current.send(JSON.stringify({ action: "typing", typing: true }));
+      lastTypingSent.current = now;
+    }
+  };
+
   const handleSend = () => {
     if (!text.trim()) return;
 
@@ -119,6 +147,7 @@ export default function ChatMessages({
     }
 
     setText("");
+    lastTypingSent.current = 0;
   };
 
   const handleDelete = () => {
@@ -152,6 +181,9 @@ export default function ChatMessages({
       <div className="bg-gray-800 text-white p-3 font-semibold flex items-center gap-5">
         <FaArrowLeft onClick={onBack} className="hover:cursor-pointer" />
         <span>{selectedUser.username}</span>
+        <span className="text-xs font-normal text-gray-400">
+          {peerTyping ? "typing..." : peerOnline ? "online" : "offline"}
+        </span>
       </div>
 
       <div className="flex-1 p-2 overflow-y-auto flex flex-col gap-2">
@@ -252,7 +284,7 @@ export default function ChatMessages({
             type="text"
             placeholder="Type a message..."
             value={text}
-            onChange={(e) => setText(e.target.value)}
+            onChange={(e) => handleTyping(e.target.value)}
             className="flex-1 px-3 py-2 rounded bg-gray-800 text-white focus:outline-none"
             onKeyDown={(e) => {
               if (e.key === "Enter") handleSend();
@@ -2,7 +2,7 @@
 import { useState, useEffect, useCallback, useMemo } from "react";
 import { useNavigate } from "react-router-dom";
 import type { User } from "../../types/User";
-import type { Message } from "../../types/Message";
+import type { Message, MessagePage } from "../../types/Message";
 import ChatSidebar from "../../components/ChatSideBar";
 import FileDropZone from "../../components/FileDropZone";
 import ChatMessages from "../../components/ChatMessages";
@@ -117,8 +117,8 @@ export default function Homepage() {
         return;
       }
 
-      const data: Message[] = await res.json();
-      setMessages(data);
+      const data: MessagePage = await res.json();
+      setMessages(data.items);
     } catch (err) {
       console.error("Fetch error:", err);
       setMessages([]);
@@ -5,4 +5,6 @@ export interface Attachment {
   size: number;
   uploaded_at: string;
   content_type: string;
+  thumbnail_url: string | null;
+  placeholder: string | null;
 }
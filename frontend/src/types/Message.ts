@@ -7,3 +7,8 @@ export interface Message {
   recipient_id: number;
   attachments: Attachment[];
 }
+
+export interface MessagePage {
+  items: Message[];
+  next_cursor: string | null;
+}